@@ -0,0 +1,124 @@
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from evaltools.columnar import iter_results
+from evaltools.eval.evaluate import run_evaluation
+from evaltools.eval.evaluate_metrics import metrics_by_name
+
+from .mock_services import MockChatApp, MockJudge
+
+# Metrics that exercise both the GPT judge and the local code metrics
+DEFAULT_BENCH_METRICS = ["myrelevance", "mycoherence", "mygroundedness", "answer_length", "has_citation", "latency"]
+
+
+def get_peak_rss_mb() -> float | None:
+    """Return the peak resident memory of this process in MB, or None where it can't be measured (like Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def get_latency_percentiles(seconds: list[float]) -> dict:
+    """Return the 50th and 99th percentiles of the latencies, in seconds."""
+    if not seconds:
+        return {"p50": None, "p99": None}
+    p50, p99 = np.percentile(np.asarray(seconds, dtype=float), [50, 99])
+    return {"p50": round(float(p50), 4), "p99": round(float(p99), 4)}
+
+
+def time_evaluator_setup(requested_metrics: list[str] | None = None, num_runs: int = 20) -> dict:
+    """Return the mean milliseconds that it takes to construct the evaluator of each metric. Before evaluators
+    were reused for every row, each row paid this cost once per metric. No requests are sent to a GPT model."""
+    openai_config = {"azure_endpoint": "http://127.0.0.1:9", "azure_deployment": "bench", "api_key": "bench"}
+    setup_ms = {}
+    for metric_name in requested_metrics or list(metrics_by_name):
+        metric = metrics_by_name[metric_name]
+        start = time.perf_counter()
+        for _ in range(num_runs):
+            metric.evaluator_fn(openai_config=openai_config)
+        setup_ms[metric_name] = round((time.perf_counter() - start) * 1000 / num_runs, 2)
+    return setup_ms
+
+
+def write_bench_testdata(path: Path, num_questions: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for ind in range(num_questions):
+            row = {"question": f"What is benchmark question {ind}?", "truth": f"The answer to {ind} [info1.txt]"}
+            f.write(json.dumps(row) + "\n")
+
+
+def run_benchmark(
+    num_questions: int = 100,
+    max_concurrency: int = 8,
+    target_latency: str = "lognormal:200:0.5",
+    judge_latency: str = "lognormal:500:0.5",
+    target_throttle_rate: float = 0.0,
+    judge_throttle_rate: float = 0.0,
+    judge_batch_size: int = 1,
+    requested_metrics: list[str] | None = None,
+    results_dir: Path | None = None,
+    seed: int = 0,
+) -> dict:
+    """Evaluate synthetic questions against local stand-ins for the chat app and the GPT judge,
+    and return the throughput, per-stage latencies and peak memory of the evaluation."""
+    requested_metrics = requested_metrics or DEFAULT_BENCH_METRICS
+    with tempfile.TemporaryDirectory() as temp_dir:
+        testdata_path = Path(temp_dir) / "bench_testdata.jsonl"
+        write_bench_testdata(testdata_path, num_questions)
+        results_dir = Path(results_dir or Path(temp_dir) / "results")
+        target = MockChatApp(target_latency, throttle_rate=target_throttle_rate, seed=seed)
+        judge = MockJudge(judge_latency, throttle_rate=judge_throttle_rate, seed=seed + 1)
+        with target, judge:
+            start = time.perf_counter()
+            succeeded = run_evaluation(
+                openai_config={"azure_endpoint": judge.url, "azure_deployment": "bench", "api_key": "bench"},
+                testdata_path=testdata_path,
+                results_dir=results_dir,
+                target_url=f"{target.url}/chat",
+                target_response_answer_jmespath="message.content",
+                target_response_context_jmespath="context.data_points.text",
+                requested_metrics=requested_metrics,
+                model="bench",
+                max_concurrency=max_concurrency,
+                judge_batch_size=judge_batch_size,
+            )
+            elapsed = time.perf_counter() - start
+            target_stats = target.stats()
+            judge_stats = judge.stats()
+        if not succeeded:
+            raise RuntimeError("The benchmark evaluation failed, see the logs for details")
+        # The latency column is measured by the evaluation itself, so it includes the time spent on the network
+        target_latencies = [row["latency"] for row in iter_results(results_dir) if row.get("latency") is not None]
+
+    return {
+        "num_questions": num_questions,
+        "max_concurrency": max_concurrency,
+        "judge_batch_size": judge_batch_size,
+        "metrics": requested_metrics,
+        "target_latency": target_latency,
+        "judge_latency": judge_latency,
+        "elapsed_seconds": round(elapsed, 3),
+        "questions_per_second": round(num_questions / elapsed, 2),
+        "judge_calls_per_second": round(judge_stats["calls"] / elapsed, 2),
+        "target": {
+            "calls": target_stats["calls"],
+            "throttled": target_stats["throttled"],
+            "latency_seconds": get_latency_percentiles(target_latencies),
+        },
+        "judge": {
+            "calls": judge_stats["calls"],
+            "throttled": judge_stats["throttled"],
+            # Measured by the mock judge, since the judge calls are made inside the evaluators
+            "latency_seconds": get_latency_percentiles(judge_stats["durations"]),
+        },
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
@@ -0,0 +1,157 @@
+"""Local stand-ins for the chat app and the GPT judge, used to benchmark the evaluation without calling real services.
+Both respond after a configurable latency, and can respond with 429s to exercise the rate limiters."""
+
+import json
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Distributions that the latency of a mock service can follow, with their parameters in milliseconds
+LATENCY_DISTRIBUTIONS = {
+    "fixed": ["ms"],
+    "uniform": ["min_ms", "max_ms"],
+    "exponential": ["mean_ms"],
+    "lognormal": ["median_ms", "sigma"],
+}
+
+
+class LatencyDistribution:
+    """A latency distribution parsed from a spec like "fixed:50", "uniform:20:80", "exponential:50"
+    or "lognormal:50:0.5" (median of 50 ms, with a sigma of 0.5 for the underlying normal distribution)."""
+
+    def __init__(self, spec: str):
+        name, *params = spec.split(":")
+        if name not in LATENCY_DISTRIBUTIONS or len(params) != len(LATENCY_DISTRIBUTIONS[name]):
+            expected = ", ".join(
+                ":".join([distribution, *param_names]) for distribution, param_names in LATENCY_DISTRIBUTIONS.items()
+            )
+            raise ValueError(f"Latency should be one of {expected}, got {spec}")
+        self.spec = spec
+        self.name = name
+        self.params = [float(param) for param in params]
+
+    def sample_seconds(self, rng: random.Random) -> float:
+        if self.name == "fixed":
+            ms = self.params[0]
+        elif self.name == "uniform":
+            ms = rng.uniform(*self.params)
+        elif self.name == "exponential":
+            ms = rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0
+        else:
+            median_ms, sigma = self.params
+            ms = rng.lognormvariate(0, sigma) * median_ms
+        return ms / 1000
+
+
+class MockService(ABC):
+    """An HTTP server on a free local port that answers each POST after a sampled latency,
+    or with a 429 (Too Many Requests) at the given rate."""
+
+    def __init__(self, latency: str = "fixed:0", throttle_rate: float = 0.0, retry_after_ms: int = 100, seed=0):
+        self.latency = LatencyDistribution(latency)
+        self.throttle_rate = throttle_rate
+        self.retry_after_ms = retry_after_ms
+        self.calls = 0
+        self.throttled = 0
+        self.durations = []
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @abstractmethod
+    def respond(self, path: str, body: dict) -> dict:
+        pass
+
+    def _make_handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                start = time.perf_counter()
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with service._lock:
+                    service.calls += 1
+                    throttled = service._rng.random() < service.throttle_rate
+                    delay = service.latency.sample_seconds(service._rng)
+                if throttled:
+                    with service._lock:
+                        service.throttled += 1
+                    self._send(429, {"error": {"code": "429", "message": "Rate limit exceeded"}})
+                    return
+                time.sleep(delay)
+                self._send(200, service.respond(self.path, body))
+                with service._lock:
+                    service.durations.append(time.perf_counter() - start)
+
+            def _send(self, status: int, response: dict):
+                payload = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", str(max(1, round(service.retry_after_ms / 1000))))
+                    self.send_header("retry-after-ms", str(service.retry_after_ms))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "throttled": self.throttled, "durations": list(self.durations)}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MockChatApp(MockService):
+    """Answers questions in the format of the AI Chat Protocol, citing a made-up source."""
+
+    def respond(self, path: str, body: dict) -> dict:
+        question = body["messages"][-1]["content"]
+        return {
+            "message": {"content": f"Here is the answer to: {question} [info1.txt]", "role": "assistant"},
+            "context": {"data_points": {"text": [f"info1.txt: Some facts that help answer {question}"]}},
+        }
+
+
+class MockJudge(MockService):
+    """Answers OpenAI chat completion requests (with any deployment in the path) with made-up 1-5 ratings.
+    Requests for a JSON object get a score for each of the numbered items in the prompt."""
+
+    def respond(self, path: str, body: dict) -> dict:
+        with self._lock:
+            score = self._rng.randint(1, 5)
+        if body.get("response_format", {}).get("type") == "json_object":
+            num_items = len(re.findall(r"^### Item \d+", body["messages"][-1]["content"], flags=re.MULTILINE))
+            content = json.dumps({"scores": [{"id": ind, "score": score} for ind in range(1, num_items + 1)]})
+        else:
+            content = str(score)
+        return {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "bench"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 1, "total_tokens": 101},
+        }
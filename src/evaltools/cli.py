@@ -1,4 +1,6 @@
+import json
 import logging
+import sys
 from pathlib import Path
 
 import dotenv
@@ -6,8 +8,12 @@ import typer
 from rich.logging import RichHandler
 
 from evaltools import service_setup
+from evaltools.bench.benchmark import run_benchmark, time_evaluator_setup
 from evaltools.eval.evaluate import run_evaluate_from_config
+from evaltools.eval.merge import merge_results
 from evaltools.gen.generate import generate_dontknows_qa_data, generate_test_qa_data_for_search_index
+from evaltools.gen.search_retriever import JsonlSearchClient
+from evaltools.review import compare as compare_runs
 from evaltools.review import diff_app, diff_markdown, summary_app, summary_markdown
 
 app = typer.Typer(pretty_exceptions_enable=False)
@@ -35,20 +41,43 @@ def path_or_none(raw: str) -> Path | None:
     return None if raw == "None" else Path(raw)
 
 
+def shard_or_none(raw: str) -> tuple[int, int] | None:
+    """Parse a shard like "2/8" into its (1-based) index and the number of shards."""
+    if raw == "None":
+        return None
+    try:
+        index, count = (int(part) for part in raw.split("/"))
+    except ValueError:
+        raise typer.BadParameter(f"Expected a shard like 2/8, got {raw}")
+    if not 1 <= index <= count:
+        raise typer.BadParameter(f"Shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+
 @app.command()
 def generate(
     output: Path = typer.Option(exists=False, dir_okay=False, file_okay=True),
     numquestions: int = typer.Option(help="Number of questions to generate", default=200),
     persource: int = typer.Option(help="Number of questions to generate per source", default=5),
     citationfieldname: str = typer.Option(help="Name of citiation field in ai search index", default="sourcepage"),
+    maxconcurrency: int = typer.Option(help="Number of sources to generate questions for in parallel", default=1),
+    maxpercitation: int | None = typer.Option(
+        help="Maximum number of search documents to use from each citation (source)", default=None, parser=int_or_none
+    ),
+    searchdata: Path | None = typer.Option(
+        help="JSONL file of documents to use instead of the search index", default=None, parser=path_or_none
+    ),
 ):
+    search_client = JsonlSearchClient(Path.cwd() / searchdata) if searchdata else service_setup.get_search_client()
     generate_test_qa_data_for_search_index(
         openai_config=service_setup.get_openai_config_dict(),
-        search_client=service_setup.get_search_client(),
+        search_client=search_client,
         num_questions_total=numquestions,
         num_questions_per_source=persource,
         output_file=Path.cwd() / output,
         citation_field_name=citationfieldname,
+        max_concurrency=maxconcurrency,
+        max_per_citation=maxpercitation,
     )
 
 
@@ -57,12 +86,16 @@ def generate_dontknows(
     input: Path = typer.Option(exists=True, dir_okay=False, file_okay=True),
     output: Path = typer.Option(exists=False, dir_okay=False, file_okay=True),
     numquestions: int = typer.Option(help="Number of questions to generate", default=40),
+    contexttokens: int = typer.Option(
+        help="Approximate number of tokens of existing questions to include in each prompt", default=2000
+    ),
 ):
     generate_dontknows_qa_data(
         openai_config=service_setup.get_openai_config(),
         num_questions_total=numquestions,
         input_file=Path.cwd() / input,
         output_file=Path.cwd() / output,
+        max_context_tokens=contexttokens,
     )
 
 
@@ -82,8 +115,67 @@ def evaluate(
     resultsdir: Path = typer.Option(
         help="Directory to save the results of the evaluation", default=None, parser=path_or_none
     ),
+    maxconcurrency: int | None = typer.Option(
+        help="Number of questions to evaluate in parallel (defaults to max_concurrency in the config, or 1).",
+        default=None,
+        parser=int_or_none,
+    ),
+    targetconcurrency: int | None = typer.Option(
+        help="Number of questions to send to the target in parallel (defaults to maxconcurrency).",
+        default=None,
+        parser=int_or_none,
+    ),
+    judgeconcurrency: int | None = typer.Option(
+        help="Number of GPT metric calls to make in parallel (defaults to maxconcurrency).",
+        default=None,
+        parser=int_or_none,
+    ),
+    resume: bool = typer.Option(
+        help="Resume an interrupted evaluation, skipping the questions that were already evaluated.", default=False
+    ),
+    replay: Path | None = typer.Option(
+        help="Results directory of a previous run whose answers should be re-scored instead of calling the target.",
+        default=None,
+        parser=path_or_none,
+    ),
+    shard: str | None = typer.Option(
+        help="Evaluate only one shard of the test data, like 2/8 for the second of eight shards.",
+        default=None,
+        parser=shard_or_none,
+    ),
+    baseline: Path | None = typer.Option(
+        help="Results directory of a baseline run to compare to as the evaluation runs, stopping once the "
+        "difference is decisive.",
+        default=None,
+        parser=path_or_none,
+    ),
+):
+    run_evaluate_from_config(
+        Path.cwd(),
+        config,
+        numquestions,
+        targeturl,
+        resultsdir,
+        max_concurrency=maxconcurrency,
+        resume=resume,
+        replay_dir=replay,
+        target_concurrency=targetconcurrency,
+        judge_concurrency=judgeconcurrency,
+        shard=shard,
+        baseline_dir=baseline,
+    )
+
+
+@app.command()
+def merge(
+    shard_dirs: list[Path] = typer.Argument(exists=True, dir_okay=True, file_okay=False),
+    output: Path = typer.Option(help="Directory to save the merged results", dir_okay=True, file_okay=False),
+    allowpartial: bool = typer.Option(
+        help="Merge the results even if some shards are missing or didn't finish.", default=False
+    ),
 ):
-    run_evaluate_from_config(Path.cwd(), config, numquestions, targeturl, resultsdir)
+    if not merge_results(shard_dirs, Path.cwd() / output, allow_partial=allowpartial):
+        raise typer.Exit(code=1)
 
 
 def str_or_none(value: str) -> str | None:
@@ -92,20 +184,49 @@ def str_or_none(value: str) -> str | None:
 
 @app.command()
 def diff(
-    directory1: Path = typer.Argument(exists=True, dir_okay=True, file_okay=False),
-    directory2: Path = typer.Argument(default=None, exists=True, dir_okay=True, file_okay=False),
+    directories: list[Path] = typer.Argument(exists=True, dir_okay=True, file_okay=False),
     changed: str | None = typer.Option(
         help="Show only questions whose values changed for the given column", default=None, parser=str_or_none
     ),
     output: str | None = typer.Option(help="Output type, can be 'app' or 'markdown'", default=None, parser=str_or_none),
+    outputfile: Path | None = typer.Option(
+        help="File to write the markdown to (defaults to printing it)", default=None, parser=path_or_none
+    ),
+    limit: int | None = typer.Option(
+        help="Show at most this many questions in the markdown", default=None, parser=int_or_none
+    ),
+    sortbydelta: str | None = typer.Option(
+        help="Show the questions whose value changed most for the given numeric column first in the markdown",
+        default=None,
+        parser=str_or_none,
+    ),
 ):
-    directories = [directory1] if directory2 is None else [directory1, directory2]
     if output == "markdown":
-        print(diff_markdown.main(directories, changed))
+        markdown_options = {"changed": changed, "limit": limit, "sort_by_delta": sortbydelta}
+        if outputfile:
+            with open(outputfile, "w", encoding="utf-8") as f:
+                diff_markdown.write_markdown(directories, f, **markdown_options)
+        else:
+            diff_markdown.write_markdown(directories, sys.stdout, **markdown_options)
     else:
         diff_app.main(directories, changed)
 
 
+@app.command()
+def compare(
+    directories: list[Path] = typer.Argument(exists=True, dir_okay=True, file_okay=False),
+    metric: str = typer.Option(help="Metric to compare the runs on, like gpt_groundedness"),
+    rankby: str = typer.Option(
+        help="Rank questions by 'regression' (biggest drop from the first run) or 'variance' (across all runs)",
+        default="regression",
+    ),
+    limit: int | None = typer.Option(help="Show at most this many questions", default=20, parser=int_or_none),
+):
+    if rankby not in compare_runs.RANK_BY_OPTIONS:
+        raise typer.BadParameter(f"Must be one of {compare_runs.RANK_BY_OPTIONS}", param_hint="--rankby")
+    print(compare_runs.main(directories, metric, rank_by=rankby, limit=limit))
+
+
 @app.command()
 def summary(
     results_dir: Path = typer.Argument(exists=True, dir_okay=True, file_okay=False),
@@ -113,11 +234,59 @@ def summary(
     highlight: str | None = typer.Option(
         help="Highlight a specific run in the summary", default=None, parser=str_or_none
     ),
+    filter: list[str] | None = typer.Option(
+        help="Only show runs matching a condition on a metric, like gpt_groundedness.pass_rate>=0.8 (repeatable)",
+        default=None,
+    ),
+    sortby: str | None = typer.Option(
+        help="Sort runs by a metric, like gpt_relevance.mean_rating or latency", default=None, parser=str_or_none
+    ),
+    descending: bool = typer.Option(help="Sort runs in descending order", default=False),
 ):
+    query = {"filters": filter, "sort_by": sortby, "descending": descending}
     if output == "markdown":
-        print(summary_markdown.main(results_dir, highlight_run=highlight))
+        print(summary_markdown.main(results_dir, highlight_run=highlight, **query))
+    else:
+        summary_app.main(results_dir, **query)
+
+
+@app.command()
+def bench(
+    numquestions: int = typer.Option(help="Number of synthetic questions to evaluate", default=100),
+    maxconcurrency: int = typer.Option(help="Number of questions to evaluate in parallel", default=8),
+    targetlatency: str = typer.Option(
+        help="Latency of the mock chat app, like fixed:50, uniform:20:80, exponential:50 or lognormal:200:0.5 (ms)",
+        default="lognormal:200:0.5",
+    ),
+    judgelatency: str = typer.Option(
+        help="Latency of the mock GPT judge, in the same format", default="lognormal:500:0.5"
+    ),
+    target429rate: float = typer.Option(help="Fraction of chat app calls that get a 429 response", default=0.0),
+    judge429rate: float = typer.Option(help="Fraction of GPT judge calls that get a 429 response", default=0.0),
+    judgebatchsize: int = typer.Option(help="Number of rows to score per GPT judge call", default=1),
+    output: Path | None = typer.Option(
+        help="File to save the benchmark report to, as JSON", default=None, parser=path_or_none
+    ),
+    setupruns: int = typer.Option(
+        help="Instead of an evaluation, time constructing each metric's evaluator this many times", default=0
+    ),
+):
+    if setupruns:
+        report = {"num_runs": setupruns, "evaluator_setup_ms": time_evaluator_setup(num_runs=setupruns)}
     else:
-        summary_app.main(results_dir)
+        report = run_benchmark(
+            num_questions=numquestions,
+            max_concurrency=maxconcurrency,
+            target_latency=targetlatency,
+            judge_latency=judgelatency,
+            target_throttle_rate=target429rate,
+            judge_throttle_rate=judge429rate,
+            judge_batch_size=judgebatchsize,
+        )
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(json.dumps(report, indent=4))
+    print(json.dumps(report, indent=4))
 
 
 def cli():
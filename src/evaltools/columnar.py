@@ -0,0 +1,83 @@
+"""Columnar (Parquet) copy of the evaluation results, written next to eval_results.jsonl when pyarrow is installed.
+The review commands read it instead of the JSONL file, loading only the columns they need."""
+
+import json
+import logging
+from collections.abc import Iterable
+from pathlib import Path
+
+from evaltools.jsonl import count_jsonl_rows, iter_jsonl
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger("evaltools")
+
+RESULTS_JSONL_FILENAME = "eval_results.jsonl"
+RESULTS_PARQUET_FILENAME = "eval_results.parquet"
+
+# Schema metadata listing the columns whose values had mixed types (like True/False/-1),
+# which are stored as JSON strings so that they round-trip exactly
+_JSON_COLUMNS_KEY = b"evaltools.json_columns"
+
+
+def write_results_table(rows: list[dict], path: Path) -> bool:
+    """Write the rows to a Parquet file, returning False if pyarrow isn't installed."""
+    path = Path(path)
+    if pa is None:
+        # Don't leave behind a table that no longer matches the JSONL results
+        path.unlink(missing_ok=True)
+        return False
+    column_names = list(dict.fromkeys(key for row in rows for key in row))
+    arrays = []
+    json_columns = []
+    for column_name in column_names:
+        values = [row.get(column_name) for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if value is None else json.dumps(value) for value in values]))
+            json_columns.append(column_name)
+    table = pa.table(arrays, names=column_names, metadata={_JSON_COLUMNS_KEY: json.dumps(json_columns)})
+    pq.write_table(table, path)
+    return True
+
+
+def _get_parquet_path(results_dir: Path) -> Path | None:
+    parquet_path = Path(results_dir) / RESULTS_PARQUET_FILENAME
+    if pq is not None and parquet_path.exists():
+        return parquet_path
+    return None
+
+
+def count_results(results_dir: Path) -> int:
+    """Count the evaluated rows, using the Parquet footer if it's available."""
+    parquet_path = _get_parquet_path(results_dir)
+    if parquet_path:
+        return pq.ParquetFile(parquet_path).metadata.num_rows
+    return count_jsonl_rows(Path(results_dir) / RESULTS_JSONL_FILENAME)
+
+
+def iter_results(results_dir: Path, exclude_columns: Iterable[str] = ()) -> Iterable[dict]:
+    """Yield each evaluated row, leaving out the given columns (like the long context strings).
+    Only the other columns are read from the Parquet file, which is memory-mapped rather than loaded."""
+    parquet_path = _get_parquet_path(results_dir)
+    if parquet_path is None:
+        exclude_columns = set(exclude_columns)
+        for row in iter_jsonl(Path(results_dir) / RESULTS_JSONL_FILENAME):
+            yield {key: value for key, value in row.items() if key not in exclude_columns}
+        return
+    schema = pq.read_schema(parquet_path)
+    json_columns = set(json.loads((schema.metadata or {}).get(_JSON_COLUMNS_KEY, b"[]")))
+    columns = [name for name in schema.names if name not in exclude_columns]
+    table = pq.read_table(parquet_path, columns=columns, memory_map=True)
+    for batch in table.to_batches():
+        for row in batch.to_pylist():
+            for column_name in json_columns.intersection(row):
+                if row[column_name] is not None:
+                    row[column_name] = json.loads(row[column_name])
+            yield row
@@ -0,0 +1,133 @@
+import functools
+import logging
+import re
+
+from .rate_limit import estimate_tokens
+
+logger = logging.getLogger("evaltools")
+
+CONTEXT_STRATEGIES = ["head", "proportional", "relevance"]
+
+# send_question_to_target joins the data points of the context with this separator
+CHUNK_SEPARATOR = "\n\n"
+
+DEFAULT_ENCODING = "o200k_base"
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+class Tokenizer:
+    """Counts and truncates tokens with tiktoken. If tiktoken isn't installed or its encoding can't be loaded
+    (it's downloaded on first use), the tokens are estimated at ~4 characters per token instead."""
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        try:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except ImportError:
+            logger.warning("tiktoken isn't installed, so context budgets will use estimated token counts")
+        except Exception as e:
+            logger.warning(
+                "Couldn't load the %s encoding (%s), so context budgets will use estimates", encoding_name, e
+            )
+
+    def count(self, text: str) -> int:
+        if self._encoding is None:
+            return estimate_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is None:
+            return text[: max_tokens * 4]
+        tokens = self._encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self._encoding.decode(tokens[:max_tokens])
+
+
+@functools.lru_cache
+def get_tokenizer(encoding_name: str = DEFAULT_ENCODING) -> Tokenizer:
+    return Tokenizer(encoding_name)
+
+
+def get_relevance(question_words: set[str], chunk: str) -> float:
+    """Fraction of the question's words that appear in the chunk."""
+    if not question_words:
+        return 0.0
+    return len(question_words.intersection(_WORD_PATTERN.findall(chunk.casefold()))) / len(question_words)
+
+
+class ContextBudget:
+    """Limits the context sent to a GPT metric to a number of tokens, using one of these strategies:
+
+    * head: keep the start of the context
+    * proportional: keep the start of every chunk (data point), with each one cut down in proportion to its length
+    * relevance: keep the chunks that share the most words with the question, in their original order
+    """
+
+    def __init__(self, max_tokens: int, strategy: str = "head", tokenizer: Tokenizer | None = None):
+        if strategy not in CONTEXT_STRATEGIES:
+            raise ValueError(f"Context budget strategy must be one of {CONTEXT_STRATEGIES}, got {strategy}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    @classmethod
+    def from_config(cls, config: dict | None, metric_name: str) -> "ContextBudget | None":
+        """Create the budget of a metric from a config with defaults for every metric, like
+        {"max_tokens": 4000, "strategy": "relevance", "metrics": {"gpt_groundedness": {"max_tokens": 8000}}}"""
+        if not config:
+            return None
+        settings = {key: value for key, value in config.items() if key != "metrics"}
+        settings.update(config.get("metrics", {}).get(metric_name, {}))
+        if not settings.get("max_tokens"):
+            return None
+        return cls(
+            settings["max_tokens"],
+            strategy=settings.get("strategy", "head"),
+            tokenizer=get_tokenizer(settings.get("encoding", DEFAULT_ENCODING)),
+        )
+
+    def apply(self, context: str, question: str = "") -> tuple[str, bool]:
+        """Return the context cut down to the budget, and whether it had to be cut."""
+        if not context or self.tokenizer.count(context) <= self.max_tokens:
+            return context, False
+        if self.strategy == "head":
+            return self.tokenizer.truncate(context, self.max_tokens), True
+        chunks = context.split(CHUNK_SEPARATOR)
+        chunk_tokens = [self.tokenizer.count(chunk) for chunk in chunks]
+        separator_tokens = self.tokenizer.count(CHUNK_SEPARATOR)
+        if self.strategy == "proportional":
+            available = self.max_tokens - separator_tokens * (len(chunks) - 1)
+            if available < len(chunks):
+                # Not every chunk can keep even one token once the separators are counted
+                return self.tokenizer.truncate(context, self.max_tokens), True
+            # Every chunk keeps at least one token, and the rest of the budget is shared in proportion to the length
+            shares = [min(num_tokens, 1) for num_tokens in chunk_tokens]
+            remaining = available - sum(shares)
+            total_left = max(sum(chunk_tokens) - sum(shares), 1)
+            shares = [
+                share + remaining * (num_tokens - share) // total_left
+                for share, num_tokens in zip(shares, chunk_tokens)
+            ]
+            kept = [self.tokenizer.truncate(chunk, share) for chunk, share in zip(chunks, shares)]
+            return CHUNK_SEPARATOR.join(chunk for chunk in kept if chunk), True
+        question_words = set(_WORD_PATTERN.findall(question.casefold()))
+        ranked = sorted(range(len(chunks)), key=lambda ind: -get_relevance(question_words, chunks[ind]))
+        kept = {}
+        remaining = self.max_tokens
+        for ind in ranked:
+            needed = chunk_tokens[ind] + (separator_tokens if kept else 0)
+            if needed <= remaining:
+                kept[ind] = chunks[ind]
+                remaining -= needed
+            else:
+                # Fill what's left of the budget with the start of the next most relevant chunk
+                partial = self.tokenizer.truncate(chunks[ind], remaining - (separator_tokens if kept else 0))
+                if partial:
+                    kept[ind] = partial
+                break
+        return CHUNK_SEPARATOR.join(kept[ind] for ind in sorted(kept)), True
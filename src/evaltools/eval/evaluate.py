@@ -1,20 +1,53 @@
+import hashlib
 import json
 import logging
 import os
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import jmespath
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from rich.progress import track
 
 from evaltools import service_setup
+from evaltools.columnar import RESULTS_PARQUET_FILENAME, write_results_table
+from evaltools.jsonl import count_jsonl_rows, iter_jsonl, read_jsonl
 
+from .context_budget import ContextBudget
 from .evaluate_metrics import metrics_by_name
+from .journal import JOURNAL_FILENAME, ResultsJournal
+from .metric_cache import MetricCache
+from .pipeline import run_pipeline
+from .rate_limit import RateLimiter, estimate_tokens
+from .sequential import SequentialTest
+from .summary import summarize_results
+from .tracing import SPAN_KIND_CLIENT, Tracer
 
 logger = logging.getLogger("evaltools")
 
+# Rough size of the rubric and examples in a metric prompt, used to budget GPT tokens per minute
+JUDGE_PROMPT_TOKENS = 1000
+
+# OTLP/JSON trace of the spans of a run, written when export_trace is enabled
+TRACE_FILENAME = "trace.json"
+
+# Describes which shard of the test data a results directory holds, so the shards can be merged later
+SHARD_FILENAME = "shard.json"
+
+
+def create_target_session(pool_size: int = 10) -> requests.Session:
+    """Create a session that keeps connections to the target alive across questions,
+    so that connection setup (and TLS handshakes) aren't counted in the latency of every answer."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
 
 def send_question_to_target(
     question: str,
@@ -23,46 +56,62 @@ def send_question_to_target(
     raise_error=False,
     response_answer_jmespath="message.content",
     response_context_jmespath="context.data_points.text",
+    rate_limiter: RateLimiter | None = None,
+    session: requests.Session | None = None,
+    timeout: tuple[float | None, float | None] | None = None,
+    tracer: Tracer | None = None,
+    timings: dict | None = None,
 ):
+    tracer = tracer or Tracer()
     headers = {"Content-Type": "application/json"}
     body = {
         "messages": [{"content": question, "role": "user"}],
         "context": parameters,
     }
+    # Without a session, each question opens a new connection to the target
+    http = session or requests
+    request_kwargs = {"timeout": timeout} if timeout else {}
     try:
-        r = requests.post(url, headers=headers, json=body)
-        r.encoding = "utf-8"
+        # The request includes any time spent waiting on the rate limiter and retrying throttled calls
+        with tracer.span("target.request", timings, kind=SPAN_KIND_CLIENT, question=truncate_for_log(question)):
+            if rate_limiter:
+                r = rate_limiter.call(lambda: http.post(url, headers=headers, json=body, **request_kwargs))
+            else:
+                r = http.post(url, headers=headers, json=body, **request_kwargs)
+            r.encoding = "utf-8"
 
         latency = r.elapsed.total_seconds()
 
-        try:
-            response_dict = r.json()
-        except json.JSONDecodeError:
-            raise ValueError(
-                f"Response from target {url} is not valid JSON:\n\n{r.text} \n"
-                "Make sure that your configuration points at a chat endpoint that returns a single JSON object.\n"
-            )
-
-        try:
-            answer = jmespath.search(response_answer_jmespath, response_dict)
-            data_points = jmespath.search(response_context_jmespath, response_dict)
-            if isinstance(data_points, dict):
-                context = json.dumps(data_points, ensure_ascii=False)
-            elif isinstance(data_points, list):
-                context = "\n\n".join(data_points)
-            elif data_points is not None:
-                # Hopefully it's a string
-                context = data_points
-            else:
-                raise ValueError("Context is missing")
-        except Exception:
-            raise ValueError(
-                "Response does not adhere to the expected schema. "
-                f"The answer should be accessible via the JMESPath expression '{response_answer_jmespath}' "
-                f"and the context should be accessible via the JMESPath expression '{response_context_jmespath}'. "
-                "Either adjust the app response or adjust send_question_to_target() in evaluate.py "
-                f"to match the actual schema.\nResponse: {response_dict}"
-            )
+        with tracer.span("target.parse", timings, question=truncate_for_log(question)):
+            try:
+                response_dict = r.json()
+            except json.JSONDecodeError:
+                raise ValueError(
+                    f"Response from target {url} is not valid JSON:\n\n{r.text} \n"
+                    "Make sure that your configuration points at a chat endpoint that returns a single JSON object.\n"
+                )
+
+            try:
+                answer = jmespath.search(response_answer_jmespath, response_dict)
+                data_points = jmespath.search(response_context_jmespath, response_dict)
+                if isinstance(data_points, dict):
+                    context = json.dumps(data_points, ensure_ascii=False)
+                elif isinstance(data_points, list):
+                    context = "\n\n".join(data_points)
+                elif data_points is not None:
+                    # Hopefully it's a string
+                    context = data_points
+                else:
+                    raise ValueError("Context is missing")
+            except Exception:
+                raise ValueError(
+                    "Response does not adhere to the expected schema. "
+                    f"The answer should be accessible via the JMESPath expression '{response_answer_jmespath}' "
+                    f"and the context should be accessible via the JMESPath expression "
+                    f"'{response_context_jmespath}'. "
+                    "Either adjust the app response or adjust send_question_to_target() in evaluate.py "
+                    f"to match the actual schema.\nResponse: {response_dict}"
+                )
 
         response_obj = {"answer": answer, "context": context, "latency": latency}
         return response_obj
@@ -80,9 +129,15 @@ def truncate_for_log(s: str, max_length=50):
     return s if len(s) < max_length else s[:max_length] + "..."
 
 
-def load_jsonl(path: Path) -> list[dict]:
-    with open(path, encoding="utf-8") as f:
-        return [json.loads(line) for line in f.readlines()]
+def load_jsonl(path: Path, limit: int | None = None) -> list[dict]:
+    return read_jsonl(path, limit=limit)
+
+
+def get_question_shard(question: str, num_shards: int) -> int:
+    """Return the (1-based) shard that a question belongs to.
+    The shard is based on a hash of the question, so it's the same on every machine and for every run."""
+    digest = hashlib.sha1(question.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards + 1
 
 
 def run_evaluation(
@@ -97,33 +152,94 @@ def run_evaluation(
     target_response_context_jmespath=None,
     model=None,
     azure_credential=None,
+    max_concurrency=1,
+    target_rate_limit=None,
+    judge_rate_limit=None,
+    target_connection=None,
+    resume=False,
+    metric_cache=None,
+    replay_dir=None,
+    target_concurrency=None,
+    judge_concurrency=None,
+    queue_size=100,
+    judge_batch_size=1,
+    shard=None,
+    vectorize_code_metrics=False,
+    record_timings=False,
+    export_trace=False,
+    context_budget=None,
+    sequential_test=None,
 ):
     logger.info("Running evaluation using data from %s", testdata_path)
-    testdata = load_jsonl(testdata_path)
+    # Spans are only kept individually when they're exported, otherwise just their durations are kept
+    tracer = Tracer(keep_spans=export_trace)
     if num_questions:
         logger.info("Limiting evaluation to %s questions", num_questions)
-        testdata = testdata[:num_questions]
 
-    logger.info("Sending a test question to the target to ensure it is running...")
-    try:
-        question = "What information is in your knowledge base?"
-        target_data = send_question_to_target(
-            question,
-            target_url,
-            target_parameters,
-            raise_error=True,
-            response_answer_jmespath=target_response_answer_jmespath,
-            response_context_jmespath=target_response_context_jmespath,
-        )
-        logger.info(
-            'Successfully received response from target for question: "%s"\n"answer": "%s"\n"context": "%s"',
-            truncate_for_log(question),
-            truncate_for_log(target_data["answer"]),
-            truncate_for_log(target_data["context"]),
-        )
-    except Exception as e:
-        logger.error("Failed to send a test question to the target due to error: \n%s", e)
-        return False
+    def read_indexed_testdata():
+        # Stream the test data, so that only the questions being evaluated are ever parsed or held in memory.
+        # Rows keep their index in the full test data, even when only one shard of it is evaluated.
+        rows = enumerate(iter_jsonl(testdata_path, limit=num_questions))
+        if shard:
+            shard_index, num_shards = shard
+            rows = (
+                (index, row) for index, row in rows if get_question_shard(row["question"], num_shards) == shard_index
+            )
+        return rows
+
+    def read_testdata():
+        return (row for _, row in read_indexed_testdata())
+
+    if shard:
+        num_testdata = sum(1 for _ in read_indexed_testdata())
+        logger.info("Evaluating shard %d of %d, with %d questions", shard[0], shard[1], num_testdata)
+    else:
+        num_testdata = count_jsonl_rows(testdata_path, limit=num_questions)
+
+    # Calls to the target and calls to the GPT model can each be limited separately
+    target_concurrency = target_concurrency or max_concurrency
+    judge_concurrency = judge_concurrency or max_concurrency
+
+    # The target app and the GPT judge each have their own quota, so they get separate limiters
+    target_limiter = RateLimiter.from_config("target", target_rate_limit, target_concurrency)
+    judge_limiter = RateLimiter.from_config("GPT judge", judge_rate_limit, judge_concurrency)
+
+    target_connection = target_connection or {}
+    target_session = create_target_session(pool_size=target_connection.get("pool_size", target_concurrency))
+    target_timeout = (target_connection.get("connect_timeout", 30), target_connection.get("read_timeout"))
+
+    # Reuse the answers from a previous run instead of sending the questions to the target again
+    replayed_rows = {}
+    if replay_dir:
+        replayed_rows = {row["question"]: row for row in load_jsonl(Path(replay_dir) / "eval_results.jsonl")}
+    num_replayed = sum(1 for row in read_testdata() if row["question"] in replayed_rows) if replay_dir else 0
+    if replay_dir:
+        logger.info("Replaying %d of %d answers from %s", num_replayed, num_testdata, replay_dir)
+
+    if num_replayed < num_testdata:
+        logger.info("Sending a test question to the target to ensure it is running...")
+        try:
+            question = "What information is in your knowledge base?"
+            target_data = send_question_to_target(
+                question,
+                target_url,
+                target_parameters,
+                raise_error=True,
+                response_answer_jmespath=target_response_answer_jmespath,
+                response_context_jmespath=target_response_context_jmespath,
+                rate_limiter=target_limiter,
+                session=target_session,
+                timeout=target_timeout,
+            )
+            logger.info(
+                'Successfully received response from target for question: "%s"\n"answer": "%s"\n"context": "%s"',
+                truncate_for_log(question),
+                truncate_for_log(target_data["answer"]),
+                truncate_for_log(target_data["context"]),
+            )
+        except Exception as e:
+            logger.error("Failed to send a test question to the target due to error: \n%s", e)
+            return False
 
     logger.info("Sending a test chat completion to the GPT deployment to ensure it is running...")
     gpt_response = service_setup.get_openai_client(openai_config, azure_credential).chat.completions.create(
@@ -143,49 +259,361 @@ def run_evaluation(
         metrics_by_name[metric_name] for metric_name in requested_metrics if metric_name in metrics_by_name
     ]
 
-    def evaluate_row(row):
-        output = {}
-        output["question"] = row["question"]
-        output["truth"] = row["truth"]
-        target_response = send_question_to_target(
-            question=row["question"],
-            url=target_url,
-            parameters=target_parameters,
-            response_answer_jmespath=target_response_answer_jmespath,
-            response_context_jmespath=target_response_context_jmespath,
+    # Construct each evaluator once and reuse it (and its GPT client) for every row,
+    # since loading prompty files and creating clients for every row adds up quickly
+    setup_start = time.perf_counter()
+    evaluators = {metric.METRIC_NAME: metric.evaluator_fn(openai_config=openai_config) for metric in requested_metrics}
+    evaluator_setup_seconds = time.perf_counter() - setup_start
+    logger.info("Prepared %d evaluators in %.3f seconds", len(evaluators), evaluator_setup_seconds)
+
+    # The context sent to each GPT metric can be cut down to a number of tokens
+    context_budgets = {
+        metric.METRIC_NAME: budget
+        for metric in requested_metrics
+        if metric.REQUIRES_GPT and (budget := ContextBudget.from_config(context_budget, metric.METRIC_NAME))
+    }
+    if context_budgets:
+        logger.info(
+            "Limiting the context to %s tokens",
+            ", ".join(
+                f"{budget.max_tokens} ({budget.strategy}) for {name}" for name, budget in context_budgets.items()
+            ),
         )
-        output.update(target_response)
-        for metric in requested_metrics:
-            result = metric.evaluator_fn(openai_config=openai_config)(
+
+    cache = None
+    if metric_cache:
+        cache = MetricCache(metric_cache["path"], max_size_mb=metric_cache.get("max_size_mb", 500))
+        logger.info("Using cached GPT metric results from %s", cache.path)
+        judge_model = f"{model}:{openai_config.get('azure_deployment') or openai_config.get('model')}"
+        prompt_hashes = {metric.METRIC_NAME: metric.get_prompt_hash() for metric in requested_metrics}
+
+    def get_target_output(row):
+        output = {}
+        timings = {} if record_timings else None
+        if row["question"] in replayed_rows:
+            # Keep the answer, context, latency and previous metrics, so new metrics get merged into the row
+            output.update(replayed_rows[row["question"]])
+            output.pop("_timings", None)
+            output["truth"] = row["truth"]
+        else:
+            output["question"] = row["question"]
+            output["truth"] = row["truth"]
+            target_response = send_question_to_target(
+                question=row["question"],
+                url=target_url,
+                parameters=target_parameters,
+                response_answer_jmespath=target_response_answer_jmespath,
+                response_context_jmespath=target_response_context_jmespath,
+                rate_limiter=target_limiter,
+                session=target_session,
+                timeout=target_timeout,
+                tracer=tracer,
+                timings=timings,
+            )
+            output.update(target_response)
+        if timings is not None:
+            output["_timings"] = timings
+        if context_budgets:
+            output["context_truncated"] = False
+        return output
+
+    def get_metric_context(metric, row, output):
+        budget = context_budgets.get(metric.METRIC_NAME)
+        if budget is None:
+            return output["context"]
+        context, truncated = budget.apply(output["context"], row["question"])
+        if truncated:
+            # Only ever set to True, so metrics of the same row running at once can't undo each other
+            output["context_truncated"] = True
+        return context
+
+    def evaluate_metric(metric, row, output):
+        # Metrics of the same row can run at once, but each one only sets its own keys in the row's timings
+        with tracer.span(
+            f"metric.{metric.METRIC_NAME}", output.get("_timings"), question=truncate_for_log(row["question"])
+        ):
+            return evaluate_metric_untimed(metric, row, output)
+
+    def evaluate_metric_untimed(metric, row, output):
+        evaluator = evaluators[metric.METRIC_NAME]
+        context = get_metric_context(metric, row, output)
+
+        def call_evaluator():
+            return evaluator(
                 query=row["question"],
                 response=output["answer"],
-                context=output["context"],
+                context=context,
                 ground_truth=row["truth"],
             )
-            output.update(result)
 
+        if not metric.REQUIRES_GPT:
+            return call_evaluator()
+
+        def call_judge_evaluator():
+            # Unlike the metric's span, this leaves out the time spent waiting on the rate limiter
+            with tracer.span(
+                f"judge.{metric.METRIC_NAME}",
+                output.get("_timings"),
+                kind=SPAN_KIND_CLIENT,
+                question=truncate_for_log(row["question"]),
+            ):
+                return call_evaluator()
+
+        tokens = estimate_tokens(row["question"], output["answer"], context, row["truth"], overhead=JUDGE_PROMPT_TOKENS)
+
+        def call_judge():
+            return judge_limiter.call(call_judge_evaluator, tokens=tokens)
+
+        if cache:
+            return cache.get_or_compute(get_cache_key(metric, row, output, context), call_judge)
+        return call_judge()
+
+    def get_cache_key(metric, row, output, context):
+        # The key uses the context that the metric was given, so changing the budget scores the rows again
+        return cache.make_key(
+            metric.METRIC_NAME,
+            prompt_hashes[metric.METRIC_NAME],
+            judge_model,
+            row["question"],
+            output["answer"],
+            context,
+            row["truth"],
+        )
+
+    # Metrics that support it can score several rows per GPT call, once all the target responses are collected
+    batched_metrics = []
+    if sequential_test and (judge_batch_size > 1 or vectorize_code_metrics):
+        # Every metric has to be scored before each look at the results, not at the end
+        logger.info("Scoring one row at a time, since the results are compared to the baseline as they come in")
+    elif judge_batch_size > 1:
+        batched_metrics = [metric for metric in requested_metrics if hasattr(metric, "batch_evaluator_fn")]
+    # Local code metrics can instead be computed over whole columns at once, so they don't hold up the network calls
+    column_metrics = []
+    if vectorize_code_metrics and not sequential_test:
+        column_metrics = [
+            metric
+            for metric in requested_metrics
+            if not metric.REQUIRES_GPT and hasattr(metric, "evaluate_columns") and metric not in batched_metrics
+        ]
+    row_metrics = [metric for metric in requested_metrics if metric not in batched_metrics + column_metrics]
+
+    def evaluate_row(row):
+        output = get_target_output(row)
+        for metric in row_metrics:
+            output.update(evaluate_metric(metric, row, output))
         return output
 
-    # Run evaluations in serial to avoid rate limiting
-    questions_with_ratings = []
-    for row in track(testdata, description="Processing..."):
-        questions_with_ratings.append(evaluate_row(row))
+    def evaluate_metric_in_batches(metric, rows):
+        batch_evaluator = metric.batch_evaluator_fn(openai_config=openai_config, azure_credential=azure_credential)
+        contexts = {id(row): get_metric_context(metric, row, row) for row in rows}
+        rows_to_score = rows
+        if cache:
+            rows_to_score = []
+            for row in rows:
+                cached_result = cache.get(get_cache_key(metric, row, row, contexts[id(row)]))
+                if cached_result is None:
+                    rows_to_score.append(row)
+                else:
+                    row.update(cached_result)
+
+        def score_batch(batch):
+            batch_inputs = [
+                {
+                    "query": row["question"],
+                    "response": row["answer"],
+                    "context": contexts[id(row)],
+                    "ground_truth": row["truth"],
+                }
+                for row in batch
+            ]
+            tokens = estimate_tokens(
+                *(text for row_inputs in batch_inputs for text in row_inputs.values()), overhead=JUDGE_PROMPT_TOKENS
+            )
+            with tracer.span(f"judge_batch.{metric.METRIC_NAME}", kind=SPAN_KIND_CLIENT, batch_size=len(batch)):
+                results = judge_limiter.call(lambda: batch_evaluator(batch_inputs), tokens=tokens)
+            for row, result in zip(batch, results):
+                if result is None:
+                    # The score for this row couldn't be parsed from the batched answer, so score it on its own
+                    result = evaluate_metric(metric, row, row)
+                elif cache:
+                    cache.set(get_cache_key(metric, row, row, contexts[id(row)]), result)
+                row.update(result)
+
+        batches = [
+            rows_to_score[ind : ind + judge_batch_size] for ind in range(0, len(rows_to_score), judge_batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=judge_concurrency) as executor:
+            futures = [executor.submit(score_batch, batch) for batch in batches]
+            for future in track(
+                as_completed(futures), total=len(futures), description=f"Scoring {metric.METRIC_NAME}..."
+            ):
+                future.result()
+
+    # Record each row as soon as it's done, so that an interrupted run can be resumed
+    results_dir.mkdir(parents=True, exist_ok=True)
+    if shard:
+        with open(results_dir / SHARD_FILENAME, "w", encoding="utf-8") as shard_file:
+            shard_info = {
+                "index": shard[0],
+                "count": shard[1],
+                "num_questions": num_testdata,
+                "testdata_path": str(testdata_path),
+            }
+            shard_file.write(json.dumps(shard_info, indent=4))
+    journal = ResultsJournal(results_dir / JOURNAL_FILENAME)
+    completed = {}
+    if resume:
+        completed = journal.load()
+        # Only the rows up to the last completed one need to be read to check that the journal matches
+        num_to_check = max(completed, default=-1) + 1
+        testdata_prefix = iter_jsonl(testdata_path, limit=min(num_to_check, num_questions or num_to_check))
+        questions = {index: row["question"] for index, row in enumerate(testdata_prefix) if index in completed}
+        if shard:
+            # Rows journaled by a different shard don't count as evaluated for this one
+            questions = {
+                index: question
+                for index, question in questions.items()
+                if get_question_shard(question, shard[1]) == shard[0]
+            }
+        for index in completed:
+            if completed[index]["question"] != questions.get(index):
+                logger.error(
+                    "The journal in %s doesn't match the test data at row %d, so the evaluation can't be resumed.",
+                    results_dir,
+                    index,
+                )
+                return False
+        logger.info("Resuming evaluation: %d of %d questions were already evaluated", len(completed), num_testdata)
+    journal.open(append=resume)
+
+    sequential = None
+    stopped_early = False
+    if sequential_test:
+        tested_metrics = sequential_test.get("metrics") or [
+            metric.METRIC_NAME for metric in requested_metrics if metric.REQUIRES_GPT
+        ]
+        sequential = SequentialTest.from_baseline_dir(
+            Path(sequential_test["baseline_dir"]),
+            tested_metrics or [metric.METRIC_NAME for metric in requested_metrics],
+            [row["question"] for row in read_testdata()],
+            alpha=sequential_test.get("alpha", 0.05),
+            min_questions=sequential_test.get("min_questions", 30),
+        )
+        for output in completed.values():
+            sequential.add(output)
+
+    def record_result(index, output):
+        with tracer.span("results.journal"):
+            journal.append(index, output)
+        if sequential:
+            sequential.add(output)
+
+    def evaluate_rows(indexed_rows, total):
+        if target_concurrency > 1 or judge_concurrency > 1:
+            logger.info(
+                "Evaluating with up to %d target calls and %d GPT metric calls in parallel",
+                target_concurrency,
+                judge_concurrency,
+            )
+            run_pipeline(
+                indexed_rows,
+                total=total,
+                fetch_target_response=get_target_output,
+                metrics=row_metrics,
+                evaluate_metric=evaluate_metric,
+                record_result=record_result,
+                target_concurrency=target_concurrency,
+                judge_concurrency=judge_concurrency,
+                queue_size=queue_size,
+            )
+        else:
+            # Run evaluations in serial to avoid rate limiting
+            for index, row in track(indexed_rows, total=total, description="Processing..."):
+                record_result(index, evaluate_row(row))
+
+    remaining_rows = ((index, row) for index, row in read_indexed_testdata() if index not in completed)
+    num_remaining = num_testdata - len(completed)
+
+    try:
+        if sequential:
+            # Evaluate the questions in a random (but repeatable) order, so that each batch is a fair sample of them
+            remaining_rows = list(remaining_rows)
+            random.Random(sequential_test.get("seed", 0)).shuffle(remaining_rows)
+            batch_size = sequential_test.get("batch_size", 50)
+            for start in range(0, len(remaining_rows), batch_size):
+                batch = remaining_rows[start : start + batch_size]
+                evaluate_rows(batch, len(batch))
+                if sequential.check():
+                    stopped_early = start + batch_size < len(remaining_rows)
+                    break
+                if sequential.looks:
+                    logger.info(
+                        "Compared %d questions to the baseline, the difference isn't decisive yet: %s",
+                        sequential.num_paired,
+                        ", ".join(
+                            f"{metric} {result['mean_delta']:+} (p={result['p_value']:.4f})"
+                            for metric, result in sequential.looks[-1]["metrics"].items()
+                        ),
+                    )
+            if sequential.decision:
+                decision = sequential.decision
+                logger.info(
+                    "%s is decisively %s than the baseline (%+.2f, p=%.4g) after %d questions%s",
+                    decision["metric"],
+                    decision["direction"],
+                    decision["mean_delta"],
+                    decision["p_value"],
+                    decision["num_paired"],
+                    ", so the rest of the questions were skipped" if stopped_early else "",
+                )
+        else:
+            evaluate_rows(remaining_rows, num_remaining)
+    finally:
+        journal.close()
+        target_session.close()
+
+    # Rebuild the full results from the journal, in the same order as the test data
+    questions_with_ratings = [row for _, row in sorted(journal.load().items())]
+    for metric in batched_metrics:
+        logger.info("Scoring %s for %d rows at a time", metric.METRIC_NAME, judge_batch_size)
+        evaluate_metric_in_batches(metric, questions_with_ratings)
+    if column_metrics:
+        inputs = pd.DataFrame(questions_with_ratings, columns=["question", "answer", "context", "truth"])
+        for metric in column_metrics:
+            logger.info("Computing %s for all %d rows at once", metric.METRIC_NAME, len(inputs))
+            with tracer.span(f"column_metric.{metric.METRIC_NAME}", num_rows=len(inputs)):
+                results = metric.evaluate_columns(inputs).to_dict("records")
+            for row, result in zip(questions_with_ratings, results):
+                row.update(result)
+    if cache:
+        cache.close()
 
     logger.info("Evaluation calls have completed. Calculating overall metrics now...")
-    # Make the results directory if it doesn't exist
-    results_dir.mkdir(parents=True, exist_ok=True)
     # Save the results
-    with open(results_dir / "eval_results.jsonl", "w", encoding="utf-8") as results_file:
-        for row in questions_with_ratings:
-            results_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+    with tracer.span("results.jsonl", num_rows=len(questions_with_ratings)):
+        with open(results_dir / "eval_results.jsonl", "w", encoding="utf-8") as results_file:
+            for row in questions_with_ratings:
+                results_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+    with tracer.span("results.parquet", num_rows=len(questions_with_ratings)):
+        write_results_table(questions_with_ratings, results_dir / RESULTS_PARQUET_FILENAME)
+    journal.remove()
 
     # Calculate aggregate metrics
     df = pd.DataFrame(questions_with_ratings)
-    summary = {}
-    for metric in requested_metrics:
-        summary[metric.METRIC_NAME] = metric.get_aggregate_stats(df)
-    # add a metric for the number of questions
-    summary["num_questions"] = {"total": len(df)}
+    summarized_metrics = list(requested_metrics)
+    if replay_dir and (Path(replay_dir) / "summary.json").exists():
+        # Keep summarizing the metrics of the previous run, since their columns are still in the rows
+        with open(Path(replay_dir) / "summary.json", encoding="utf-8") as f:
+            previous_summary = json.load(f)
+        summarized_metrics += [
+            metrics_by_name[metric_name]
+            for metric_name in previous_summary
+            if metric_name in metrics_by_name
+            and metric_name in df.columns
+            and metrics_by_name[metric_name] not in summarized_metrics
+        ]
+    with tracer.span("results.summary"):
+        summary = summarize_results(df, summarized_metrics)
 
     # summary statistics
     with open(results_dir / "summary.json", "w", encoding="utf-8") as summary_file:
@@ -199,8 +627,33 @@ def run_evaluation(
             "target_url": target_url,
             "target_parameters": target_parameters,
             "num_questions": num_questions,
+            "resumed_questions": len(completed),
+            "replayed_from": str(replay_dir) if replay_dir else None,
+            "replayed_questions": num_replayed,
+            "max_concurrency": max_concurrency,
+            "target_concurrency": target_concurrency,
+            "judge_concurrency": judge_concurrency,
+            "judge_batch_size": judge_batch_size,
+            "vectorize_code_metrics": vectorize_code_metrics,
+            "rate_limits": {"target": target_limiter.stats, "judge": judge_limiter.stats},
+            "evaluator_setup_seconds": round(evaluator_setup_seconds, 3),
+            "metric_cache": cache.stats() if cache else None,
+            "shard": {"index": shard[0], "count": shard[1], "num_questions": num_testdata} if shard else None,
+            "record_timings": record_timings,
+            "timings": tracer.breakdown(),
+            "context_budget": context_budget,
+            "context_truncated_questions": sum(1 for row in questions_with_ratings if row.get("context_truncated")),
+            "sequential_test": {
+                "baseline_dir": str(sequential_test["baseline_dir"]),
+                **sequential.report(stopped_early),
+            }
+            if sequential
+            else None,
         }
         parameters_file.write(json.dumps(parameters, indent=4))
+    if export_trace:
+        tracer.write_otlp_json(results_dir / TRACE_FILENAME, testdata_path=str(testdata_path), target_url=target_url)
+        logger.info("Trace of the evaluation saved in %s", results_dir / TRACE_FILENAME)
     logger.info("Evaluation results saved in %s", results_dir)
     return True
 
@@ -232,14 +685,39 @@ def run_evaluate_from_config(
     openai_config=None,
     model=None,
     azure_credential=None,
+    max_concurrency=None,
+    resume=False,
+    replay_dir=None,
+    target_concurrency=None,
+    judge_concurrency=None,
+    shard=None,
+    baseline_dir=None,
 ):
     config_path = working_dir / Path(config_path)
     logger.info("Running evaluation from config %s", config_path)
     with open(config_path, encoding="utf-8") as f:
         config = json.load(f)
+        configured_results_dir = config.get("results_dir", "")
         process_config(config)
 
+    metric_cache = config.get("metric_cache")
+    if metric_cache:
+        metric_cache = {**metric_cache, "path": working_dir / metric_cache.get("path", ".evaltools_cache/metrics.db")}
+
+    sequential_test = config.get("sequential_test")
+    if baseline_dir or sequential_test:
+        sequential_test = dict(sequential_test or {})
+        if baseline_dir:
+            sequential_test["baseline_dir"] = baseline_dir
+        if not sequential_test.get("baseline_dir"):
+            logger.error("To compare to a baseline as the evaluation runs, specify the baseline results directory.")
+            return
+        sequential_test["baseline_dir"] = working_dir / Path(sequential_test["baseline_dir"])
+
     if results_dir is None:
+        if resume and "<TIMESTAMP>" in configured_results_dir:
+            logger.error("To resume an evaluation, specify the results directory of the interrupted run.")
+            return
         results_dir = working_dir / Path(config["results_dir"])
 
     evaluation_run_complete = run_evaluation(
@@ -257,6 +735,23 @@ def run_evaluate_from_config(
         target_response_context_jmespath=config.get("target_response_context_jmespath", "context.data_points.text"),
         model=model or os.environ["OPENAI_GPT_MODEL"],
         azure_credential=azure_credential,
+        max_concurrency=max_concurrency or config.get("max_concurrency", 1),
+        target_rate_limit=config.get("target_rate_limit"),
+        judge_rate_limit=config.get("judge_rate_limit"),
+        target_connection=config.get("target_connection"),
+        resume=resume,
+        metric_cache=metric_cache,
+        replay_dir=working_dir / Path(replay_dir) if replay_dir else None,
+        target_concurrency=target_concurrency or config.get("target_concurrency"),
+        judge_concurrency=judge_concurrency or config.get("judge_concurrency"),
+        queue_size=config.get("queue_size", 100),
+        judge_batch_size=config.get("judge_batch_size", 1),
+        shard=shard,
+        vectorize_code_metrics=config.get("vectorize_code_metrics", False),
+        record_timings=config.get("record_timings", False),
+        export_trace=config.get("export_trace", False),
+        context_budget=config.get("context_budget"),
+        sequential_test=sequential_test,
     )
 
     if evaluation_run_complete:
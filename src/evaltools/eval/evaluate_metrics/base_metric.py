@@ -1,13 +1,20 @@
 import logging
 from abc import ABC, abstractmethod
 
+import numpy as np
 import pandas as pd
 
 logger = logging.getLogger("evaltools")
 
+# Number of resamples used for bootstrap confidence intervals, with a fixed seed so summaries are reproducible
+BOOTSTRAP_SAMPLES = 1000
+BOOTSTRAP_SEED = 42
+
 
 class BaseMetric(ABC):
     METRIC_NAME = "name_of_metric"
+    # Whether computing the metric sends a request to the GPT model (as opposed to only local code)
+    REQUIRES_GPT = False
 
     @classmethod
     @abstractmethod
@@ -15,28 +22,52 @@ class BaseMetric(ABC):
         """Returns a dictionary of aggregate statistics for the metric"""
         pass
 
+    @classmethod
+    def get_prompt_hash(cls) -> str:
+        """Returns a hash identifying the prompt used by the metric, so that cached results are not reused
+        once the prompt changes. Only relevant for metrics that require GPT."""
+        return ""
+
+    @classmethod
+    def get_bootstrap_ci(cls, successes: int, total: int, confidence: float = 0.95) -> list[float] | None:
+        """Returns a bootstrap confidence interval for a rate, as [low, high].
+        Resampling `total` pass/fail outcomes with replacement is the same as drawing from a binomial distribution,
+        so all the resamples are drawn at once without materializing them."""
+        if total == 0:
+            return None
+        rng = np.random.default_rng(BOOTSTRAP_SEED)
+        rates = rng.binomial(total, successes / total, size=BOOTSTRAP_SAMPLES) / total
+        tail = (1 - confidence) / 2 * 100
+        low, high = np.percentile(rates, [tail, 100 - tail])
+        return [round(float(low), 2), round(float(high), 2)]
+
+    @classmethod
+    def get_percentiles(cls, values: pd.Series) -> dict:
+        """Returns the 50th, 90th and 99th percentiles of the values."""
+        if values.empty:
+            return {}
+        p50, p90, p99 = np.percentile(values.to_numpy(dtype=float), [50, 90, 99])
+        return {"p50": round(float(p50), 2), "p90": round(float(p90), 2), "p99": round(float(p99), 2)}
+
     @classmethod
     def get_aggregate_stats_for_numeric_rating(cls, df, rating_column_name):
-        # Narrow down dataframe to just the metric
-        df = df[[rating_column_name]]
-
-        # Drop invalid ratings - strings like "Failed"
-        rows_before = len(df)
-        df = df.apply(pd.to_numeric, errors="coerce")
-        df = df.dropna()
-        rows_after = len(df)
-        if rows_before != rows_after:
+        # Drop invalid ratings - strings like "Failed" (the column is usually numeric already)
+        ratings = pd.to_numeric(df[rating_column_name], errors="coerce")
+        num_rows = len(ratings)
+        ratings = ratings.dropna()
+        if len(ratings) != num_rows:
             logger.warning(
                 "Dropped %d invalid ratings for metric %s",
-                rows_before - rows_after,
+                num_rows - len(ratings),
                 rating_column_name,
             )
 
         # Count how many ratings passed threshold of 4+
-        pass_count = int(df[rating_column_name].apply(lambda rating: rating >= 4).sum())
+        pass_count = int((ratings >= 4).sum())
 
         return {
             "pass_count": pass_count,
-            "pass_rate": round(pass_count / rows_before, 2),
-            "mean_rating": round(df[rating_column_name].mean(), 2),
+            "pass_rate": round(pass_count / num_rows, 2),
+            "pass_rate_ci": cls.get_bootstrap_ci(pass_count, num_rows),
+            "mean_rating": round(ratings.mean(), 2),
         }
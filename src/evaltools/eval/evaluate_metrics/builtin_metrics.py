@@ -1,3 +1,8 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
+
+import pandas as pd
 from azure.ai.evaluation import (
     CoherenceEvaluator,
     F1ScoreEvaluator,
@@ -9,8 +14,24 @@ from azure.ai.evaluation import (
 
 from .base_metric import BaseMetric
 
+# Below this many rows, starting worker processes takes longer than scoring the rows in this process
+F1_PROCESS_POOL_MIN_ROWS = 5000
+
+
+def score_f1(pairs: list[tuple[str, str]]) -> list[dict]:
+    """Score a chunk of (response, ground truth) pairs, in a worker process or in this one."""
+    evaluator = F1ScoreEvaluator()
+    return [evaluator(response=response, ground_truth=ground_truth) for response, ground_truth in pairs]
+
 
 class BuiltinRatingMetric(BaseMetric):
+    REQUIRES_GPT = True
+
+    @classmethod
+    def get_prompt_hash(cls):
+        # The prompts are bundled with the SDK, so they can only change when the SDK version changes
+        return f"azure-ai-evaluation=={version('azure-ai-evaluation')}"
+
     @classmethod
     def get_aggregate_stats(cls, df):
         return cls.get_aggregate_stats_for_numeric_rating(df, cls.METRIC_NAME)
@@ -63,6 +84,20 @@ class BuiltinF1ScoreMetric(BaseMetric):
     def evaluator_fn(cls, **kwargs):
         return F1ScoreEvaluator()
 
+    @classmethod
+    def evaluate_columns(cls, df: pd.DataFrame) -> pd.DataFrame:
+        # Tokenizing is pure Python, so large runs are split across processes to get around the GIL
+        pairs = list(zip(df["answer"], df["truth"]))
+        if len(pairs) < F1_PROCESS_POOL_MIN_ROWS:
+            results = score_f1(pairs)
+        else:
+            num_workers = os.cpu_count() or 1
+            chunk_size = -(-len(pairs) // num_workers)
+            chunks = [pairs[ind : ind + chunk_size] for ind in range(0, len(pairs), chunk_size)]
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                results = [result for chunk_results in executor.map(score_f1, chunks) for result in chunk_results]
+        return pd.DataFrame(results, index=df.index)
+
     @classmethod
     def get_aggregate_stats(cls, df):
         return {
@@ -1,10 +1,24 @@
 import logging
 import re
 
+import pandas as pd
+
 from .base_metric import BaseMetric
 
 logger = logging.getLogger("evaltools")
 
+# Any bracketed text, like [info1.txt]
+CITATION_PATTERN = re.compile(r"\[[^\]]+\]")
+# A bracketed file name with an optional page, like [info1.pdf#page=2]
+CITATION_FILE_PATTERN = re.compile(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]")
+
+
+def get_citations(texts: pd.Series) -> pd.DataFrame:
+    """Find the file citations in each text, returning one row per citation with the index of its text."""
+    citations = texts.str.extractall(CITATION_FILE_PATTERN).fillna("")
+    citations.index = citations.index.get_level_values(0)
+    return citations.rename_axis("row").reset_index().drop_duplicates()
+
 
 class AnswerLengthMetric(BaseMetric):
     METRIC_NAME = "answer_length"
@@ -19,14 +33,21 @@ class AnswerLengthMetric(BaseMetric):
 
         return answer_length
 
+    @classmethod
+    def evaluate_columns(cls, df: pd.DataFrame) -> pd.DataFrame:
+        answer_length = df["answer"].str.len().fillna(-1).astype(int)
+        return pd.DataFrame({cls.METRIC_NAME: answer_length})
+
     @classmethod
     def get_aggregate_stats(cls, df):
         # remove -1 values from the mean calculation
-        df = df[df[cls.METRIC_NAME] != -1]
+        answer_length = df[cls.METRIC_NAME]
+        answer_length = answer_length[answer_length != -1]
         return {
-            "mean": round(df[cls.METRIC_NAME].mean(), 2),
-            "max": int(df[cls.METRIC_NAME].max()),
-            "min": int(df[cls.METRIC_NAME].min()),
+            "mean": round(answer_length.mean(), 2),
+            "max": int(answer_length.max()),
+            "min": int(answer_length.min()),
+            **cls.get_percentiles(answer_length),
         }
 
 
@@ -39,16 +60,24 @@ class HasCitationMetric(BaseMetric):
             if response is None:
                 logger.warning("Received response of None, can't compute has_citation metric. Setting to -1.")
                 return {cls.METRIC_NAME: -1}
-            return {cls.METRIC_NAME: bool(re.search(r"\[[^\]]+\]", response))}
+            return {cls.METRIC_NAME: bool(CITATION_PATTERN.search(response))}
 
         return has_citation
 
+    @classmethod
+    def evaluate_columns(cls, df: pd.DataFrame) -> pd.DataFrame:
+        has_citation = df["answer"].str.contains(CITATION_PATTERN).astype(object)
+        return pd.DataFrame({cls.METRIC_NAME: has_citation.where(df["answer"].notna(), -1)})
+
     @classmethod
     def get_aggregate_stats(cls, df):
-        df = df[df[cls.METRIC_NAME] != -1]
+        values = df[cls.METRIC_NAME]
+        values = values[values != -1]
+        total = int(values.sum())
         return {
-            "total": int(df[cls.METRIC_NAME].sum()),
-            "rate": round(df[cls.METRIC_NAME].mean(), 2),
+            "total": total,
+            "rate": round(values.mean(), 2),
+            "rate_ci": cls.get_bootstrap_ci(total, len(values)),
         }
 
 
@@ -62,19 +91,34 @@ class CitationMatchMetric(BaseMetric):
                 logger.warning("Received response of None, can't compute citation_match metric. Setting to -1.")
                 return {cls.METRIC_NAME: -1}
             # Return true if all citations in the truth are present in the response
-            truth_citations = set(re.findall(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]", ground_truth))
-            response_citations = set(re.findall(r"\[([^\]]+)\.\w{3,4}(#page=\d+)*\]", response))
+            truth_citations = set(CITATION_FILE_PATTERN.findall(ground_truth))
+            response_citations = set(CITATION_FILE_PATTERN.findall(response))
             citation_match = truth_citations.issubset(response_citations)
             return {cls.METRIC_NAME: citation_match}
 
         return citation_match
 
+    @classmethod
+    def evaluate_columns(cls, df: pd.DataFrame) -> pd.DataFrame:
+        # Find the truth citations that are missing from the response of the same row
+        truth_citations = get_citations(df["truth"].reset_index(drop=True))
+        response_citations = get_citations(df["answer"].reset_index(drop=True))
+        matched = truth_citations.merge(response_citations, how="left", indicator=True)
+        rows_missing_citations = matched.loc[matched["_merge"] == "left_only", "row"].unique()
+        citation_match = pd.Series(True, index=range(len(df)), dtype=object)
+        citation_match[rows_missing_citations] = False
+        citation_match.index = df.index
+        return pd.DataFrame({cls.METRIC_NAME: citation_match.where(df["answer"].notna(), -1)})
+
     @classmethod
     def get_aggregate_stats(cls, df):
-        df = df[df[cls.METRIC_NAME] != -1]
+        values = df[cls.METRIC_NAME]
+        values = values[values != -1]
+        total = int(values.sum())
         return {
-            "total": int(df[cls.METRIC_NAME].sum()),
-            "rate": round(df[cls.METRIC_NAME].mean(), 2),
+            "total": total,
+            "rate": round(values.mean(), 2),
+            "rate_ci": cls.get_bootstrap_ci(total, len(values)),
         }
 
 
@@ -95,4 +139,5 @@ class LatencyMetric(BaseMetric):
             "mean": round(df[cls.METRIC_NAME].mean(), 2),
             "max": df[cls.METRIC_NAME].max(),
             "min": df[cls.METRIC_NAME].min(),
+            **cls.get_percentiles(df[cls.METRIC_NAME]),
         }
@@ -1,10 +1,16 @@
+import hashlib
+import json
 import logging
 import re
 from pathlib import Path
 
+import jinja2
 import numpy as np
+import yaml
 from promptflow.client import load_flow
 
+from evaltools import service_setup
+
 from .base_metric import BaseMetric
 
 PROMPT_TEMPLATE_DIR = Path(__file__).resolve().parent / "prompts"
@@ -36,13 +42,108 @@ class PromptBasedEvaluator:
         return output
 
 
+def get_prompty_parameters(path: Path) -> dict:
+    """Return the model parameters of a prompty file, like its temperature and max_tokens."""
+    front_matter = yaml.safe_load(path.read_text(encoding="utf-8").split("---", 2)[1])
+    return dict(front_matter.get("model", {}).get("parameters") or {})
+
+
+def split_prompty(path: Path) -> tuple[str, str, str]:
+    """Split the template of a prompty file into its system message, the rubric at the start of the user message
+    (everything before the first line with a template variable), and the remaining per-row template.
+    Reminders about the output format are left out of the row template, since the batch asks for JSON instead."""
+    template = path.read_text(encoding="utf-8").split("---", 2)[2]
+    system, user = re.split(r"^user:\s*$", template, maxsplit=1, flags=re.MULTILINE)
+    system = re.sub(r"^\s*system:\s*$", "", system, count=1, flags=re.MULTILINE).strip()
+    user_lines = user.strip().splitlines()
+    first_row_line = next(ind for ind, line in enumerate(user_lines) if "{{" in line)
+    rubric = "\n".join(user_lines[:first_row_line]).strip()
+    row_lines = [line for line in user_lines[first_row_line:] if not line.startswith("Reminder:")]
+    row_template = "\n".join(row_lines).strip()
+    return system, rubric, row_template
+
+
+class BatchPromptBasedEvaluator:
+    """Scores several rows with a single request, by sending the rubric of a prompty file once,
+    followed by each of the rows, and asking for a JSON object with a score for each row."""
+
+    def __init__(self, model_config, path, name, azure_credential=None):
+        self._name = name
+        self._model = model_config.get("azure_deployment") or model_config.get("model")
+        self._client = service_setup.get_openai_client(model_config, azure_credential)
+        # The prompty's sampling parameters are kept, but the answer is a JSON object with a score for every row
+        self._parameters = get_prompty_parameters(path)
+        self._parameters.pop("response_format", None)
+        self._parameters.pop("max_tokens", None)
+        system, self._rubric, row_template = split_prompty(path)
+        self._row_template = jinja2.Template(row_template)
+        self._system = (
+            f"{system}\nYou will be given several numbered items at once. Score each item independently, "
+            'and respond only with a JSON object like {"scores": [{"id": 1, "score": 5}, {"id": 2, "score": 3}]}, '
+            "with one integer score between 1 and 5 for each item."
+        )
+
+    def build_messages(self, rows: list[dict]) -> list[dict]:
+        items = "\n\n".join(
+            f"### Item {ind}\n{self._row_template.render(**row)}" for ind, row in enumerate(rows, start=1)
+        )
+        return [
+            {"role": "system", "content": self._system},
+            {"role": "user", "content": f"{self._rubric}\n\nScore each of these {len(rows)} items:\n\n{items}"},
+        ]
+
+    def parse_scores(self, llm_output: str, num_rows: int) -> list[float | None]:
+        """Return the score for each row, or None for rows whose score couldn't be parsed."""
+        scores = [None] * num_rows
+        try:
+            items = json.loads(llm_output)["scores"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.warning("Could not parse batched scores from answer: %s", llm_output)
+            return scores
+        for item in items:
+            try:
+                ind, score = int(item["id"]) - 1, float(item["score"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if 0 <= ind < num_rows and 1 <= score <= 5:
+                scores[ind] = score
+        return scores
+
+    def __call__(self, rows: list[dict]) -> list[dict | None]:
+        """Score rows with keys query, response, context and ground_truth.
+        Rows that couldn't be scored are returned as None, so that they can be evaluated individually instead."""
+        response = self._client.chat.completions.create(
+            model=self._model,
+            messages=self.build_messages(rows),
+            max_tokens=50 + 20 * len(rows),
+            response_format={"type": "json_object"},
+            **self._parameters,
+        )
+        scores = self.parse_scores(response.choices[0].message.content or "", len(rows))
+        return [None if score is None else {self._name: score} for score in scores]
+
+
 class CustomRatingMetric(BaseMetric):
+    REQUIRES_GPT = True
+
+    @classmethod
+    def get_prompty_path(cls) -> Path:
+        return PROMPT_TEMPLATE_DIR / f"{cls.METRIC_NAME}.prompty"
+
     @classmethod
     def evaluator_fn(cls, openai_config, **kwargs):
-        return PromptBasedEvaluator(
-            openai_config, path=PROMPT_TEMPLATE_DIR / f"{cls.METRIC_NAME}.prompty", name=cls.METRIC_NAME
+        return PromptBasedEvaluator(openai_config, path=cls.get_prompty_path(), name=cls.METRIC_NAME)
+
+    @classmethod
+    def batch_evaluator_fn(cls, openai_config, azure_credential=None, **kwargs):
+        return BatchPromptBasedEvaluator(
+            openai_config, path=cls.get_prompty_path(), name=cls.METRIC_NAME, azure_credential=azure_credential
         )
 
+    @classmethod
+    def get_prompt_hash(cls):
+        return hashlib.sha256(cls.get_prompty_path().read_bytes()).hexdigest()
+
     @classmethod
     def get_aggregate_stats(cls, df):
         return cls.get_aggregate_stats_for_numeric_rating(df, cls.METRIC_NAME)
@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("evaltools")
+
+JOURNAL_FILENAME = "eval_results.journal.jsonl"
+
+
+class ResultsJournal:
+    """Append-only journal of evaluated rows, written as each row finishes,
+    so that an interrupted evaluation can be resumed without evaluating those rows again.
+
+    Each line stores the index of the row in the test data along with its result:
+    {"index": 3, "result": {"question": ..., "answer": ..., ...}}
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> dict[int, dict]:
+        """Return the results recorded so far, keyed by row index."""
+        results = {}
+        if not self.path.exists():
+            return results
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # The process may have been killed in the middle of writing the last line
+                    logger.warning("Ignoring incomplete line %d in %s", line_number, self.path)
+                    continue
+                results[entry["index"]] = entry["result"]
+        return results
+
+    def open(self, append: bool):
+        """Open the journal for writing, either keeping the existing entries or starting from scratch."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if append and self.path.exists():
+            self._truncate_incomplete_line()
+        self._file = open(self.path, "a" if append else "w", encoding="utf-8")
+
+    def _truncate_incomplete_line(self):
+        with open(self.path, "rb+") as f:
+            contents = f.read()
+            if contents and not contents.endswith(b"\n"):
+                f.truncate(contents.rfind(b"\n") + 1)
+
+    def append(self, index: int, result: dict):
+        line = json.dumps({"index": index, "result": result}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,160 @@
+import json
+import logging
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from evaltools.columnar import RESULTS_PARQUET_FILENAME, write_results_table
+from evaltools.jsonl import iter_jsonl, read_jsonl
+
+from .evaluate import SHARD_FILENAME
+from .evaluate_metrics import metrics_by_name
+from .journal import JOURNAL_FILENAME, ResultsJournal
+from .summary import summarize_results
+
+logger = logging.getLogger("evaltools")
+
+# Parameters that only describe the run of a single shard, so they aren't kept in the merged parameters
+SHARD_ONLY_PARAMETERS = ["rate_limits", "metric_cache", "resumed_questions", "evaluator_setup_seconds"]
+
+
+def load_shard(shard_dir: Path) -> dict | None:
+    """Load the results of one shard, along with whether it finished evaluating all of its questions."""
+    shard_path = shard_dir / SHARD_FILENAME
+    if not shard_path.exists():
+        logger.error(
+            "%s is not the results directory of a sharded evaluation (%s is missing)", shard_dir, SHARD_FILENAME
+        )
+        return None
+    with open(shard_path, encoding="utf-8") as f:
+        shard = json.load(f)
+    results_path = shard_dir / "eval_results.jsonl"
+    if results_path.exists():
+        rows = read_jsonl(results_path)
+    else:
+        # The shard was interrupted, so only the rows in its journal were evaluated
+        rows = [row for _, row in sorted(ResultsJournal(shard_dir / JOURNAL_FILENAME).load().items())]
+    shard["results_dir"] = shard_dir
+    shard["rows"] = rows
+    shard["complete"] = results_path.exists() and len(rows) == shard["num_questions"]
+    return shard
+
+
+def order_by_testdata(rows: list[dict], testdata_path: Path) -> list[dict]:
+    """Put the rows of all the shards back in the order of the questions in the test data."""
+    positions = {}
+    for position, row in enumerate(iter_jsonl(testdata_path)):
+        positions.setdefault(row["question"], position)
+    return sorted(rows, key=lambda row: positions.get(row["question"], len(positions)))
+
+
+def merge_results(shard_dirs: list[Path], output_dir: Path, allow_partial: bool = False) -> bool:
+    """Combine the results of a sharded evaluation into a single results directory,
+    recalculating the summary over all the questions."""
+    shards = [load_shard(Path(shard_dir)) for shard_dir in shard_dirs]
+    if None in shards:
+        return False
+
+    num_shards = {shard["count"] for shard in shards}
+    if len(num_shards) > 1:
+        logger.error("The results directories are from evaluations with different numbers of shards: %s", num_shards)
+        return False
+    num_shards = num_shards.pop()
+    shards_by_index = {}
+    for shard in shards:
+        if shard["index"] in shards_by_index:
+            logger.error(
+                "Shard %d appears in both %s and %s",
+                shard["index"],
+                shards_by_index[shard["index"]]["results_dir"],
+                shard["results_dir"],
+            )
+            return False
+        shards_by_index[shard["index"]] = shard
+
+    missing_shards = [index for index in range(1, num_shards + 1) if index not in shards_by_index]
+    partial_shards = [shard for shard in shards if not shard["complete"]]
+    for index in missing_shards:
+        logger.warning("Shard %d of %d is missing", index, num_shards)
+    for shard in partial_shards:
+        logger.warning(
+            "Shard %d of %d in %s is partial: %d of %d questions were evaluated",
+            shard["index"],
+            num_shards,
+            shard["results_dir"],
+            len(shard["rows"]),
+            shard["num_questions"],
+        )
+    if (missing_shards or partial_shards) and not allow_partial:
+        logger.error("Not merging partial results. Finish the missing shards, or merge anyway with --allowpartial.")
+        return False
+
+    shards = [shards_by_index[index] for index in sorted(shards_by_index)]
+    rows = [row for shard in shards for row in shard["rows"]]
+    testdata_path = Path(shards[0]["testdata_path"])
+    if testdata_path.exists():
+        rows = order_by_testdata(rows, testdata_path)
+    else:
+        logger.warning("Test data %s not found, so the results are kept in shard order", testdata_path)
+
+    # Summarize the same metrics that the shards summarized
+    df = pd.DataFrame(rows)
+    metric_names = {}
+    for shard in shards:
+        summary_path = shard["results_dir"] / "summary.json"
+        if summary_path.exists():
+            with open(summary_path, encoding="utf-8") as f:
+                metric_names.update(dict.fromkeys(json.load(f)))
+    metrics = [
+        metrics_by_name[metric_name]
+        for metric_name in metric_names
+        if metric_name in metrics_by_name and metric_name in df.columns
+    ]
+    summary = summarize_results(df, metrics)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "eval_results.jsonl", "w", encoding="utf-8") as results_file:
+        for row in rows:
+            results_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+    write_results_table(rows, output_dir / RESULTS_PARQUET_FILENAME)
+    with open(output_dir / "summary.json", "w", encoding="utf-8") as summary_file:
+        summary_file.write(json.dumps(summary, indent=4))
+
+    parameters = {}
+    for shard in shards:
+        parameters_path = shard["results_dir"] / "evaluate_parameters.json"
+        if parameters_path.exists():
+            with open(parameters_path, encoding="utf-8") as f:
+                parameters = json.load(f)
+            break
+    for key in SHARD_ONLY_PARAMETERS:
+        parameters.pop(key, None)
+    parameters.update(
+        {
+            "evaluation_timestamp": int(time.time()),
+            "testdata_path": str(testdata_path),
+            "shard": None,
+            "merged_shards": [
+                {
+                    "index": shard["index"],
+                    "results_dir": str(shard["results_dir"]),
+                    "num_questions": shard["num_questions"],
+                    "evaluated_questions": len(shard["rows"]),
+                    "complete": shard["complete"],
+                }
+                for shard in shards
+            ],
+            "missing_shards": missing_shards,
+        }
+    )
+    with open(output_dir / "evaluate_parameters.json", "w", encoding="utf-8") as parameters_file:
+        parameters_file.write(json.dumps(parameters, indent=4))
+
+    for shard in shards:
+        if (shard["results_dir"] / "config.json").exists():
+            shutil.copyfile(shard["results_dir"] / "config.json", output_dir / "config.json")
+            break
+    logger.info("Merged %d questions from %d shards into %s", len(rows), len(shards), output_dir)
+    return True
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger("evaltools")
+
+# Recency updates from cache hits are written with the next set(), or once this many are pending
+MAX_PENDING_LAST_USED = 1000
+
+
+def is_valid_result(result: dict) -> bool:
+    """Whether a metric result is worth caching, which isn't the case when the score couldn't be parsed
+    from the GPT answer (leaving NaN) or the evaluator reported a "Failed" rating."""
+    return bool(result) and not any(
+        (isinstance(value, float) and math.isnan(value)) or value == "Failed" for value in result.values()
+    )
+
+
+class MetricCache:
+    """On-disk SQLite cache of GPT metric results.
+
+    Results are keyed by a hash of everything that can affect them: the metric name, the hash of its prompt,
+    the GPT model, and the query, response, context and ground truth that were evaluated.
+    When the cache grows beyond max_size_mb, the least recently used results are evicted.
+    Results that aren't valid (like NaN scores) aren't stored, so a failure is retried in the next run.
+    """
+
+    def __init__(self, path: Path, max_size_mb: float = 500):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._last_used = 0.0
+        self._pending_last_used = {}
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS metric_results "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS metric_results_last_used ON metric_results (last_used)")
+        self._connection.commit()
+        # Kept up to date on every insert and eviction, so that checking the size doesn't scan the table
+        (self._total_size,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM metric_results").fetchone()
+
+    @staticmethod
+    def make_key(
+        metric_name: str, prompt_hash: str, model: str, query: str, response: str, context: str, ground_truth: str
+    ) -> str:
+        parts = [metric_name, prompt_hash, model, query, response, context, ground_truth]
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM metric_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # Committing on every hit would make a fully cached run wait on the disk, so the updates are batched
+            self._pending_last_used[key] = self._now()
+            if len(self._pending_last_used) >= MAX_PENDING_LAST_USED:
+                self._write_pending_last_used()
+                self._connection.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        if not is_valid_result(value):
+            logger.debug("Not caching invalid metric result %s", value)
+            return
+        serialized = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._write_pending_last_used()
+            self._pending_last_used.pop(key, None)
+            previous = self._connection.execute("SELECT size FROM metric_results WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO metric_results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, serialized, len(serialized), self._now()),
+            )
+            self._total_size += len(serialized) - (previous[0] if previous else 0)
+            self._evict()
+            self._connection.commit()
+
+    def _write_pending_last_used(self):
+        if self._pending_last_used:
+            self._connection.executemany(
+                "UPDATE metric_results SET last_used = ? WHERE key = ?",
+                [(last_used, key) for key, last_used in self._pending_last_used.items()],
+            )
+            self._pending_last_used.clear()
+
+    def _now(self) -> float:
+        # Keep timestamps strictly increasing, so recency is preserved even with a coarse system clock
+        self._last_used = max(time.time(), self._last_used + 1e-6)
+        return self._last_used
+
+    def get_or_compute(self, key: str, compute) -> dict:
+        """Return the cached result for the key, or compute it and store it in the cache (if it's valid)."""
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.set(key, result)
+        return result
+
+    def _evict(self):
+        if self._total_size <= self.max_size_bytes:
+            return
+        # Other processes (like the shards of a run) may share the database, so count its real size before evicting
+        (total_size,) = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM metric_results").fetchone()
+        self._total_size = total_size
+        if total_size <= self.max_size_bytes:
+            return
+        # Evict down to 90% of the maximum so we don't evict again on every insert
+        target_size = self.max_size_bytes * 0.9
+        evicted_keys = []
+        for key, size in self._connection.execute("SELECT key, size FROM metric_results ORDER BY last_used"):
+            if total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+        self._connection.executemany("DELETE FROM metric_results WHERE key = ?", evicted_keys)
+        self._total_size = total_size
+        logger.info("Evicted %d results from the metric cache", len(evicted_keys))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            self._write_pending_last_used()
+            self._connection.commit()
+            self._connection.close()
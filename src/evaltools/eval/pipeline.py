@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+
+from rich.progress import Progress
+
+logger = logging.getLogger("evaltools")
+
+# Marks the end of the items in a stage's queue
+_DONE = object()
+
+
+async def _gather_or_cancel(*awaitables) -> list:
+    """Like asyncio.gather, but as soon as one of the awaitables fails (or this is cancelled),
+    cancel the others and wait for them to stop, like a TaskGroup does on Python 3.11+."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task.done() and (task.cancelled() or task.exception() is not None):
+                # Raises the task's exception
+                task.result()
+        return [task.result() for task in tasks]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_stage(workers: list, next_queue: asyncio.Queue | None, num_next_workers: int):
+    """Wait for all the workers of a stage to finish, then tell the workers of the next stage to stop."""
+    await _gather_or_cancel(*workers)
+    if next_queue is not None:
+        for _ in range(num_next_workers):
+            await next_queue.put(_DONE)
+
+
+async def _run_pipeline(
+    indexed_rows: Iterable[tuple[int, dict]],
+    total: int,
+    fetch_target_response: Callable[[dict], dict],
+    metrics: list,
+    evaluate_metric: Callable[[type, dict, dict], dict],
+    record_result: Callable[[int, dict], None],
+    target_concurrency: int,
+    judge_concurrency: int,
+    queue_size: int,
+):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=target_concurrency + judge_concurrency)
+    # Bounded queues apply backpressure, so rows are only read as fast as they can be evaluated
+    target_queue = asyncio.Queue(maxsize=queue_size)
+    judge_queue = asyncio.Queue(maxsize=queue_size)
+    write_queue = asyncio.Queue(maxsize=queue_size)
+    judge_semaphore = asyncio.Semaphore(judge_concurrency)
+
+    async def feed_rows():
+        for indexed_row in indexed_rows:
+            await target_queue.put(indexed_row)
+        for _ in range(target_concurrency):
+            await target_queue.put(_DONE)
+
+    async def target_worker():
+        while (item := await target_queue.get()) is not _DONE:
+            index, row = item
+            output = await loop.run_in_executor(executor, fetch_target_response, row)
+            await judge_queue.put((index, row, output))
+
+    async def evaluate_metric_async(metric, row, output):
+        if not metric.REQUIRES_GPT:
+            # Local metrics don't wait on the GPT model, but they shouldn't block the event loop either
+            return await asyncio.to_thread(evaluate_metric, metric, row, output)
+        async with judge_semaphore:
+            return await loop.run_in_executor(executor, evaluate_metric, metric, row, output)
+
+    async def judge_worker():
+        while (item := await judge_queue.get()) is not _DONE:
+            index, row, output = item
+            # Send the response to all the metrics at once
+            results = await _gather_or_cancel(*(evaluate_metric_async(metric, row, output) for metric in metrics))
+            for result in results:
+                output.update(result)
+            await write_queue.put((index, output))
+
+    with Progress() as progress:
+        task = progress.add_task("Processing...", total=total)
+
+        async def write_worker():
+            while (item := await write_queue.get()) is not _DONE:
+                index, output = item
+                record_result(index, output)
+                progress.advance(task)
+
+        target_workers = [target_worker() for _ in range(target_concurrency)]
+        judge_workers = [judge_worker() for _ in range(judge_concurrency)]
+        try:
+            # Stop sending questions to the target and the GPT model as soon as any row fails
+            await _gather_or_cancel(
+                feed_rows(),
+                _run_stage(target_workers, judge_queue, judge_concurrency),
+                _run_stage(judge_workers, write_queue, 1),
+                write_worker(),
+            )
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_pipeline(
+    indexed_rows: Iterable[tuple[int, dict]],
+    total: int,
+    fetch_target_response: Callable[[dict], dict],
+    metrics: list,
+    evaluate_metric: Callable[[type, dict, dict], dict],
+    record_result: Callable[[int, dict], None],
+    target_concurrency: int = 1,
+    judge_concurrency: int = 1,
+    queue_size: int = 100,
+):
+    """Evaluate rows in a pipeline of three stages, each connected by a bounded queue:
+
+    1. Up to target_concurrency workers send questions to the target.
+    2. Up to judge_concurrency metric calls evaluate the target responses, with all metrics of a row run at once.
+    3. A single writer records each evaluated row (in the order that they finish).
+
+    The target calls and the metric calls overlap fully, since each stage has its own workers.
+    """
+    asyncio.run(
+        _run_pipeline(
+            indexed_rows,
+            total,
+            fetch_target_response,
+            metrics,
+            evaluate_metric,
+            record_result,
+            target_concurrency,
+            judge_concurrency,
+            queue_size,
+        )
+    )
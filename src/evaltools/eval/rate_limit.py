@@ -0,0 +1,259 @@
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger("evaltools")
+
+
+def get_header(headers, name: str) -> str | None:
+    """Look up a header by name, ignoring case even if headers is a plain dict."""
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        value = next((v for k, v in headers.items() if k.lower() == name), None)
+    return value
+
+
+def parse_duration(raw: str) -> float | None:
+    """Parse durations like "20", "1.5s", "200ms" or "6m0s" (as sent in x-ratelimit-reset-* headers) into seconds."""
+    raw = raw.strip()
+    try:
+        return float(raw)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", raw)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def get_retry_after(headers) -> float | None:
+    """Return how many seconds the service asked us to wait, based on retry-after-ms or Retry-After headers."""
+    if retry_after_ms := get_header(headers, "retry-after-ms"):
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    if retry_after := get_header(headers, "retry-after"):
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def get_throttled_headers(result) -> tuple[bool, dict | None]:
+    """Determine whether a response or exception indicates that we were rate limited (HTTP 429).
+    Returns whether it was throttled, along with the response headers if they're available."""
+    if isinstance(result, BaseException):
+        # The OpenAI SDK error may be wrapped several layers deep by promptflow or azure-ai-evaluation
+        seen = set()
+        error = result
+        status_code = None
+        while error is not None and id(error) not in seen:
+            seen.add(id(error))
+            response = getattr(error, "response", None)
+            error_status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+            if error_status_code == 429:
+                headers = getattr(response, "headers", None) or getattr(error, "headers", None)
+                return "insufficient_quota" not in str(error), headers
+            status_code = status_code or error_status_code
+            error = error.__cause__ or error.__context__ or getattr(error, "inner_exception", None)
+        if status_code is not None:
+            # The error has a status code other than 429, so a "429" in its message doesn't mean we were throttled
+            return False, None
+        message = str(result).lower()
+        throttled = ("429" in message or "rate limit" in message) and "insufficient_quota" not in message
+        return throttled, None
+    if getattr(result, "status_code", None) == 429:
+        return True, result.headers
+    return False, getattr(result, "headers", None)
+
+
+def estimate_tokens(*texts: str | None, overhead: int = 0) -> int:
+    """Roughly estimate the number of tokens in some texts, assuming ~4 characters per token."""
+    return overhead + sum(len(text) for text in texts if text) // 4
+
+
+class TokenBucket:
+    """Budget of units (requests or tokens) that refills continuously up to a per-minute capacity."""
+
+    def __init__(self, per_minute: float, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self.refill_per_second = per_minute / 60.0
+        self.clock = clock
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until the bucket has enough units available for the given amount."""
+        self.refill()
+        # A single request bigger than the whole budget can only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+    def limit_to(self, remaining: float):
+        """Lower the available budget to what the service reports as remaining."""
+        self.refill()
+        self.available = min(self.available, remaining)
+
+
+class RateLimiter:
+    """Client-side rate limiter shared by every call to one service (either the target app or the GPT judge).
+
+    Calls are paced by optional requests-per-minute and tokens-per-minute token buckets,
+    and the number of calls in flight is adjusted with AIMD (additive increase, multiplicative decrease):
+    each successful call slowly raises the concurrency limit, while each 429 response halves it
+    and pauses all callers until the Retry-After delay has passed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 1,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_retries: int = 5,
+        backoff_seconds: float = 2,
+        max_backoff_seconds: float = 60,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency_limit = float(self.max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.clock = clock
+        self.request_bucket = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0}
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, name: str, config: dict | None, max_concurrency: int = 1):
+        """Create a rate limiter from a config dict with keys like requests_per_minute and tokens_per_minute."""
+        config = dict(config or {})
+        config.setdefault("max_concurrency", max_concurrency)
+        return cls(name, **config)
+
+    def _wait_time(self, tokens: float) -> float:
+        now = self.clock()
+        if self.paused_until > now:
+            return self.paused_until - now
+        wait_time = 0.0
+        if self.request_bucket:
+            wait_time = max(wait_time, self.request_bucket.wait_time(1))
+        if self.token_bucket and tokens:
+            wait_time = max(wait_time, self.token_bucket.wait_time(tokens))
+        return wait_time
+
+    def acquire(self, tokens: float = 0):
+        """Block until a call with the given estimated token count can be made within the limits."""
+        with self._condition:
+            while True:
+                if self.in_flight >= int(self.concurrency_limit):
+                    self._condition.wait()
+                    continue
+                wait_time = self._wait_time(tokens)
+                if wait_time <= 0:
+                    break
+                self._condition.wait(timeout=wait_time)
+            self.in_flight += 1
+            self.stats["requests"] += 1
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket and tokens:
+                self.token_bucket.consume(tokens)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, headers=None):
+        with self._condition:
+            # Additive increase: one more concurrent call for every window of successful calls
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+            self._update_from_headers(headers)
+            self._condition.notify_all()
+
+    def on_throttle(self, attempt: int, headers=None):
+        with self._condition:
+            # Multiplicative decrease, and everyone waits out the backoff before the next call
+            self.concurrency_limit = max(1.0, self.concurrency_limit / 2)
+            self.stats["throttled"] += 1
+            delay = get_retry_after(headers)
+            if delay is None:
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2**attempt) * random.uniform(0.5, 1.5)
+            self.paused_until = max(self.paused_until, self.clock() + delay)
+            self._update_from_headers(headers)
+            self._condition.notify_all()
+        logger.warning(
+            "Rate limited by %s, waiting %.1f seconds (concurrency limit now %d)",
+            self.name,
+            delay,
+            int(self.concurrency_limit),
+        )
+
+    def _update_from_headers(self, headers):
+        """Respect the x-ratelimit-remaining-* headers sent by Azure OpenAI and other services."""
+        for kind, bucket in (("requests", self.request_bucket), ("tokens", self.token_bucket)):
+            remaining = get_header(headers, f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = float(remaining)
+            except ValueError:
+                continue
+            if bucket:
+                bucket.limit_to(remaining)
+            if remaining <= 0:
+                reset = get_header(headers, f"x-ratelimit-reset-{kind}")
+                delay = (parse_duration(reset) if reset else None) or self.backoff_seconds
+                self.paused_until = max(self.paused_until, self.clock() + delay)
+
+    def call(self, fn, tokens: float = 0):
+        """Call fn within the rate limits, retrying when it returns a 429 response or raises a rate limit error.
+        If the retries are exhausted, the final response is returned (or the final error is raised)."""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self._condition:
+                    self.stats["retries"] += 1
+            self.acquire(tokens)
+            try:
+                result = fn()
+            except Exception as e:
+                throttled, headers = get_throttled_headers(e)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                self.on_throttle(attempt, headers)
+                continue
+            finally:
+                self.release()
+            throttled, headers = get_throttled_headers(result)
+            if not throttled or attempt == self.max_retries:
+                if not throttled:
+                    self.on_success(headers)
+                return result
+            self.on_throttle(attempt, headers)
@@ -0,0 +1,127 @@
+import logging
+import math
+from pathlib import Path
+from statistics import NormalDist
+
+from evaltools.columnar import iter_results
+from evaltools.runs import LOWER_IS_BETTER_METRICS, normalize_question
+
+logger = logging.getLogger("evaltools")
+
+_NORMAL = NormalDist()
+
+
+def get_spent_alpha(alpha: float, information_fraction: float) -> float:
+    """Total significance level that may be used up once a fraction of the questions is evaluated, following
+    the O'Brien-Fleming-like spending function of Lan and DeMets: early looks need very strong evidence to stop,
+    and the full alpha is only available once every question is evaluated."""
+    if information_fraction <= 0:
+        return 0.0
+    z = _NORMAL.inv_cdf(1 - alpha / 2)
+    return 2 * (1 - _NORMAL.cdf(z / math.sqrt(min(information_fraction, 1.0))))
+
+
+def to_number(value) -> float | None:
+    """Return a metric value as a float, or None for missing and invalid values (like "Failed" ratings)."""
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)) and not math.isnan(value):
+        return float(value)
+    return None
+
+
+class SequentialTest:
+    """Compares a run to a baseline run while it's being evaluated, to stop as soon as the difference is decisive.
+
+    The metrics of each evaluated question are paired with the same question in the baseline. At each look,
+    the mean difference of each metric is tested with a two-sided z-test of the paired differences.
+    The significance level is split across the looks with an alpha spending function, and across the metrics
+    with a Bonferroni correction, so that looking after every batch doesn't inflate the false positive rate.
+    """
+
+    def __init__(
+        self,
+        baseline_rows: dict[str, dict],
+        metrics: list[str],
+        num_planned: int,
+        alpha: float = 0.05,
+        min_questions: int = 30,
+    ):
+        self.baseline_rows = baseline_rows
+        self.metrics = metrics
+        self.num_planned = max(num_planned, 1)
+        self.alpha = alpha
+        self.min_questions = min_questions
+        self.deltas = {metric: [] for metric in metrics}
+        self.num_paired = 0
+        self.looks = []
+        self.decision = None
+        self._spent_fraction = 0.0
+
+    @classmethod
+    def from_baseline_dir(cls, baseline_dir: Path, metrics: list[str], questions: list[str], **kwargs):
+        """Load the metrics of the baseline run, planning for a look at every question that it shares with this run."""
+        baseline_rows = {}
+        for row in iter_results(baseline_dir, exclude_columns=["context", "answer", "truth"]):
+            baseline_rows.setdefault(normalize_question(row["question"]), row)
+        num_planned = sum(1 for question in questions if normalize_question(question) in baseline_rows)
+        logger.info("Comparing to %d questions of the baseline in %s", num_planned, baseline_dir)
+        return cls(baseline_rows, metrics, num_planned, **kwargs)
+
+    def add(self, row: dict):
+        baseline_row = self.baseline_rows.get(normalize_question(row["question"]))
+        if baseline_row is None:
+            return
+        self.num_paired += 1
+        for metric in self.metrics:
+            value, baseline_value = to_number(row.get(metric)), to_number(baseline_row.get(metric))
+            if value is not None and baseline_value is not None:
+                self.deltas[metric].append(value - baseline_value)
+
+    def check(self) -> bool:
+        """Test the differences so far, and return whether the comparison is decisive."""
+        if self.num_paired < self.min_questions:
+            return False
+        information_fraction = min(self.num_paired / self.num_planned, 1.0)
+        # The alpha that wasn't spent at earlier looks (or was skipped below min_questions) carries over
+        look_alpha = get_spent_alpha(self.alpha, information_fraction) - get_spent_alpha(
+            self.alpha, self._spent_fraction
+        )
+        self._spent_fraction = information_fraction
+        metric_alpha = look_alpha / len(self.metrics)
+        look = {"num_paired": self.num_paired, "alpha": metric_alpha, "metrics": {}}
+        for metric in self.metrics:
+            deltas = self.deltas[metric]
+            if len(deltas) < 2:
+                continue
+            mean = sum(deltas) / len(deltas)
+            variance = sum((delta - mean) ** 2 for delta in deltas) / (len(deltas) - 1)
+            if variance == 0:
+                # Every difference is the same, so there's no variance for the z-test to use. An exact sign test
+                # still shows a consistent change: n differences of the same sign happen by chance with p = 2 * 0.5^n
+                p_value = 1.0 if mean == 0 else min(1.0, 2 * 0.5 ** len(deltas))
+            else:
+                z = mean / math.sqrt(variance / len(deltas))
+                p_value = 2 * (1 - _NORMAL.cdf(abs(z)))
+            improved = mean < 0 if metric in LOWER_IS_BETTER_METRICS else mean > 0
+            look["metrics"][metric] = {
+                "num_questions": len(deltas),
+                "mean_delta": round(mean, 4),
+                "p_value": round(p_value, 6),
+                "direction": "better" if improved else "worse",
+            }
+            if p_value < metric_alpha and self.decision is None:
+                self.decision = {"metric": metric, **look["metrics"][metric], "num_paired": self.num_paired}
+        self.looks.append(look)
+        return self.decision is not None
+
+    def report(self, stopped_early: bool) -> dict:
+        return {
+            "metrics": self.metrics,
+            "alpha": self.alpha,
+            "num_planned": self.num_planned,
+            "num_paired": self.num_paired,
+            "stopped_early": stopped_early,
+            "decision": self.decision,
+            "looks": self.looks,
+        }
@@ -0,0 +1,26 @@
+import pandas as pd
+
+
+def to_typed_frame(df: pd.DataFrame, metrics: list) -> pd.DataFrame:
+    """Convert each metric column of the results to a numeric dtype, once for all the aggregate stats.
+    Values that aren't numbers (like "Failed" ratings) become NaN, while columns that hold no numbers at all
+    (like the labels of a custom metric) are kept as they are."""
+    typed = df.copy(deep=False)
+    for metric in metrics:
+        if metric.METRIC_NAME not in typed.columns or pd.api.types.is_numeric_dtype(typed[metric.METRIC_NAME]):
+            continue
+        values = pd.to_numeric(typed[metric.METRIC_NAME], errors="coerce")
+        if values.notna().any():
+            typed[metric.METRIC_NAME] = values
+    return typed
+
+
+def summarize_results(df: pd.DataFrame, metrics: list) -> dict:
+    """Calculate the aggregate stats of each metric over the evaluated rows."""
+    typed = to_typed_frame(df, metrics)
+    summary = {}
+    for metric in metrics:
+        summary[metric.METRIC_NAME] = metric.get_aggregate_stats(typed)
+    # add a metric for the number of questions
+    summary["num_questions"] = {"total": len(df)}
+    return summary
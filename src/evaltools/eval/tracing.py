@@ -0,0 +1,123 @@
+import json
+import random
+import threading
+import time
+from array import array
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+# OTLP span kinds, see https://opentelemetry.io/docs/specs/otel/trace/api/#spankind
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+
+def _to_otlp_attributes(attributes: dict) -> list[dict]:
+    otlp_attributes = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            otlp_value = {"boolValue": value}
+        elif isinstance(value, int):
+            otlp_value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            otlp_value = {"doubleValue": value}
+        else:
+            otlp_value = {"stringValue": str(value)}
+        otlp_attributes.append({"key": key, "value": otlp_value})
+    return otlp_attributes
+
+
+class Tracer:
+    """Times the stages of an evaluation, like the calls to the target and to each metric.
+
+    The durations of every stage are always kept (as compact arrays), for the run-level breakdown.
+    With keep_spans, each span is also kept with its start and end time, so the run can be exported as a trace.
+    Spans can also add their duration to a row's own timings dict, when one is given.
+    """
+
+    def __init__(self, keep_spans: bool = False):
+        self.keep_spans = keep_spans
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self._durations = defaultdict(lambda: array("d"))
+        self._spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, timings: dict | None = None, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if timings is not None:
+                # Retried calls add up, so the row shows the total time spent on the stage
+                timings[name] = round(timings.get(name, 0) + seconds, 4)
+            with self._lock:
+                self._durations[name].append(seconds)
+                if self.keep_spans:
+                    self._spans.append((name, kind, start_ns, start_ns + int(seconds * 1e9), attributes))
+
+    def breakdown(self) -> dict:
+        """Return the number of spans and the total, mean, p50 and p99 seconds of each stage.
+        Stages overlap when they run concurrently, so their totals can add up to more than the run's duration."""
+        with self._lock:
+            durations = {name: np.frombuffer(values, dtype=float) for name, values in self._durations.items()}
+        stages = {}
+        for name, values in sorted(durations.items()):
+            p50, p99 = np.percentile(values, [50, 99])
+            stages[name] = {
+                "count": len(values),
+                "total_seconds": round(float(values.sum()), 3),
+                "mean_seconds": round(float(values.mean()), 4),
+                "p50_seconds": round(float(p50), 4),
+                "p99_seconds": round(float(p99), 4),
+            }
+        return {"total_seconds": round(time.perf_counter() - self._start, 3), "stages": stages}
+
+    def write_otlp_json(self, path: Path, service_name: str = "evaltools", **run_attributes):
+        """Write the spans as an OTLP/JSON trace, with a root span for the whole run,
+        which can be loaded by tools that read OpenTelemetry traces (like Jaeger or an OpenTelemetry Collector)."""
+        rng = random.Random()
+        trace_id = f"{rng.getrandbits(128):032x}"
+        root_span_id = f"{rng.getrandbits(64):016x}"
+        end_ns = time.time_ns()
+        with self._lock:
+            spans = list(self._spans)
+        otlp_spans = [
+            {
+                "traceId": trace_id,
+                "spanId": root_span_id,
+                "name": "evaluation",
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(self.start_ns),
+                "endTimeUnixNano": str(end_ns),
+                "attributes": _to_otlp_attributes(run_attributes),
+            }
+        ]
+        for name, kind, start_ns, span_end_ns, attributes in spans:
+            otlp_spans.append(
+                {
+                    "traceId": trace_id,
+                    "spanId": f"{rng.getrandbits(64):016x}",
+                    "parentSpanId": root_span_id,
+                    "name": name,
+                    "kind": kind,
+                    "startTimeUnixNano": str(start_ns),
+                    "endTimeUnixNano": str(span_end_ns),
+                    "attributes": _to_otlp_attributes(attributes),
+                }
+            )
+        trace = {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _to_otlp_attributes({"service.name": service_name})},
+                    "scopeSpans": [{"scope": {"name": "evaltools"}, "spans": otlp_spans}],
+                }
+            ]
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(trace))
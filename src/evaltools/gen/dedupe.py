@@ -0,0 +1,66 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+
+# Numbering and bullets that models add to the start of generated lines, like "1. ", "2) " or "- "
+_LIST_MARKER_PATTERN = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+")
+_NON_WORD_PATTERN = re.compile(r"[^\w\s]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def strip_list_marker(line: str) -> str:
+    return _LIST_MARKER_PATTERN.sub("", line).strip()
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase the text and drop its punctuation, list markers and extra whitespace."""
+    text = _NON_WORD_PATTERN.sub(" ", strip_list_marker(text).casefold())
+    return _WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def get_ngrams(normalized_text: str, n: int = 3) -> set[str]:
+    """Return the character n-grams of the text, or the text itself when it's shorter than n."""
+    if len(normalized_text) < n:
+        return {normalized_text}
+    return {normalized_text[ind : ind + n] for ind in range(len(normalized_text) - n + 1)}
+
+
+class QuestionDeduplicator:
+    """Tracks questions seen so far, to reject exact duplicates (after normalizing the text)
+    and near-duplicates (whose character n-grams have a Jaccard similarity of at least the threshold).
+
+    An inverted index from each n-gram to the questions containing it is kept, so that a new question
+    is only compared with the questions that share at least one n-gram with it.
+    """
+
+    def __init__(self, threshold: float = 0.75, ngram_size: int = 3):
+        self.threshold = threshold
+        self.ngram_size = ngram_size
+        self._hashes = set()
+        self._ngram_counts = []
+        self._index = defaultdict(list)
+
+    def is_duplicate(self, question: str) -> bool:
+        normalized = normalize_text(question)
+        if hashlib.sha1(normalized.encode("utf-8")).digest() in self._hashes:
+            return True
+        ngrams = get_ngrams(normalized, self.ngram_size)
+        shared_counts = Counter(question_id for ngram in ngrams for question_id in self._index.get(ngram, ()))
+        for question_id, num_shared in shared_counts.items():
+            similarity = num_shared / (len(ngrams) + self._ngram_counts[question_id] - num_shared)
+            if similarity >= self.threshold:
+                return True
+        return False
+
+    def add(self, question: str) -> bool:
+        """Remember the question unless it duplicates one already seen. Returns whether it was added."""
+        if self.is_duplicate(question):
+            return False
+        normalized = normalize_text(question)
+        self._hashes.add(hashlib.sha1(normalized.encode("utf-8")).digest())
+        ngrams = get_ngrams(normalized, self.ngram_size)
+        question_id = len(self._ngram_counts)
+        self._ngram_counts.append(len(ngrams))
+        for ngram in ngrams:
+            self._index[ngram].append(question_id)
+        return True
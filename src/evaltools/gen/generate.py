@@ -1,17 +1,77 @@
 import json
 import logging
-import math
 import random
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 from azure.search.documents import SearchClient
 
 from evaltools import service_setup
+from evaltools.eval.rate_limit import estimate_tokens
+from evaltools.jsonl import read_jsonl
+
+from .dedupe import QuestionDeduplicator, strip_list_marker
+from .search_retriever import JsonlSearchClient, SearchIndexRetriever
 
 logger = logging.getLogger("evaltools")
 
 
+def write_generated_qa(
+    sources: Iterable[dict],
+    generate_for_source: Callable[[dict], list[dict]],
+    num_questions_total: int,
+    num_questions_per_source: int,
+    output_file: Path,
+    max_concurrency: int = 1,
+) -> int:
+    """Generate questions for the sources with up to max_concurrency calls at once, writing each question as soon
+    as it's generated, and stopping as soon as there are num_questions_total. Returns the number of questions written.
+
+    New sources are only started while the calls in flight may still be needed to reach the total,
+    so that no calls are made for questions that would be thrown away.
+    """
+    directory = Path(output_file).parent
+    if not directory.exists():
+        directory.mkdir(parents=True)
+    sources = iter(sources)
+    num_written = 0
+    in_flight = {}
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        with open(output_file, "w", encoding="utf-8") as f:
+            while num_written < num_questions_total:
+                while (
+                    len(in_flight) < max_concurrency
+                    and num_written + len(in_flight) * num_questions_per_source < num_questions_total
+                ):
+                    source = next(sources, None)
+                    if source is None:
+                        break
+                    in_flight[executor.submit(generate_for_source, source)] = source
+                if not in_flight:
+                    logger.warning("Ran out of sources after generating %d questions", num_written)
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del in_flight[future]
+                    for item in future.result()[: num_questions_total - num_written]:
+                        f.write(json.dumps(item) + "\n")
+                        num_written += 1
+                # Flush after each source, so that the questions so far are kept if generation is interrupted
+                f.flush()
+                logger.info("Generated %d of %d questions", num_written, num_questions_total)
+        if in_flight:
+            logger.info("Generated enough questions already, cancelling %d outstanding sources", len(in_flight))
+    finally:
+        # Sources that haven't started are cancelled, and the results of any running calls are ignored
+        executor.shutdown(wait=False, cancel_futures=True)
+        if hasattr(sources, "close"):
+            # Lets a retriever stop fetching more sources
+            sources.close()
+    return num_written
+
+
 def generate_test_qa_data(
     openai_config: dict,
     num_questions_total: int,
@@ -20,6 +80,7 @@ def generate_test_qa_data(
     source_retriever: Generator[dict, None, None],
     source_to_text: callable,
     answer_formatter: callable,
+    max_concurrency: int = 1,
 ):
     try:
         from azure.ai.generative.synthetic.qa import QADataGenerator, QAType
@@ -27,6 +88,7 @@ def generate_test_qa_data(
         logger.error(
             "Azure AI Generative package is deprecated and no longer working, so this functionality is disabled."
         )
+        return
 
     logger.info(
         "Generating %d questions total, %d per source, based on search results",
@@ -35,27 +97,27 @@ def generate_test_qa_data(
     )
     qa_generator = QADataGenerator(model_config=openai_config)
 
-    qa: list[dict] = []
-    for source in source_retriever():
-        if len(qa) > num_questions_total:
-            logger.info("Generated enough questions already, stopping")
-            break
+    def generate_for_source(source) -> list[dict]:
         result = qa_generator.generate(
             text=source_to_text(source),
             qa_type=QAType.LONG_ANSWER,
             num_questions=num_questions_per_source,
         )
+        return [
+            {"question": question, "truth": answer_formatter(answer, source)}
+            for question, answer in result["question_answers"]
+        ]
 
-        for question, answer in result["question_answers"]:
-            qa.append({"question": question, "truth": answer_formatter(answer, source)})
-
-    logger.info("Writing %d questions to %s", len(qa), output_file)
-    directory = Path(output_file).parent
-    if not directory.exists():
-        directory.mkdir(parents=True)
-    with open(output_file, "w", encoding="utf-8") as f:
-        for item in qa[0:num_questions_total]:
-            f.write(json.dumps(item) + "\n")
+    logger.info("Writing questions to %s as they are generated", output_file)
+    num_written = write_generated_qa(
+        source_retriever(),
+        generate_for_source,
+        num_questions_total,
+        num_questions_per_source,
+        output_file,
+        max_concurrency=max_concurrency,
+    )
+    logger.info("Wrote %d questions to %s", num_written, output_file)
 
 
 def generate_test_qa_data_for_search_index(
@@ -63,13 +125,12 @@ def generate_test_qa_data_for_search_index(
     num_questions_total: int,
     num_questions_per_source: int,
     output_file: Path,
-    search_client: SearchClient,
+    search_client: SearchClient | JsonlSearchClient,
     citation_field_name: str,
+    max_concurrency: int = 1,
+    max_per_citation: int | None = None,
 ):
-    def source_retriever() -> Generator[dict, None, None]:
-        for doc in search_client.search("", top=1000):
-            logger.info("Processing search document %s", doc[citation_field_name])
-            yield doc
+    source_retriever = SearchIndexRetriever(search_client, citation_field_name, max_per_citation=max_per_citation)
 
     def source_to_text(source) -> str:
         return source["content"]
@@ -85,14 +146,67 @@ def generate_test_qa_data_for_search_index(
         source_retriever,
         source_to_text,
         answer_formatter,
+        max_concurrency=max_concurrency,
     )
 
 
-def generate_based_on_questions(openai_client, model: str, qa: list, num_questions: int, prompt: str):
+# Rough number of tokens of existing questions to include in each prompt for off-topic questions
+DONTKNOWS_CONTEXT_TOKENS = 2000
+
+# Number of extra calls for each category of off-topic questions, when too many of its questions were duplicates
+DONTKNOWS_TOP_UP_ROUNDS = 3
+
+# Categories of off-topic questions, with whether their prompt includes existing questions
+DONTKNOWS_PROMPTS = [
+    (
+        "Given these questions, suggest {num_questions} questions that are very related but are not directly answerable by the same sources. Do not simply ask for other examples of the same thing - your question should be standalone.",  # noqa: E501
+        True,
+    ),
+    (
+        "Given these questions, suggest {num_questions} questions with similar keywords that are about publicly known facts.",  # noqa: E501
+        True,
+    ),
+    (
+        "Given these questions, suggest {num_questions} questions that are not related to these topics at all but have well known answers.",  # noqa: E501
+        True,
+    ),
+    (
+        "Suggest {num_questions} questions that are nonsensical, and would result in confusion if you asked it.",
+        False,
+    ),
+]
+
+
+def sample_questions(qa: list, max_tokens: int | None, rng: random.Random = random) -> list[str]:
+    """Shuffle the questions for some randomness, keeping as many as fit within the (estimated) token budget."""
+    questions = [item["question"] for item in rng.sample(qa, len(qa))]
+    if max_tokens is None:
+        return questions
+    sampled = []
+    num_tokens = 0
+    for question in questions:
+        # Each question also takes a token for its newline
+        num_tokens += estimate_tokens(question) + 1
+        if num_tokens > max_tokens:
+            break
+        sampled.append(question)
+    return sampled
+
+
+def generate_based_on_questions(
+    openai_client,
+    model: str,
+    qa: list,
+    num_questions: int,
+    prompt: str,
+    max_context_tokens: int | None = None,
+    avoid_questions: list[str] | None = None,
+):
     existing_questions = ""
     if qa:
-        qa = random.sample(qa, len(qa))  # Shuffle questions for some randomness
-        existing_questions = "\n".join([item["question"] for item in qa])
+        existing_questions = "\n".join(sample_questions(qa, max_context_tokens))
+    if avoid_questions:
+        existing_questions += "\nDo not suggest any of these questions again:\n" + "\n".join(avoid_questions)
 
     gpt_response = openai_client.chat.completions.create(
         model=model,
@@ -107,49 +221,78 @@ def generate_based_on_questions(openai_client, model: str, qa: list, num_questio
         temperature=0.3,
     )
 
+    lines = [strip_list_marker(line) for line in gpt_response.choices[0].message.content.split("\n")]
     qa = []
-    for message in gpt_response.choices[0].message.content.split("\n")[0:num_questions]:
+    for message in [line for line in lines if line][0:num_questions]:
         qa.append({"question": message, "truth": f"Generated from this prompt: {prompt}"})
     return qa
 
 
-def generate_dontknows_qa_data(openai_config: dict, num_questions_total: int, input_file: Path, output_file: Path):
+def generate_dontknows_qa_data(
+    openai_config: dict,
+    num_questions_total: int,
+    input_file: Path,
+    output_file: Path,
+    max_context_tokens: int = DONTKNOWS_CONTEXT_TOKENS,
+):
     logger.info("Generating off-topic questions based on %s", input_file)
-    with open(input_file, encoding="utf-8") as f:
-        qa = [json.loads(line) for line in f.readlines()]
+    qa = read_jsonl(input_file)
 
     openai_client = service_setup.get_openai_client(openai_config)
-    dontknows_qa = []
-    num_questions_each = math.ceil(num_questions_total / 4)
-    dontknows_qa += generate_based_on_questions(
-        openai_client,
-        openai_config.model,
-        qa,
-        num_questions_each,
-        f"Given these questions, suggest {num_questions_each} questions that are very related but are not directly answerable by the same sources. Do not simply ask for other examples of the same thing - your question should be standalone.",  # noqa: E501
-    )
-    dontknows_qa += generate_based_on_questions(
-        openai_client,
-        openai_config.model,
-        qa,
-        num_questions_each,
-        f"Given these questions, suggest {num_questions_each} questions with similar keywords that are about publicly known facts.",  # noqa: E501
-    )
-    dontknows_qa += generate_based_on_questions(
-        openai_client,
-        openai_config.model,
-        qa,
-        num_questions_each,
-        f"Given these questions, suggest {num_questions_each} questions that are not related to these topics at all but have well known answers.",  # noqa: E501
-    )
-    remaining = num_questions_total - len(dontknows_qa)
-    dontknows_qa += generate_based_on_questions(
-        openai_client,
-        openai_config.model,
-        qa=None,
-        num_questions=remaining,
-        prompt=f"Suggest {remaining} questions that are nonsensical, and would result in confusion if you asked it.",  # noqa: E501
-    )
+    model = openai_config.get("azure_deployment") or openai_config.get("model")
+    # Off-topic questions shouldn't repeat each other, or the questions that can be answered
+    deduplicator = QuestionDeduplicator()
+    for item in qa:
+        deduplicator.add(item["question"])
+
+    # Split the total exactly, with the remainder going to the first categories
+    num_questions_each, num_extra = divmod(num_questions_total, len(DONTKNOWS_PROMPTS))
+    num_wanted = [num_questions_each + (category < num_extra) for category in range(len(DONTKNOWS_PROMPTS))]
+    dontknows_by_category = [[] for _ in DONTKNOWS_PROMPTS]
+    num_duplicates = 0
+
+    def generate_for_category(category: int, num_questions: int) -> list[dict]:
+        prompt, uses_existing_questions = DONTKNOWS_PROMPTS[category]
+        return generate_based_on_questions(
+            openai_client,
+            model,
+            qa if uses_existing_questions else None,
+            num_questions,
+            prompt.format(num_questions=num_questions),
+            max_context_tokens=max_context_tokens,
+            avoid_questions=sample_questions(dontknows_by_category[category], max_context_tokens),
+        )
+
+    # The categories are generated at once, then any that are short of questions get another call for the rest
+    with ThreadPoolExecutor(max_workers=len(DONTKNOWS_PROMPTS)) as executor:
+        for top_up_round in range(DONTKNOWS_TOP_UP_ROUNDS + 1):
+            num_missing = {
+                category: num_wanted[category] - len(dontknows_by_category[category])
+                for category in range(len(DONTKNOWS_PROMPTS))
+                if len(dontknows_by_category[category]) < num_wanted[category]
+            }
+            if not num_missing:
+                break
+            if top_up_round:
+                logger.info("Generating %d more questions to replace duplicates", sum(num_missing.values()))
+            futures = {
+                category: executor.submit(generate_for_category, category, num_questions)
+                for category, num_questions in num_missing.items()
+            }
+            # Deduplicate in the order of the categories, so the results don't depend on which call finished first
+            for category, future in futures.items():
+                for item in future.result():
+                    if len(dontknows_by_category[category]) >= num_wanted[category]:
+                        break
+                    if deduplicator.add(item["question"]):
+                        dontknows_by_category[category].append(item)
+                    else:
+                        num_duplicates += 1
+    dontknows_qa = [item for category_qa in dontknows_by_category for item in category_qa]
+    if num_duplicates:
+        logger.info("Removed %d duplicate questions", num_duplicates)
+    if len(dontknows_qa) < num_questions_total:
+        logger.warning("Only generated %d unique off-topic questions out of %d", len(dontknows_qa), num_questions_total)
 
     logger.info("Writing %d off-topic questions to %s", len(dontknows_qa), output_file)
     directory = Path(output_file).parent
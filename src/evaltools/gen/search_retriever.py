@@ -0,0 +1,185 @@
+import json
+import logging
+import queue
+import threading
+from collections import Counter
+from collections.abc import Iterator
+from pathlib import Path
+
+logger = logging.getLogger("evaltools")
+
+# Azure AI Search can't skip past this many results, so paging through a query stops there
+MAX_SEARCH_RESULTS = 100_000
+
+# Marks the end of the pages in the prefetch queue
+_DONE = object()
+
+
+class JsonlPageIterator:
+    """Iterates over pages of documents, with a continuation token (the offset of the next page)
+    that can be passed to by_page() to continue from the next page, like the Azure AI Search client's pages."""
+
+    def __init__(self, documents: list[dict], page_size: int, continuation_token: str | None = None):
+        self._documents = documents
+        self._page_size = page_size
+        offset = int(continuation_token or 0)
+        self.continuation_token = str(offset) if offset < len(documents) else None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Iterator[dict]:
+        if self.continuation_token is None:
+            raise StopIteration
+        offset = int(self.continuation_token)
+        page = self._documents[offset : offset + self._page_size]
+        offset += len(page)
+        self.continuation_token = str(offset) if offset < len(self._documents) else None
+        return iter(page)
+
+
+class JsonlSearchPaged:
+    """Results of a JsonlSearchClient search, which can be read a page at a time."""
+
+    def __init__(self, documents: list[dict], page_size: int, include_total_count: bool):
+        self._documents = documents
+        self._page_size = page_size
+        self._include_total_count = include_total_count
+
+    def get_count(self) -> int | None:
+        return len(self._documents) if self._include_total_count else None
+
+    def by_page(self, continuation_token: str | None = None) -> JsonlPageIterator:
+        return JsonlPageIterator(self._documents, self._page_size, continuation_token)
+
+    def __iter__(self) -> Iterator[dict]:
+        for page in self.by_page():
+            yield from page
+
+
+class JsonlSearchClient:
+    """Local stand-in for the Azure AI Search client, returning the documents of a JSONL file in pages.
+    Only empty searches are supported, since it's meant for generating questions without a search service."""
+
+    def __init__(self, path: Path, page_size: int = 50):
+        self.path = Path(path)
+        self.page_size = page_size
+
+    def search(
+        self,
+        search_text: str | None = None,
+        *,
+        select: list[str] | None = None,
+        top: int | None = None,
+        include_total_count: bool | None = None,
+        **kwargs,
+    ) -> JsonlSearchPaged:
+        if search_text not in (None, "", "*"):
+            raise ValueError("JsonlSearchClient only supports empty searches")
+        documents = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if top is not None and len(documents) >= top:
+                    break
+                if line.strip():
+                    document = json.loads(line)
+                    if select:
+                        document = {field: document.get(field) for field in select}
+                    documents.append(document)
+        return JsonlSearchPaged(documents, self.page_size, bool(include_total_count))
+
+
+class SearchIndexRetriever:
+    """Retrieves the documents of a search index to generate questions from, one page at a time.
+
+    Only the citation and content fields are fetched. Pages are fetched by a background thread,
+    up to prefetch_pages ahead of the documents being processed, following the continuation token of each page.
+    With max_per_citation, at most that many documents (chunks) are kept for each citation (source),
+    so that the questions are spread across the sources instead of coming from the longest ones.
+    """
+
+    def __init__(
+        self,
+        search_client,
+        citation_field_name: str,
+        content_field_name: str = "content",
+        max_documents: int | None = None,
+        max_per_citation: int | None = None,
+        prefetch_pages: int = 2,
+    ):
+        self.search_client = search_client
+        self.citation_field_name = citation_field_name
+        self.content_field_name = content_field_name
+        self.max_documents = max_documents
+        self.max_per_citation = max_per_citation
+        self.prefetch_pages = prefetch_pages
+        self.num_pages = 0
+        self.continuation_token = None
+
+    def _fetch_pages(self, pages: queue.Queue, stop: threading.Event):
+        def put(item) -> bool:
+            # Give up on the page if the documents are no longer needed
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            results = self.search_client.search(
+                "",
+                select=[self.citation_field_name, self.content_field_name],
+                top=self.max_documents or MAX_SEARCH_RESULTS,
+                include_total_count=True,
+            )
+            total = results.get_count()
+            if total is not None:
+                logger.info("The search index has %d documents", total)
+                if total > MAX_SEARCH_RESULTS and not self.max_documents:
+                    logger.warning("Only the first %d documents of the search index can be read", MAX_SEARCH_RESULTS)
+            page_iterator = results.by_page()
+            for page in page_iterator:
+                page = list(page)
+                self.num_pages += 1
+                # The token for the page after this one, so that a failure can report how far the retrieval got
+                self.continuation_token = page_iterator.continuation_token
+                if not put(page):
+                    return
+            put(_DONE)
+        except Exception as e:
+            logger.error(
+                "Failed to fetch search results after %d pages (continuation token: %s)",
+                self.num_pages,
+                self.continuation_token,
+            )
+            put(e)
+
+    def __call__(self) -> Iterator[dict]:
+        pages = queue.Queue(maxsize=self.prefetch_pages)
+        stop = threading.Event()
+        fetcher = threading.Thread(target=self._fetch_pages, args=(pages, stop), daemon=True)
+        fetcher.start()
+        num_per_citation = Counter()
+        num_skipped = 0
+        try:
+            while (page := pages.get()) is not _DONE:
+                if isinstance(page, Exception):
+                    raise page
+                for doc in page:
+                    citation = doc[self.citation_field_name]
+                    if self.max_per_citation and num_per_citation[citation] >= self.max_per_citation:
+                        num_skipped += 1
+                        continue
+                    num_per_citation[citation] += 1
+                    logger.info("Processing search document %s", citation)
+                    yield doc
+        finally:
+            stop.set()
+            if num_skipped:
+                logger.info(
+                    "Skipped %d documents from sources that already had %d documents",
+                    num_skipped,
+                    self.max_per_citation,
+                )
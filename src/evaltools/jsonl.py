@@ -0,0 +1,84 @@
+"""Streaming JSONL reader shared by the evaluate, generate and review commands.
+Rows are parsed lazily, and files are read in binary mode so that each row's byte offset is known."""
+
+import json
+from collections.abc import Iterator
+from pathlib import Path
+
+# Use a faster JSON decoder if one is installed. Neither accepts the NaN that json.dumps writes
+# for unparseable metric scores, so rows that the fast decoder rejects are parsed again with json.loads.
+try:
+    import orjson
+
+    _fast_loads = orjson.loads
+    _FAST_DECODE_ERRORS = (orjson.JSONDecodeError,)
+except ImportError:
+    try:
+        import msgspec
+
+        _fast_loads = msgspec.json.Decoder().decode
+        _FAST_DECODE_ERRORS = (msgspec.DecodeError,)
+    except ImportError:
+        _fast_loads = None
+        _FAST_DECODE_ERRORS = ()
+
+
+def loads(data: bytes | str):
+    if _fast_loads is not None:
+        try:
+            return _fast_loads(data)
+        except _FAST_DECODE_ERRORS:
+            pass
+    return json.loads(data)
+
+
+# Size of the chunks used when counting rows without parsing them
+_CHUNK_SIZE = 1024 * 1024
+
+
+def iter_jsonl_with_offsets(path: Path, limit: int | None = None, offset: int = 0) -> Iterator[tuple[int, dict]]:
+    """Yield (byte offset, row) for each row of a JSONL file, starting at the given byte offset.
+    Blank lines are skipped, and iteration stops after `limit` rows if specified."""
+    if limit is not None and limit <= 0:
+        return
+    num_rows = 0
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while line := f.readline():
+            if line.strip():
+                yield offset, loads(line)
+                num_rows += 1
+                if limit is not None and num_rows >= limit:
+                    return
+            offset += len(line)
+
+
+def iter_jsonl(path: Path, limit: int | None = None, offset: int = 0) -> Iterator[dict]:
+    """Yield each row of a JSONL file, parsing one line at a time."""
+    return (row for _, row in iter_jsonl_with_offsets(path, limit=limit, offset=offset))
+
+
+def read_jsonl_row(file, offset: int) -> dict:
+    """Read the row at a byte offset from a JSONL file that's already open in binary mode."""
+    file.seek(offset)
+    return loads(file.readline())
+
+
+def read_jsonl(path: Path, limit: int | None = None) -> list[dict]:
+    return list(iter_jsonl(path, limit=limit))
+
+
+def count_jsonl_rows(path: Path, limit: int | None = None) -> int:
+    """Count the non-blank rows of a JSONL file without parsing them."""
+    with open(path, "rb") as f:
+        num_rows = 0
+        pending = b""
+        while chunk := f.read(_CHUNK_SIZE):
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            num_rows += sum(1 for line in lines if line.strip())
+            if limit is not None and num_rows >= limit:
+                return limit
+        if pending.strip():
+            num_rows += 1
+    return num_rows if limit is None else min(num_rows, limit)
@@ -0,0 +1,94 @@
+from pathlib import Path
+
+import pandas as pd
+
+from evaltools.columnar import iter_results
+from evaltools.runs import LOWER_IS_BETTER_METRICS, normalize_question
+
+RANK_BY_OPTIONS = ["regression", "variance"]
+
+
+def get_run_names(directories: list[Path]) -> list[str]:
+    """Name each run after its folder, adding a number when folders have the same name."""
+    names = []
+    for directory in directories:
+        name = directory.name
+        while name in names:
+            name = f"{directory.name} ({len(names) + 1})"
+        names.append(name)
+    return names
+
+
+def load_run(directory: Path) -> pd.DataFrame:
+    """Load the question and numeric metric columns of a run, indexed by the normalized question."""
+    rows = pd.DataFrame(iter_results(directory, exclude_columns=["context", "answer", "truth"]))
+    df = pd.DataFrame({"question": rows["question"]})
+    for column in rows.columns.drop("question"):
+        # Booleans (like has_citation) become 0/1, and invalid values (like "Failed" ratings) become NaN
+        values = pd.to_numeric(rows[column], errors="coerce")
+        if values.notna().any():
+            df[column] = values.astype(float)
+    df.index = df["question"].map(normalize_question)
+    # If a question was asked more than once, compare its first answer
+    return df[~df.index.duplicated()]
+
+
+def build_comparison(directories: list[Path], metrics: list[str] | None = None) -> pd.DataFrame:
+    """Join the results of all the runs on their questions, in a single pass over each run.
+
+    Returns a frame with one row per question and a (metric, run) column for each metric of each run,
+    along with a "question" column. Questions missing from a run have NaN values for that run.
+    By default, the metrics are the numeric columns that all the runs have.
+    """
+    run_names = get_run_names(directories)
+    runs = [load_run(directory) for directory in directories]
+    if metrics is None:
+        metrics = [column for column in runs[0].columns if column != "question"]
+        metrics = [metric for metric in metrics if all(metric in run.columns for run in runs[1:])]
+    metric_frames = {
+        metric: pd.concat(
+            [run[metric] if metric in run.columns else pd.Series(dtype=float) for run in runs],
+            axis=1,
+            keys=run_names,
+        )
+        for metric in metrics
+    }
+    comparison = pd.concat(metric_frames, axis=1)
+    questions = pd.concat([run["question"] for run in runs])
+    comparison["question"] = questions[~questions.index.duplicated()]
+    return comparison
+
+
+def rank_questions(
+    comparison: pd.DataFrame, metric: str, rank_by: str = "regression", limit: int | None = None
+) -> pd.DataFrame:
+    """Rank the questions by how much a metric got worse compared to the first run ("regression"),
+    or by how much the metric varies across all the runs ("variance")."""
+    values = comparison[metric]
+    if rank_by == "regression":
+        # Compare each run to the first run, flipping the sign when higher values are worse
+        deltas = values.sub(values.iloc[:, 0], axis=0).iloc[:, 1:]
+        if metric in LOWER_IS_BETTER_METRICS:
+            deltas = -deltas
+        score = -deltas.min(axis=1)
+    elif rank_by == "variance":
+        score = values.var(axis=1, ddof=0)
+    else:
+        raise ValueError(f"rank_by must be one of {RANK_BY_OPTIONS}, got {rank_by}")
+    ranked = values.assign(question=comparison["question"], **{rank_by: score}).dropna(subset=[rank_by])
+    ranked = ranked.sort_values(rank_by, ascending=False, kind="stable")
+    return ranked.head(limit) if limit else ranked
+
+
+def to_markdown(ranked: pd.DataFrame) -> str:
+    columns = ["question", *[column for column in ranked.columns if column != "question"]]
+    lines = ["| " + " | ".join(columns) + " |", "|" + " |".join(["---"] * len(columns)) + " |"]
+    for row in ranked[columns].itertuples(index=False):
+        cells = [str(round(value, 2)) if isinstance(value, float) else str(value) for value in row]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main(directories: list[Path], metric: str, rank_by: str = "regression", limit: int | None = None) -> str:
+    comparison = build_comparison(directories, metrics=[metric])
+    return to_markdown(rank_questions(comparison, metric, rank_by=rank_by, limit=limit))
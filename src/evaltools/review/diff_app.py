@@ -2,35 +2,92 @@
 from pathlib import Path
 
 from textual.app import App, ComposeResult
+from textual.binding import Binding
 from textual.containers import Horizontal, Vertical, VerticalScroll
-from textual.widgets import Button, DataTable, Markdown, Static
+from textual.widgets import Button, DataTable, Input, Markdown, Static
 
+from .row_store import RowStore
 from .utils import diff_directories
 
+# Number of rows read ahead of the current question, so paging forward doesn't wait on the disk
+PREFETCH_ROWS = 20
+
 
 class DiffApp(App):
     CSS_PATH = "diff_app.tcss"
+    BINDINGS = [
+        Binding("right,n", "next_question", "Next"),
+        Binding("left,p", "previous_question", "Previous"),
+        Binding("g", "focus_jump", "Jump to question"),
+        Binding("q", "quit", "Quit"),
+    ]
 
     def __init__(self, directories: list[Path], changed: str = None):
         super().__init__()
         # Only include the first directory if the second is not provided
         self.directories = directories
         self.changed = changed
-        self.data_dicts = []  # Store dicts keyed by question
-        self.result_index = 0  # Based on results in the first directory
+        self.stores = []  # Rows of each directory, read as they're shown
+        self.questions = None  # Questions to show when filtering by a changed column, otherwise all rows are shown
+        self.num_results = None  # Counted in the background, since it takes a scan of the whole file
+        self.result_index = -1  # Based on results in the first directory
 
     def on_mount(self):
-        self.data_dicts = diff_directories(self.directories)
-        self.next_question()
+        self.stores = [RowStore(directory / "eval_results.jsonl") for directory in self.directories]
+        if self.changed:
+            # Filtering needs every row, so only then are all the results read up front
+            self.questions = list(diff_directories(self.directories, self.changed)[0].keys())
+            self.num_results = len(self.questions)
+            self.stores[0].index_questions()
+        else:
+            self.run_worker(self.count_results, thread=True, group="count")
+        # Questions that aren't at the same position in the other directories are looked up in an index,
+        # which takes parsing every row, so it's built in the background
+        if len(self.stores) > 1:
+            self.run_worker(self.index_questions, thread=True, group="index")
+        self.show_question(0)
+
+    def on_unmount(self):
+        for store in self.stores:
+            store.close()
+
+    def count_results(self):
+        num_results = len(self.stores[0])
+        self.call_from_thread(self.set_num_results, num_results)
+
+    def index_questions(self):
+        for store in self.stores[1:]:
+            store.index_questions()
+        self.call_from_thread(self.on_questions_indexed)
+
+    def on_questions_indexed(self):
+        # Fill in any answers that were still being looked up
+        if self.result_index >= 0:
+            self.show_question(self.result_index)
+
+    def set_num_results(self, num_results: int):
+        self.num_results = num_results
+        self.update_position()
 
     def on_button_pressed(self, event: Button.Pressed) -> None:
         if event.button.id == "quit":
             self.exit()
+        elif event.button.id == "previous":
+            self.action_previous_question()
         else:
-            self.next_question()
+            self.action_next_question()
+
+    def on_input_submitted(self, event: Input.Submitted) -> None:
+        try:
+            self.show_question(int(event.value) - 1)
+        except ValueError:
+            self.notify(f"{event.value} is not a question number", severity="warning")
+        event.input.clear()
+        self.set_focus(None)
 
     def compose(self) -> ComposeResult:
         with Vertical():
+            yield Static(id="position")
             yield Static(id="question")
             with Horizontal(id="sources"):
                 for directory in self.directories:
@@ -48,29 +105,56 @@ class DiffApp(App):
                 for ind in range(len(self.directories)):
                     yield DataTable(id=f"metrics{ind}", show_cursor=False, cell_padding=1)
             with Horizontal(id="buttons"):
+                yield Button("Previous question", id="previous", classes="button")
                 yield Button.success("Next question", classes="button")
+                yield Input(placeholder="Go to question #", id="jump", type="integer")
                 yield Button.error("Quit", id="quit", classes="button")
 
-    def next_question(self):
-        if self.result_index >= len(self.data_dicts[0]):
-            self.exit()
+    def action_next_question(self):
+        self.show_question(self.result_index + 1)
+
+    def action_previous_question(self):
+        self.show_question(self.result_index - 1)
+
+    def action_focus_jump(self):
+        self.query_one("#jump", Input).focus()
+
+    def get_first_row(self, index: int) -> dict | None:
+        if self.questions is None:
+            return self.stores[0].get(index)
+        if 0 <= index < len(self.questions):
+            return self.stores[0].find(self.questions[index], hint=index)
+        return None
+
+    def update_position(self):
+        num_results = "?" if self.num_results is None else self.num_results
+        self.query_one("#position", Static).update(f"Question {self.result_index + 1} of {num_results}")
+
+    def show_question(self, index: int):
+        first_row = self.get_first_row(index) if index >= 0 else None
+        if first_row is None:
+            self.bell()
             return
-        question = list(self.data_dicts[0].keys())[self.result_index]
+        self.result_index = index
+        question = first_row["question"]
+        self.update_position()
         self.query_one("#question", Static).update(question)
 
-        for ind in range(len(self.directories)):
-            try:
-                self.query_one(f"#answer{ind}", Markdown).update(self.data_dicts[ind][question]["answer"])
-                if len(self.directories) == 1:
-                    self.query_one("#answer_truth", Markdown).update(self.data_dicts[0][question]["truth"])
-            except KeyError:
-                self.query_one(f"#answer{ind}", Markdown).update("No answer found for that question")
+        for ind, store in enumerate(self.stores):
+            # Rows in the other directories are usually at the same position, so look there first
+            question_results = first_row if ind == 0 else store.find(question, hint=index, build_index=False)
+            if question_results is None:
+                message = "No answer found for that question" if store.has_question_index else "Looking up answer..."
+                self.query_one(f"#answer{ind}", Markdown).update(message)
+                self.query_one(f"#metrics{ind}", DataTable).clear(columns=True)
                 continue
+            self.query_one(f"#answer{ind}", Markdown).update(question_results["answer"])
+            if len(self.directories) == 1:
+                self.query_one("#answer_truth", Markdown).update(question_results["truth"])
 
             # Find all fields in the result that have numeric values
             metric_columns = []
             metric_values = []
-            question_results = self.data_dicts[ind][question]
             for column, value in question_results.items():
                 if isinstance(value, int | float):
                     metric_columns.append(column)
@@ -80,7 +164,12 @@ class DiffApp(App):
             datatable.add_row(*metric_values)
             datatable.add_row("" * len(metric_columns))
 
-        self.result_index += 1
+        if self.questions is None:
+            self.run_worker(lambda: self.prefetch(index + 1), thread=True, exclusive=True, group="prefetch")
+
+    def prefetch(self, start: int):
+        for store in self.stores:
+            store.prefetch(start, PREFETCH_ROWS)
 
 
 def main(directories: list[Path], changed: str | None = None):
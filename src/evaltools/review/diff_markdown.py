@@ -1,7 +1,14 @@
+import heapq
+import io
+import math
+from collections.abc import Iterator
 from pathlib import Path
-from typing import Any
+from typing import Any, TextIO
 
-from .utils import diff_directories
+from evaltools.jsonl import iter_jsonl
+
+from .row_store import RowStore
+from .utils import is_same_value
 
 
 def _round_metric(value: Any) -> Any:
@@ -10,46 +17,112 @@ def _round_metric(value: Any) -> Any:
     return value
 
 
-def main(directories: list[Path], changed: str | None = None):
-    data_dicts = diff_directories(directories, changed)
+def _is_number(value: Any) -> bool:
+    return isinstance(value, int | float)
 
-    markdown_str = ""
-    for question in data_dicts[0].keys():
-        markdown_str += f"**{question}**\n\n"
-        # now make an HTML table with the answers
-        markdown_str += "<table>\n"
-        markdown_str += (
-            "<tr><th></th>"
-            + "".join([f"<th>{directory.name}</th>" for directory in directories])
-            + "<th>ground_truth</th></tr>\n"
-        )
-        markdown_str += (
-            "<tr><th>answer</th>"
-            + "".join([f"<td>{data_dict[question]['answer']}</td>" for data_dict in data_dicts])
-            + f"<td>{data_dicts[0][question]['truth']}</td></tr>\n"
+
+def _is_changed(rows: list[dict | None], column: str) -> bool:
+    """Whether the value of the column differs between the first run and any other run."""
+    values = [row.get(column) if row else None for row in rows]
+    if any(value is None for value in values):
+        return False
+    return not all(is_same_value(value, values[0]) for value in values[1:])
+
+
+def _get_delta(rows: list[dict | None], column: str) -> float | None:
+    """The spread of a numeric column across the runs, or None if any run is missing it (or has NaN,
+    which can't be ranked)."""
+    values = [row.get(column) if row else None for row in rows]
+    if not all(_is_number(value) and not math.isnan(value) for value in values):
+        return None
+    return max(values) - min(values)
+
+
+def _render_question(directories: list[Path], rows: list[dict | None]) -> str:
+    first_row = rows[0]
+    question = first_row["question"]
+    answers = ["No answer found for that question" if row is None else row["answer"] for row in rows]
+    parts = [f"**{question}**\n\n", "<table>\n"]
+    parts.append(
+        "<tr><th></th>"
+        + "".join(f"<th>{directory.name}</th>" for directory in directories)
+        + "<th>ground_truth</th></tr>\n"
+    )
+    parts.append(
+        "<tr><th>answer</th>"
+        + "".join(f"<td>{answer}</td>" for answer in answers)
+        + f"<td>{first_row['truth']}</td></tr>\n"
+    )
+    # make a row for each metric of the first run
+    for metric_name, first_value in first_row.items():
+        if not _is_number(first_value):
+            continue
+        cells = []
+        for ind, row in enumerate(rows):
+            raw_value = row.get(metric_name) if row else None
+            value = _round_metric(raw_value)
+            # Insert arrow emoji based on the difference between metric value and the first run
+            value_emoji = ""
+            if ind > 0 and _is_number(value) and not is_same_value(value, _round_metric(first_value)):
+                value_emoji = "⬆️" if raw_value > first_value else "⬇️"
+            cells.append(f"<td>{value} {value_emoji}</td>")
+        parts.append(f"<tr><th>{metric_name}</th>" + "".join(cells) + "<td>N/A</td></tr>\n")
+    parts.append("</table>\n\n")
+    return "".join(parts)
+
+
+def _iter_row_sets(stores: list[RowStore], changed: str | None) -> Iterator[tuple[int, list[dict | None]]]:
+    """Yield the position of each question in the first run along with its row in every run.
+    The first run is read from its JSONL file, so that the positions match the rows of its RowStore."""
+    for position, first_row in enumerate(iter_jsonl(stores[0].path)):
+        # Rows in the other runs are usually at the same position, so look there first
+        rows = [first_row] + [store.find(first_row["question"], hint=position) for store in stores[1:]]
+        if changed and not _is_changed(rows, changed):
+            continue
+        yield position, rows
+
+
+def write_markdown(
+    directories: list[Path],
+    output: TextIO,
+    changed: str | None = None,
+    limit: int | None = None,
+    sort_by_delta: str | None = None,
+):
+    """Write a markdown report comparing the answers of each question across the runs, one question at a time.
+
+    Only the rows being written are held in memory. When sorting by the change in a metric,
+    the first pass keeps just the position and delta of each question (or of the top `limit` questions),
+    and the second pass reads those rows again by position.
+    """
+    stores = [RowStore(directory / "eval_results.jsonl") for directory in directories]
+    try:
+        if sort_by_delta is None:
+            for num_written, (_, rows) in enumerate(_iter_row_sets(stores, changed)):
+                if limit is not None and num_written >= limit:
+                    break
+                output.write(_render_question(directories, rows))
+            return
+
+        deltas = (
+            (delta, position)
+            for position, rows in _iter_row_sets(stores, changed)
+            if (delta := _get_delta(rows, sort_by_delta)) is not None
         )
+        # Biggest changes first, keeping the order of the test data for ties
+        ranked = heapq.nsmallest(limit, deltas, key=lambda item: (-item[0], item[1])) if limit is not None else None
+        if ranked is None:
+            ranked = sorted(deltas, key=lambda item: (-item[0], item[1]))
+        for _, position in ranked:
+            first_row = stores[0].get(position)
+            rows = [first_row] + [store.find(first_row["question"], hint=position) for store in stores[1:]]
+            output.write(_render_question(directories, rows))
+    finally:
+        for store in stores:
+            store.close()
+
 
-        # now make rows for each metric
-        metrics = {}
-        question_results = data_dicts[0][question]
-        for column, value in question_results.items():
-            if isinstance(value, int | float):
-                metrics[column] = []
-        for metric_name in metrics.keys():
-            first_value = _round_metric(data_dicts[0][question].get(metric_name))
-            for ind, data_dict in enumerate(data_dicts):
-                value = _round_metric(data_dict[question].get(metric_name))
-                # Insert arrow emoji based on the difference between metric value and the first data_dict
-                value_emoji = ""
-                if value is not None and ind > 0 and value != first_value:
-                    value_emoji = "⬆️" if value > data_dicts[0][question][metric_name] else "⬇️"
-                metrics[metric_name].append(f"{value} {value_emoji}")
-        # make a row for each metric
-        for metric_name, metric_values in metrics.items():
-            markdown_str += (
-                f"<tr><th>{metric_name}</th>"
-                + "".join([f"<td>{value}</td>" for value in metric_values])
-                + "<td>N/A</td></tr>\n"
-            )
-        markdown_str += "</table>\n\n"
-    return markdown_str
+def main(directories: list[Path], changed: str | None = None, limit: int | None = None) -> str:
+    output = io.StringIO()
+    write_markdown(directories, output, changed=changed, limit=limit)
+    return output.getvalue()
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+from evaltools.columnar import count_results
+
+logger = logging.getLogger("evaltools")
+
+INDEX_FILENAME = ".evaltools_index.db"
+# Bump this whenever the table layout changes, so that old index files are rebuilt
+INDEX_VERSION = 1
+
+# Stats used for a metric when sorting or filtering by its name alone, in order of preference
+DEFAULT_STATS = ["mean_rating", "mean", "pass_rate", "rate"]
+
+FILTER_PATTERN = re.compile(r"^\s*([^<>=!]+?)\s*(>=|<=|==|!=|>|<)\s*(.+?)\s*$")
+
+
+def get_run_mtime(run_dir: Path) -> float:
+    """Return the latest modification time of a run folder and the files that the summary reads.
+    Files rewritten in place (like when re-scoring a run) don't change the folder's own mtime."""
+    mtimes = [run_dir.stat().st_mtime]
+    for filename in ["summary.json", "evaluate_parameters.json"]:
+        try:
+            mtimes.append((run_dir / filename).stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    return max(mtimes)
+
+
+def get_stat_expression(stat_path: str) -> tuple[str, list[str]]:
+    """Turn "metric.stat" into a SQL expression (and its arguments) that extracts the stat from a run's summary.
+    With just "metric", the stat that the summary table shows for that metric is used."""
+    metric_name, _, stat = stat_path.partition(".")
+    paths = [f'$."{metric_name}"."{stat_name}"' for stat_name in ([stat] if stat else DEFAULT_STATS)]
+    expression = ", ".join(["json_extract(summary, ?)"] * len(paths))
+    return (f"COALESCE({expression})" if len(paths) > 1 else expression), paths
+
+
+class ResultsIndex:
+    """SQLite index of the summaries and parameters of the runs in a results folder.
+
+    The index is stored in the results folder and keyed by each run's modification time,
+    so that only new or changed runs are read again when summarizing.
+    """
+
+    def __init__(self, results_dir: Path):
+        self.results_dir = Path(results_dir)
+        try:
+            self._connection = sqlite3.connect(self.results_dir / INDEX_FILENAME)
+            self._create_table()
+        except sqlite3.OperationalError as e:
+            # For example, a results folder on a read-only share
+            logger.warning("Can't write the results index in %s (%s), so it won't be saved", self.results_dir, e)
+            self._connection = sqlite3.connect(":memory:")
+            self._create_table()
+
+    def _create_table(self):
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version != INDEX_VERSION:
+            self._connection.execute("DROP TABLE IF EXISTS runs")
+            self._connection.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs "
+            "(folder TEXT PRIMARY KEY, mtime REAL NOT NULL, summary TEXT NOT NULL, parameters TEXT NOT NULL, "
+            "num_rows INTEGER NOT NULL)"
+        )
+        self._connection.commit()
+
+    def refresh(self) -> int:
+        """Read the runs that were added or changed since the index was last refreshed,
+        and forget the runs that were removed. Returns the number of runs that were read."""
+        indexed_mtimes = dict(self._connection.execute("SELECT folder, mtime FROM runs"))
+        folders = [f for f in os.listdir(self.results_dir) if os.path.isdir(self.results_dir / f)]
+        num_read = 0
+        for folder in folders:
+            run_dir = self.results_dir / folder
+            mtime = get_run_mtime(run_dir)
+            if indexed_mtimes.get(folder) == mtime:
+                continue
+            if not (run_dir / "summary.json").exists():
+                # The run is still in progress, or was interrupted
+                continue
+            with open(run_dir / "summary.json", encoding="utf-8") as f:
+                summary = f.read()
+            parameters = "{}"
+            if (run_dir / "evaluate_parameters.json").exists():
+                with open(run_dir / "evaluate_parameters.json", encoding="utf-8") as f:
+                    parameters = f.read()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO runs (folder, mtime, summary, parameters, num_rows) VALUES (?, ?, ?, ?, ?)",
+                (folder, mtime, summary, parameters, count_results(run_dir)),
+            )
+            num_read += 1
+        removed = [(folder,) for folder in indexed_mtimes if folder not in folders]
+        self._connection.executemany("DELETE FROM runs WHERE folder = ?", removed)
+        self._connection.commit()
+        if num_read or removed:
+            logger.info("Updated the results index: read %d runs, removed %d runs", num_read, len(removed))
+        return num_read
+
+    def query(
+        self, filters: list[str] | None = None, sort_by: str | None = None, descending: bool = False
+    ) -> list[tuple[str, dict, dict, int]]:
+        """Return (folder, summary, parameters, number of rows) for each indexed run.
+
+        Filters look like "gpt_groundedness.pass_rate>=0.8" or "answer_length<500",
+        and sort_by looks like "gpt_groundedness.mean_rating" or "latency". Runs are sorted by folder name by default.
+        """
+        conditions = []
+        arguments = []
+        for run_filter in filters or []:
+            match = FILTER_PATTERN.match(run_filter)
+            if not match:
+                raise ValueError(f"Filter should look like metric.stat>=value, got {run_filter}")
+            stat_path, operator, value = match.groups()
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+            expression, paths = get_stat_expression(stat_path)
+            conditions.append(f"{expression} {operator} ?")
+            arguments.extend([*paths, value])
+        sql = "SELECT folder, summary, parameters, num_rows FROM runs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if sort_by:
+            # Runs without the stat go last either way
+            direction = "DESC" if descending else "ASC"
+            expression, paths = get_stat_expression(sort_by)
+            sql += f" ORDER BY {expression} IS NULL, {expression} {direction}, folder"
+            arguments.extend(paths * 2)
+        else:
+            sql += " ORDER BY folder DESC" if descending else " ORDER BY folder"
+        return [
+            (folder, json.loads(summary), json.loads(parameters), num_rows)
+            for folder, summary, parameters, num_rows in self._connection.execute(sql, arguments)
+        ]
+
+    def close(self):
+        self._connection.close()
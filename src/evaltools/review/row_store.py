@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from evaltools.jsonl import loads, read_jsonl_row
+
+# Number of lines scanned at a time, so that reading a row never waits long on a scan of the whole file
+SCAN_CHUNK_ROWS = 1000
+
+
+class RowStore:
+    """Rows of a results JSONL file, read on demand instead of all up front.
+
+    The byte offset of each row is recorded the first time the file is scanned past it (without parsing the rows
+    in between), so any row can then be read with a single seek. Recently read rows are kept in a small cache.
+    Scans are done a chunk of lines at a time with their own file handle, so a scan in a background thread
+    (like counting the rows) only holds up reading a row for the length of one chunk.
+    """
+
+    def __init__(self, path: Path, cache_size: int = 256):
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self._file = open(self.path, "rb")
+        self._scan_file = open(self.path, "rb")
+        self._offsets = []
+        self._scan_offset = 0
+        self._scanned_to_end = False
+        self._cache = OrderedDict()
+        self._question_indexes = None
+        # Guards the file handle used for reading rows, and the cache
+        self._lock = threading.Lock()
+        # Guards the scan file handle and the offsets, and is only held while scanning one chunk
+        self._scan_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+
+    def _scan_chunk(self, index: int | None) -> bool:
+        """Record the offsets of up to SCAN_CHUNK_ROWS more rows. Returns whether the given row
+        (or the end of the file, for None) has been reached."""
+        with self._scan_lock:
+            for _ in range(SCAN_CHUNK_ROWS):
+                if self._scanned_to_end or (index is not None and len(self._offsets) > index):
+                    return True
+                self._scan_file.seek(self._scan_offset)
+                line = self._scan_file.readline()
+                if not line:
+                    self._scanned_to_end = True
+                elif line.strip():
+                    self._offsets.append(self._scan_offset)
+                self._scan_offset += len(line)
+            return self._scanned_to_end or (index is not None and len(self._offsets) > index)
+
+    def _scan_until(self, index: int | None):
+        """Record row offsets until the given row (or the end of the file, for None)."""
+        while not self._scan_chunk(index):
+            pass
+
+    def _get_offset(self, index: int) -> int | None:
+        self._scan_until(index)
+        with self._scan_lock:
+            return self._offsets[index] if 0 <= index < len(self._offsets) else None
+
+    def __len__(self) -> int:
+        self._scan_until(None)
+        with self._scan_lock:
+            return len(self._offsets)
+
+    def get(self, index: int) -> dict | None:
+        """Return the row at the given position, or None if the file has fewer rows."""
+        with self._lock:
+            if index in self._cache:
+                self._cache.move_to_end(index)
+                return self._cache[index]
+        if index < 0:
+            return None
+        offset = self._get_offset(index)
+        if offset is None:
+            return None
+        with self._lock:
+            row = read_jsonl_row(self._file, offset)
+            self._cache[index] = row
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return row
+
+    def prefetch(self, start: int, count: int):
+        """Read rows ahead of time, so that paging to them doesn't wait on the disk."""
+        for index in range(start, start + count):
+            if self.get(index) is None:
+                break
+
+    @property
+    def has_question_index(self) -> bool:
+        return self._question_indexes is not None
+
+    def index_questions(self):
+        """Build the index from each question to its row, which takes parsing every row.
+        No lock used for reading rows is held meanwhile, so this can run in a background thread."""
+        with self._index_lock:
+            if self._question_indexes is not None:
+                return
+            self._scan_until(None)
+            with self._scan_lock:
+                offsets = list(self._offsets)
+            question_indexes = {}
+            with open(self.path, "rb") as f:
+                for index, offset in enumerate(offsets):
+                    f.seek(offset)
+                    question_indexes.setdefault(loads(f.readline())["question"], index)
+            self._question_indexes = question_indexes
+
+    def find(self, question: str, hint: int | None = None, build_index: bool = True) -> dict | None:
+        """Return the row for a question. Results of the same test data usually list the questions in the same order,
+        so the row at the hint position is checked first, before falling back to an index of all the questions.
+        Without build_index, None is returned when the question isn't at the hint and the index isn't built yet."""
+        if hint is not None:
+            row = self.get(hint)
+            if row is not None and row["question"] == question:
+                return row
+        if self._question_indexes is None:
+            if not build_index:
+                return None
+            self.index_questions()
+        index = self._question_indexes.get(question)
+        return None if index is None else self.get(index)
+
+    def close(self):
+        with self._lock, self._scan_lock:
+            self._file.close()
+            self._scan_file.close()
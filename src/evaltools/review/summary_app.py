@@ -32,9 +32,9 @@ class ParametersScreen(ModalScreen):
 class TableApp(App):
     CSS_PATH = "summary_app.tcss"
 
-    def __init__(self, results_dir: Path) -> None:
+    def __init__(self, results_dir: Path, **query) -> None:
         super().__init__()
-        self.rows, self.row_parameters = summarize_results(results_dir)
+        self.rows, self.row_parameters = summarize_results(results_dir, **query)
 
     def compose(self) -> ComposeResult:
         with Vertical():
@@ -59,6 +59,6 @@ class TableApp(App):
                 self.push_screen(ParametersScreen(folder, parameters))
 
 
-def main(directory: Path):
-    app = TableApp(directory)
+def main(directory: Path, filters: list[str] | None = None, sort_by: str | None = None, descending: bool = False):
+    app = TableApp(directory, filters=filters, sort_by=sort_by, descending=descending)
     app.run()
@@ -3,8 +3,14 @@ from pathlib import Path
 from .utils import summarize_results
 
 
-def main(results_dir: Path, highlight_run: str | None = None) -> str:
-    rows, row_parameters = summarize_results(results_dir)
+def main(
+    results_dir: Path,
+    highlight_run: str | None = None,
+    filters: list[str] | None = None,
+    sort_by: str | None = None,
+    descending: bool = False,
+) -> str:
+    rows, row_parameters = summarize_results(results_dir, filters=filters, sort_by=sort_by, descending=descending)
     # transpose the rows
     rows = list(map(list, zip(*rows)))
 
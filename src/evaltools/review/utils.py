@@ -1,23 +1,47 @@
-import json
 import math
-import os
+from numbers import Real
 from pathlib import Path
+from typing import Any
 
+from evaltools.columnar import iter_results
 
-def summarize_results(results_dir):
+from .results_index import ResultsIndex
+
+
+def _is_real_number(value: Any) -> bool:
+    return isinstance(value, Real) and not isinstance(value, bool)
+
+
+def is_same_value(value: Any, other: Any) -> bool:
+    """Whether two values of a column are the same, allowing for rounding differences between numbers."""
+    if value == other:
+        return True
+    return _is_real_number(value) and _is_real_number(other) and math.isclose(value, other)
+
+
+def summarize_results(
+    results_dir, filters: list[str] | None = None, sort_by: str | None = None, descending: bool = False
+):
     run_summaries = {}
+    run_parameters = {}
+    run_num_rows = {}
     # first find the shared metrics across the runs
     metric_counts = {}
 
-    folders = [f for f in os.listdir(results_dir) if os.path.isdir(os.path.join(results_dir, f))]
-    folders.sort()
-    for folder in folders:
-        with open(Path(results_dir) / folder / "summary.json", encoding="utf-8") as f:
-            summary = json.load(f)
-            run_summaries[folder] = summary
-            # first find the common parameters across the runs
-            for metric_name in summary:
-                metric_counts[metric_name] = metric_counts.get(metric_name, 0) + 1
+    # Only the runs that changed since the last summary are read again
+    index = ResultsIndex(results_dir)
+    try:
+        index.refresh()
+        runs = index.query(filters=filters, sort_by=sort_by, descending=descending)
+    finally:
+        index.close()
+    for folder, summary, parameters, num_rows in runs:
+        run_summaries[folder] = summary
+        run_parameters[folder] = parameters
+        run_num_rows[folder] = num_rows
+        # first find the common parameters across the runs
+        for metric_name in summary:
+            metric_counts[metric_name] = metric_counts.get(metric_name, 0) + 1
 
     # Only show metrics that have shown up at least twice across runs
     shared_metric_names = [
@@ -62,11 +86,9 @@ def summarize_results(results_dir):
                     run_row.append(summary[metric_name][stat])
                 else:
                     run_row.append("?")
-        with open(Path(results_dir) / folder / "eval_results.jsonl", encoding="utf-8") as f:
-            run_row.append(sum(1 for _ in f))
+        run_row.append(run_num_rows[folder])
         rows.append(run_row)
-        with open(Path(results_dir) / folder / "evaluate_parameters.json", encoding="utf-8") as f:
-            row_parameters[folder] = json.load(f)
+        row_parameters[folder] = run_parameters[folder]
 
     return rows, row_parameters
 
@@ -74,22 +96,22 @@ def summarize_results(results_dir):
 def diff_directories(directories: list[Path], changed: str | None = None):
     data_dicts = []
     for directory in directories:
-        with open(directory / "eval_results.jsonl", encoding="utf-8") as f:
-            data_json = [json.loads(question_json) for question_json in f.readlines()]
-            data_dicts.append({question["question"]: question for question in data_json})
+        # The context isn't shown when diffing, so skip reading it unless it's the column being compared
+        rows = iter_results(directory, exclude_columns=[] if changed == "context" else ["context"])
+        data_dicts.append({row["question"]: row for row in rows})
     if changed:
-        # filter out questions that have the same value for the given column
+        # filter out questions that have the same value for the given column in every directory
         for question in list(data_dicts[0].keys()):
-            # if question isn't in the second directory, skip
-            if question not in data_dicts[1]:
+            # if question isn't in the other directories, skip
+            if any(question not in data_dict for data_dict in data_dicts[1:]):
                 data_dicts[0].pop(question)
                 continue
-            # if either metric is None, skip
-            if data_dicts[0][question].get(changed) is None or data_dicts[1][question].get(changed) is None:
+            values = [data_dict[question].get(changed) for data_dict in data_dicts]
+            # if any metric is None, skip
+            if any(value is None for value in values):
                 data_dicts[0].pop(question)
                 continue
-            if data_dicts[0][question].get(changed) == data_dicts[1][question].get(changed):
-                if math.isclose(data_dicts[0][question].get(changed), data_dicts[1][question].get(changed)):
-                    data_dicts[0].pop(question)
-                    data_dicts[1].pop(question)
+            if all(is_same_value(value, values[0]) for value in values[1:]):
+                for data_dict in data_dicts:
+                    data_dict.pop(question)
     return data_dicts
@@ -0,0 +1,13 @@
+"""Conventions for matching up the results of different runs, shared by the evaluate and review commands."""
+
+import re
+
+# Metrics where a higher value is worse, so an increase counts as a regression
+LOWER_IS_BETTER_METRICS = {"latency"}
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Key used to match a question across runs, ignoring differences in case and whitespace."""
+    return _WHITESPACE_PATTERN.sub(" ", question).strip().casefold()
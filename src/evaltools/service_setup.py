@@ -102,7 +102,7 @@ def get_openai_client(
     if "azure_deployment" in oai_config:
         azure_token_provider = None
 
-        if azure_credential is None and not os.environ.get("AZURE_OPENAI_KEY"):
+        if azure_credential is None and not oai_config.get("api_key") and not os.environ.get("AZURE_OPENAI_KEY"):
             logger.info("Using Azure OpenAI Service with Azure Developer CLI Credential")
             azure_credential = get_azd_credential(os.environ.get("AZURE_OPENAI_TENANT_ID"))
         if azure_credential is not None:
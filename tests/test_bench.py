@@ -0,0 +1,65 @@
+import json
+import random
+
+import pytest
+import requests
+
+from evaltools.bench.benchmark import run_benchmark, time_evaluator_setup
+from evaltools.bench.mock_services import LatencyDistribution, MockJudge
+
+
+def test_latency_distribution():
+    rng = random.Random(0)
+    assert LatencyDistribution("fixed:50").sample_seconds(rng) == 0.05
+    assert 0.02 <= LatencyDistribution("uniform:20:80").sample_seconds(rng) <= 0.08
+    assert LatencyDistribution("exponential:0").sample_seconds(rng) == 0
+    assert LatencyDistribution("lognormal:50:0").sample_seconds(rng) == pytest.approx(0.05)
+    with pytest.raises(ValueError, match="uniform:min_ms:max_ms"):
+        LatencyDistribution("uniform:20")
+
+
+def test_mock_judge_batched_scores():
+    with MockJudge() as judge:
+        response = requests.post(
+            f"{judge.url}/openai/deployments/bench/chat/completions",
+            json={
+                "messages": [{"role": "user", "content": "Rubric\n\n### Item 1\nfirst\n\n### Item 2\nsecond"}],
+                "response_format": {"type": "json_object"},
+            },
+        )
+    content = response.json()["choices"][0]["message"]["content"]
+    assert [item["id"] for item in json.loads(content)["scores"]] == [1, 2]
+
+
+def test_mock_judge_throttles():
+    with MockJudge(throttle_rate=1.0, retry_after_ms=250) as judge:
+        response = requests.post(f"{judge.url}/chat/completions", json={"messages": []})
+    assert response.status_code == 429
+    assert response.headers["retry-after-ms"] == "250"
+    assert judge.stats()["throttled"] == 1
+
+
+def test_run_benchmark(tmp_path):
+    report = run_benchmark(
+        num_questions=10,
+        max_concurrency=4,
+        target_latency="fixed:0",
+        judge_latency="fixed:0",
+        target_throttle_rate=0.2,
+        judge_batch_size=5,
+        requested_metrics=["myrelevance", "answer_length", "latency"],
+        results_dir=tmp_path / "results",
+    )
+    # Every question (and the test question) is answered once, and throttled calls are retried
+    assert report["target"]["calls"] == 11 + report["target"]["throttled"]
+    # A test completion, then the 10 rows in 2 batches
+    assert report["judge"]["calls"] == 3
+    assert report["questions_per_second"] > 0
+    assert set(report["target"]["latency_seconds"]) == {"p50", "p99"}
+    assert (tmp_path / "results" / "eval_results.jsonl").exists()
+
+
+def test_time_evaluator_setup():
+    setup_ms = time_evaluator_setup(["mycoherence", "answer_length"], num_runs=2)
+    assert list(setup_ms) == ["mycoherence", "answer_length"]
+    assert all(ms >= 0 for ms in setup_ms.values())
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+from evaltools.columnar import count_results, iter_results, write_results_table
+
+ROWS = [
+    {"question": "Question 1", "answer": "Answer [info1.txt]", "context": "Long context", "has_citation": True},
+    {"question": "Question 2", "answer": None, "context": "Long context", "has_citation": -1, "gpt_coherence": 4},
+    {"question": "Question 3", "answer": "Answer", "context": "Long context", "gpt_coherence": "Failed"},
+]
+
+
+def write_jsonl_results(results_dir):
+    results_dir.mkdir()
+    with open(results_dir / "eval_results.jsonl", "w", encoding="utf-8") as f:
+        for row in ROWS:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_results_without_parquet(tmp_path):
+    write_jsonl_results(tmp_path / "results")
+    assert count_results(tmp_path / "results") == 3
+    rows = list(iter_results(tmp_path / "results", exclude_columns=["context"]))
+    assert rows == [{key: value for key, value in row.items() if key != "context"} for row in ROWS]
+
+
+def test_results_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    write_jsonl_results(tmp_path / "results")
+    assert write_results_table(ROWS, tmp_path / "results" / "eval_results.parquet")
+    # The Parquet file is read instead of the JSONL file once it exists
+    (tmp_path / "results" / "eval_results.jsonl").unlink()
+    assert count_results(tmp_path / "results") == 3
+    rows = list(iter_results(tmp_path / "results", exclude_columns=["context"]))
+    assert [row["has_citation"] for row in rows] == [True, -1, None]
+    assert [row["gpt_coherence"] for row in rows] == [None, 4, "Failed"]
+    assert [row["answer"] for row in rows] == ["Answer [info1.txt]", None, "Answer"]
+    assert all("context" not in row for row in rows)
@@ -0,0 +1,93 @@
+import pytest
+
+from evaltools.eval.context_budget import ContextBudget, Tokenizer
+
+
+class WordTokenizer(Tokenizer):
+    """Counts each word as a token, so the expected results don't depend on the tiktoken encoding."""
+
+    def __init__(self):
+        pass
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, max_tokens):
+        return " ".join(text.split()[: max(max_tokens, 0)])
+
+
+CONTEXT = "\n\n".join(
+    [
+        "doc1.pdf: one two three four five six seven eight",
+        "doc2.pdf: the pto policy allows twenty days",
+        "doc3.pdf: alpha beta gamma delta",
+    ]
+)
+
+
+def test_context_within_budget_is_unchanged():
+    budget = ContextBudget(100, tokenizer=WordTokenizer())
+    assert budget.apply(CONTEXT, "What is the PTO policy?") == (CONTEXT, False)
+
+
+def test_head_strategy():
+    budget = ContextBudget(4, strategy="head", tokenizer=WordTokenizer())
+    assert budget.apply(CONTEXT) == ("doc1.pdf: one two three", True)
+
+
+def test_proportional_strategy():
+    budget = ContextBudget(10, strategy="proportional", tokenizer=WordTokenizer())
+    context, truncated = budget.apply(CONTEXT)
+    assert truncated
+    # Every chunk keeps its start (and citation), with the longest chunk cut the most
+    assert context.split("\n\n") == ["doc1.pdf: one two three", "doc2.pdf: the pto", "doc3.pdf: alpha"]
+
+
+class SeparatorTokenizer(WordTokenizer):
+    """Also counts each chunk separator as a token, like tiktoken does."""
+
+    def count(self, text):
+        return super().count(text) + text.count("\n\n")
+
+
+def test_proportional_strategy_keeps_short_chunks():
+    context = "\n\n".join(["doc1.pdf: " + " ".join(["word"] * 40), "doc2.pdf: short", "doc3.pdf: short"])
+    budget = ContextBudget(12, strategy="proportional", tokenizer=SeparatorTokenizer())
+    context, truncated = budget.apply(context)
+    assert truncated
+    # The short chunks would get 0 tokens in proportion to their length, but each one keeps its start
+    assert context.split("\n\n") == ["doc1.pdf: word word word word word word", "doc2.pdf:", "doc3.pdf:"]
+
+
+def test_proportional_strategy_with_too_many_chunks():
+    context = "\n\n".join(f"doc{ind}.pdf: some text" for ind in range(12))
+    budget = ContextBudget(8, strategy="proportional", tokenizer=SeparatorTokenizer())
+    context, truncated = budget.apply(context)
+    assert truncated
+    # The separators alone go over the budget, so the start of the context is kept instead of nothing
+    assert context == "doc0.pdf: some text doc1.pdf: some text doc2.pdf: some"
+
+
+def test_relevance_strategy():
+    budget = ContextBudget(10, strategy="relevance", tokenizer=WordTokenizer())
+    context, truncated = budget.apply(CONTEXT, "What is the PTO policy?")
+    assert truncated
+    # The most relevant chunk is kept whole, the next one fills the rest, and they stay in their original order
+    assert context.split("\n\n") == ["doc1.pdf: one two", "doc2.pdf: the pto policy allows twenty days"]
+
+
+def test_from_config_with_metric_overrides():
+    config = {"max_tokens": 100, "strategy": "relevance", "metrics": {"gpt_groundedness": {"max_tokens": 500}}}
+    groundedness_budget = ContextBudget.from_config(config, "gpt_groundedness")
+    assert (groundedness_budget.max_tokens, groundedness_budget.strategy) == (500, "relevance")
+    assert ContextBudget.from_config(config, "gpt_relevance").max_tokens == 100
+    assert ContextBudget.from_config({"metrics": {"gpt_groundedness": {"max_tokens": 500}}}, "gpt_relevance") is None
+    assert ContextBudget.from_config(None, "gpt_relevance") is None
+    with pytest.raises(ValueError):
+        ContextBudget.from_config({"max_tokens": 100, "strategy": "middle"}, "gpt_relevance")
+
+
+def test_tokenizer_estimates_without_encoding():
+    tokenizer = Tokenizer("not_an_encoding")
+    assert tokenizer.count("x" * 40) == 10
+    assert tokenizer.truncate("x" * 40, 5) == "x" * 20
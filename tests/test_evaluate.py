@@ -1,8 +1,23 @@
+import json
+import random
+import threading
+import time
 from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
 
+import pytest
 import requests
 
-from evaltools.eval.evaluate import send_question_to_target
+from evaltools import service_setup
+from evaltools.eval.evaluate import (
+    create_target_session,
+    get_question_shard,
+    run_evaluation,
+    send_question_to_target,
+)
+from evaltools.eval.evaluate_metrics import code_metrics, metrics_by_name
+from evaltools.eval.merge import merge_results
 
 
 def test_send_question_to_target_valid():
@@ -89,6 +104,397 @@ def test_send_question_to_target_missing_context():
         )
 
 
+def test_send_question_to_target_session_reuses_connection():
+    connections = []
+
+    class ChatHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = b'{"message": {"content": "Answer"}, "context": {"data_points": {"text": ["Context"]}}}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/chat"
+    try:
+        with create_target_session(pool_size=2) as session:
+            for _ in range(3):
+                result = send_question_to_target("Question", url, session=session, timeout=(5, 5), raise_error=True)
+                assert result["answer"] == "Answer"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(connections) == 1
+
+
+@pytest.fixture
+def mock_services(monkeypatch):
+    """Mocks the target app (answering each question with "Answer to <question>") and the GPT deployment."""
+
+    def mock_post(session, url, headers, json, **kwargs):
+        # Sleep a random amount so that rows complete out of order
+        time.sleep(random.uniform(0, 0.01))
+        question = json["messages"][0]["content"]
+        return MockResponse(
+            {"message": {"content": f"Answer to {question}"}, "context": {"data_points": {"text": ["Context"]}}}
+        )
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    monkeypatch.setattr(service_setup, "get_openai_client", lambda *args, **kwargs: MockOpenAIClient())
+
+
+def write_testdata(path, num_questions):
+    with open(path, "w", encoding="utf-8") as f:
+        for ind in range(num_questions):
+            f.write(json.dumps({"question": f"Question {ind}", "truth": f"Truth {ind}"}) + "\n")
+    return path
+
+
+def read_results(results_dir):
+    with open(results_dir / "eval_results.jsonl", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def run_test_evaluation(tmp_path, num_questions=20, **kwargs):
+    kwargs.setdefault("requested_metrics", ["answer_length", "latency"])
+    kwargs.setdefault("results_dir", tmp_path / "results")
+    return run_evaluation(
+        openai_config={},
+        testdata_path=write_testdata(tmp_path / "qa.jsonl", num_questions),
+        target_url="http://example.com",
+        target_response_answer_jmespath="message.content",
+        target_response_context_jmespath="context.data_points.text",
+        **kwargs,
+    )
+
+
+def register_mock_gpt_metric(monkeypatch, score):
+    """Register a GPT metric named mock_gpt_rating, which rates each row with score(query=..., response=...,
+    context=..., ground_truth=...) instead of calling a GPT model."""
+
+    class MockGPTMetric(code_metrics.BaseMetric):
+        METRIC_NAME = "mock_gpt_rating"
+        REQUIRES_GPT = True
+
+        @classmethod
+        def evaluator_fn(cls, **kwargs):
+            return lambda **inputs: {cls.METRIC_NAME: score(**inputs)}
+
+        @classmethod
+        def get_aggregate_stats(cls, df):
+            return cls.get_aggregate_stats_for_numeric_rating(df, cls.METRIC_NAME)
+
+    monkeypatch.setitem(metrics_by_name, MockGPTMetric.METRIC_NAME, MockGPTMetric)
+    return MockGPTMetric
+
+
+def test_run_evaluation_concurrent_keeps_order(tmp_path, mock_services):
+    assert run_test_evaluation(tmp_path, max_concurrency=4)
+    results = read_results(tmp_path / "results")
+    assert [row["question"] for row in results] == [f"Question {ind}" for ind in range(20)]
+    assert [row["answer"] for row in results] == [f"Answer to Question {ind}" for ind in range(20)]
+    with open(tmp_path / "results" / "summary.json", encoding="utf-8") as f:
+        assert json.load(f)["num_questions"] == {"total": 20}
+
+
+def test_run_evaluation_constructs_evaluators_once(tmp_path, mock_services, monkeypatch):
+    evaluator_fn = code_metrics.AnswerLengthMetric.evaluator_fn
+    calls = []
+
+    def counting_evaluator_fn(**kwargs):
+        calls.append(kwargs)
+        return evaluator_fn(**kwargs)
+
+    monkeypatch.setattr(code_metrics.AnswerLengthMetric, "evaluator_fn", counting_evaluator_fn)
+    assert run_test_evaluation(tmp_path, max_concurrency=4)
+    assert len(calls) == 1
+    assert [row["answer_length"] for row in read_results(tmp_path / "results")] == [
+        len(f"Answer to Question {ind}") for ind in range(20)
+    ]
+
+
+def test_run_evaluation_resume(tmp_path, mock_services, monkeypatch):
+    evaluator_fn = code_metrics.AnswerLengthMetric.evaluator_fn
+
+    def interrupting_evaluator_fn(**kwargs):
+        def answer_length(*, query, **kwargs):
+            if query == "Question 6":
+                raise KeyboardInterrupt()
+            return evaluator_fn()(**kwargs)
+
+        return answer_length
+
+    monkeypatch.setattr(code_metrics.AnswerLengthMetric, "evaluator_fn", interrupting_evaluator_fn)
+    with pytest.raises(KeyboardInterrupt):
+        run_test_evaluation(tmp_path, num_questions=10)
+    journal_path = tmp_path / "results" / "eval_results.journal.jsonl"
+    with open(journal_path, encoding="utf-8") as f:
+        assert [json.loads(line)["index"] for line in f] == [0, 1, 2, 3, 4, 5]
+    assert not (tmp_path / "results" / "eval_results.jsonl").exists()
+
+    monkeypatch.setattr(code_metrics.AnswerLengthMetric, "evaluator_fn", evaluator_fn)
+    assert run_test_evaluation(tmp_path, num_questions=10, resume=True)
+    results = read_results(tmp_path / "results")
+    assert [row["question"] for row in results] == [f"Question {ind}" for ind in range(10)]
+    assert all(row["answer_length"] == len(row["answer"]) for row in results)
+    assert not journal_path.exists()
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert json.load(f)["resumed_questions"] == 6
+
+
+def test_run_evaluation_resume_mismatched_testdata(tmp_path, mock_services):
+    (tmp_path / "results").mkdir()
+    with open(tmp_path / "results" / "eval_results.journal.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"index": 0, "result": {"question": "Some other question"}}) + "\n")
+    assert not run_test_evaluation(tmp_path, num_questions=10, resume=True)
+
+
+def test_run_evaluation_metric_cache(tmp_path, mock_services, monkeypatch):
+    judge_calls = []
+
+    def rate(*, query, **kwargs):
+        judge_calls.append(query)
+        return 5
+
+    register_mock_gpt_metric(monkeypatch, rate)
+    metric_cache = {"path": tmp_path / "cache" / "metrics.db"}
+    assert run_test_evaluation(
+        tmp_path, num_questions=5, requested_metrics=["mock_gpt_rating"], metric_cache=metric_cache
+    )
+    assert len(judge_calls) == 5
+    assert run_test_evaluation(
+        tmp_path, num_questions=5, requested_metrics=["mock_gpt_rating"], metric_cache=metric_cache
+    )
+    assert len(judge_calls) == 5
+    assert [row["mock_gpt_rating"] for row in read_results(tmp_path / "results")] == [5] * 5
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert json.load(f)["metric_cache"] == {"hits": 5, "misses": 0}
+
+
+def test_run_evaluation_replay(tmp_path, mock_services, monkeypatch):
+    assert run_test_evaluation(tmp_path, num_questions=5, requested_metrics=["answer_length", "latency"])
+    original_results = read_results(tmp_path / "results")
+
+    def failing_post(*args, **kwargs):
+        raise AssertionError("The target should not be called when replaying answers")
+
+    monkeypatch.setattr(requests.Session, "post", failing_post)
+    assert run_test_evaluation(
+        tmp_path, num_questions=5, requested_metrics=["has_citation"], replay_dir=tmp_path / "results"
+    )
+    results = read_results(tmp_path / "results")
+    assert [row["answer"] for row in results] == [row["answer"] for row in original_results]
+    assert [row["answer_length"] for row in results] == [row["answer_length"] for row in original_results]
+    assert [row["has_citation"] for row in results] == [False] * 5
+    with open(tmp_path / "results" / "summary.json", encoding="utf-8") as f:
+        assert set(json.load(f)) == {"has_citation", "answer_length", "latency", "num_questions"}
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert json.load(f)["replayed_questions"] == 5
+
+
+def test_run_evaluation_judge_batches(tmp_path, mock_services, monkeypatch):
+    batches = []
+
+    class MockBatchedMetric(code_metrics.BaseMetric):
+        METRIC_NAME = "mock_batched_rating"
+        REQUIRES_GPT = True
+
+        @classmethod
+        def evaluator_fn(cls, **kwargs):
+            return lambda **kwargs: {cls.METRIC_NAME: 1}
+
+        @classmethod
+        def batch_evaluator_fn(cls, **kwargs):
+            def rate_batch(rows):
+                batches.append(rows)
+                # Pretend the score for the last question couldn't be parsed
+                return [None if row["query"] == "Question 6" else {cls.METRIC_NAME: 5} for row in rows]
+
+            return rate_batch
+
+        @classmethod
+        def get_aggregate_stats(cls, df):
+            return cls.get_aggregate_stats_for_numeric_rating(df, cls.METRIC_NAME)
+
+    monkeypatch.setitem(metrics_by_name, MockBatchedMetric.METRIC_NAME, MockBatchedMetric)
+    assert run_test_evaluation(
+        tmp_path, num_questions=7, requested_metrics=["mock_batched_rating", "answer_length"], judge_batch_size=3
+    )
+    assert sorted(len(batch) for batch in batches) == [1, 3, 3]
+    results = read_results(tmp_path / "results")
+    assert [row["mock_batched_rating"] for row in results] == [5, 5, 5, 5, 5, 5, 1]
+    assert all("answer_length" in row for row in results)
+
+
+def test_get_question_shard_is_stable():
+    assert get_question_shard("What is the capital of France?", 4) == get_question_shard(
+        "What is the capital of France?", 4
+    )
+    shards = {get_question_shard(f"Question {ind}", 4) for ind in range(100)}
+    assert shards == {1, 2, 3, 4}
+
+
+def test_run_evaluation_shards_and_merge(tmp_path, mock_services):
+    shard_dirs = [tmp_path / f"shard{index}" for index in (1, 2, 3)]
+    for index, shard_dir in enumerate(shard_dirs, start=1):
+        assert run_test_evaluation(tmp_path, results_dir=shard_dir, shard=(index, 3))
+        assert all(get_question_shard(row["question"], 3) == index for row in read_results(shard_dir))
+    assert sum(len(read_results(shard_dir)) for shard_dir in shard_dirs) == 20
+
+    # A missing shard is reported, and only merged when partial results are allowed
+    assert not merge_results(shard_dirs[:2], tmp_path / "merged")
+    assert merge_results(shard_dirs[:2], tmp_path / "merged", allow_partial=True)
+    with open(tmp_path / "merged" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert json.load(f)["missing_shards"] == [3]
+
+    assert merge_results(shard_dirs, tmp_path / "merged")
+    results = read_results(tmp_path / "merged")
+    assert [row["question"] for row in results] == [f"Question {ind}" for ind in range(20)]
+    with open(tmp_path / "merged" / "summary.json", encoding="utf-8") as f:
+        summary = json.load(f)
+    assert summary["num_questions"] == {"total": 20}
+    assert summary["answer_length"]["mean"] == round(sum(len(row["answer"]) for row in results) / 20, 2)
+
+
+def test_merge_detects_interrupted_shard(tmp_path, mock_services):
+    shard_dirs = [tmp_path / f"shard{index}" for index in (1, 2)]
+    for index, shard_dir in enumerate(shard_dirs, start=1):
+        assert run_test_evaluation(tmp_path, results_dir=shard_dir, shard=(index, 2))
+    # Simulate an interrupted shard, which only has a journal of the rows evaluated so far
+    rows = read_results(shard_dirs[1])
+    (shard_dirs[1] / "eval_results.jsonl").unlink()
+    with open(shard_dirs[1] / "eval_results.journal.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"index": 0, "result": rows[0]}) + "\n")
+
+    assert not merge_results(shard_dirs, tmp_path / "merged")
+    assert merge_results(shard_dirs, tmp_path / "merged", allow_partial=True)
+    assert len(read_results(tmp_path / "merged")) == len(read_results(shard_dirs[0])) + 1
+    with open(tmp_path / "merged" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert [shard["complete"] for shard in json.load(f)["merged_shards"]] == [True, False]
+
+
+def test_run_evaluation_vectorized_code_metrics(tmp_path, mock_services):
+    requested_metrics = ["answer_length", "has_citation", "citation_match", "f1_score", "latency"]
+    assert run_test_evaluation(tmp_path, num_questions=5, requested_metrics=requested_metrics)
+    row_results = read_results(tmp_path / "results")
+    assert run_test_evaluation(
+        tmp_path, num_questions=5, requested_metrics=requested_metrics, vectorize_code_metrics=True, max_concurrency=2
+    )
+    results = read_results(tmp_path / "results")
+    for row, row_result in zip(results, row_results):
+        assert {**row, "latency": 1} == {**row_result, "latency": 1}
+
+
+def test_run_evaluation_timings_and_trace(tmp_path, mock_services, monkeypatch):
+    register_mock_gpt_metric(monkeypatch, lambda **kwargs: 4)
+    requested_metrics = ["mock_gpt_rating", "answer_length"]
+    assert run_test_evaluation(tmp_path, num_questions=5, requested_metrics=requested_metrics, max_concurrency=2)
+    assert not any("_timings" in row for row in read_results(tmp_path / "results"))
+    assert not (tmp_path / "results" / "trace.json").exists()
+
+    assert run_test_evaluation(
+        tmp_path,
+        num_questions=5,
+        requested_metrics=requested_metrics,
+        max_concurrency=2,
+        record_timings=True,
+        export_trace=True,
+    )
+    for row in read_results(tmp_path / "results"):
+        assert set(row["_timings"]) == {
+            "target.request",
+            "target.parse",
+            "metric.mock_gpt_rating",
+            "judge.mock_gpt_rating",
+            "metric.answer_length",
+        }
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        stages = json.load(f)["timings"]["stages"]
+    assert stages["target.request"]["count"] == 5
+    assert stages["results.journal"]["count"] == 5
+    assert stages["results.jsonl"]["count"] == 1
+    with open(tmp_path / "results" / "trace.json", encoding="utf-8") as f:
+        spans = json.load(f)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root_span = spans[0]
+    assert root_span["name"] == "evaluation"
+    assert all(span["parentSpanId"] == root_span["spanId"] for span in spans[1:])
+    assert len([span for span in spans if span["name"] == "judge.mock_gpt_rating"]) == 5
+
+
+def test_run_evaluation_with_context_budget(tmp_path, mock_services, monkeypatch):
+    contexts = []
+
+    def rate(*, context, **kwargs):
+        contexts.append(context)
+        return 4
+
+    def mock_post(session, url, headers, json, **kwargs):
+        return MockResponse({"message": {"content": "Answer"}, "context": {"data_points": {"text": ["x" * 400]}}})
+
+    monkeypatch.setattr(requests.Session, "post", mock_post)
+    register_mock_gpt_metric(monkeypatch, rate)
+    assert run_test_evaluation(
+        tmp_path,
+        num_questions=3,
+        requested_metrics=["mock_gpt_rating"],
+        context_budget={"max_tokens": 10, "encoding": "not_an_encoding"},
+    )
+    # Without the encoding, tokens are estimated at 4 characters each
+    assert contexts == ["x" * 40] * 3
+    assert all(row["context_truncated"] for row in read_results(tmp_path / "results"))
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        assert json.load(f)["context_truncated_questions"] == 3
+
+
+def test_run_evaluation_sequential_test_stops_early(tmp_path, mock_services, monkeypatch):
+    scores = {}
+    register_mock_gpt_metric(monkeypatch, lambda *, query, **kwargs: scores[query])
+    scores.update({f"Question {ind}": 5 for ind in range(200)})
+    baseline_dir = tmp_path / "baseline"
+    assert run_test_evaluation(
+        tmp_path, num_questions=200, requested_metrics=["mock_gpt_rating"], results_dir=baseline_dir
+    )
+
+    # The candidate is clearly worse on every question
+    scores.update({f"Question {ind}": 1 + ind % 3 for ind in range(200)})
+    sequential_test = {"baseline_dir": baseline_dir, "batch_size": 20, "min_questions": 20}
+    assert run_test_evaluation(
+        tmp_path, num_questions=200, requested_metrics=["mock_gpt_rating"], sequential_test=sequential_test
+    )
+    results = read_results(tmp_path / "results")
+    assert len(results) < 200
+    # The questions were picked at random, but the results are in the order of the test data
+    indexes = [int(row["question"].split()[-1]) for row in results]
+    assert indexes == sorted(indexes)
+    assert indexes != list(range(len(indexes)))
+    with open(tmp_path / "results" / "evaluate_parameters.json", encoding="utf-8") as f:
+        report = json.load(f)["sequential_test"]
+    assert report["stopped_early"]
+    assert report["decision"]["metric"] == "mock_gpt_rating"
+    assert report["decision"]["direction"] == "worse"
+    assert report["num_paired"] == len(results)
+
+
+class MockOpenAIClient:
+    def __init__(self):
+        message = SimpleNamespace(content="Hello!")
+        response = SimpleNamespace(choices=[SimpleNamespace(message=message)])
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: response))
+
+
 class MockResponse:
     def __init__(self, json_data):
         self.json_data = json_data
@@ -1,6 +1,9 @@
+from types import SimpleNamespace
+
 import pandas as pd
 
 from evaltools.eval.evaluate_metrics import builtin_metrics, code_metrics, prompt_metrics
+from evaltools.eval.summary import summarize_results
 
 
 def test_answer_length():
@@ -9,7 +12,14 @@ def test_answer_length():
     assert callable(metric_function)
     assert metric_function(response="Hello, world!") == {"answer_length": 13}
     df = pd.DataFrame([{"answer_length": 20}, {"answer_length": 10}, {"answer_length": 5}])
-    assert metric.get_aggregate_stats(df) == {"mean": 11.67, "max": 20, "min": 5}
+    assert metric.get_aggregate_stats(df) == {
+        "mean": 11.67,
+        "max": 20,
+        "min": 5,
+        "p50": 10.0,
+        "p90": 18.0,
+        "p99": 19.8,
+    }
 
 
 def test_answer_length_new():
@@ -17,7 +27,14 @@ def test_answer_length_new():
     metric_function = metric.evaluator_fn()
     assert metric_function(response=None) == {"answer_length": -1}
     df = pd.DataFrame([{"answer_length": 20}, {"answer_length": 10}, {"answer_length": 5}, {"answer_length": -1}])
-    assert metric.get_aggregate_stats(df) == {"mean": 11.67, "max": 20, "min": 5}
+    assert metric.get_aggregate_stats(df) == {
+        "mean": 11.67,
+        "max": 20,
+        "min": 5,
+        "p50": 10.0,
+        "p90": 18.0,
+        "p99": 19.8,
+    }
 
 
 def test_has_citation():
@@ -28,7 +45,7 @@ def test_has_citation():
     assert metric_function(response="Hello, [world.pdf]!") == {"has_citation": True}
 
     df = pd.DataFrame([{"has_citation": True}, {"has_citation": False}, {"has_citation": True}])
-    assert metric.get_aggregate_stats(df) == {"total": 2, "rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {"total": 2, "rate": 0.67, "rate_ci": [0.0, 1.0]}
 
 
 def test_has_citation_none():
@@ -36,7 +53,7 @@ def test_has_citation_none():
     metric_function = metric.evaluator_fn()
     assert metric_function(response=None) == {"has_citation": -1}
     df = pd.DataFrame([{"has_citation": True}, {"has_citation": False}, {"has_citation": -1}])
-    assert metric.get_aggregate_stats(df) == {"total": 1, "rate": 0.5}
+    assert metric.get_aggregate_stats(df) == {"total": 1, "rate": 0.5, "rate_ci": [0.0, 1.0]}
 
 
 def test_citation_match():
@@ -53,7 +70,7 @@ def test_citation_match():
         "citation_match": True
     }
     df = pd.DataFrame([{"citation_match": True}, {"citation_match": False}, {"citation_match": True}])
-    assert metric.get_aggregate_stats(df) == {"total": 2, "rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {"total": 2, "rate": 0.67, "rate_ci": [0.0, 1.0]}
 
 
 def test_citation_match_filenames_only():
@@ -69,7 +86,7 @@ def test_citation_match_none():
     metric_function = metric.evaluator_fn()
     assert metric_function(ground_truth="Answer", response=None) == {"citation_match": -1}
     df = pd.DataFrame([{"citation_match": True}, {"citation_match": False}, {"citation_match": -1}])
-    assert metric.get_aggregate_stats(df) == {"total": 1, "rate": 0.5}
+    assert metric.get_aggregate_stats(df) == {"total": 1, "rate": 0.5, "rate_ci": [0.0, 1.0]}
 
 
 def test_latency():
@@ -78,7 +95,14 @@ def test_latency():
     assert callable(metric_function)
     assert metric_function(data={"latency": 20}) == {}
     df = pd.DataFrame([{"latency": 20}, {"latency": 10}, {"latency": 5}])
-    assert metric.get_aggregate_stats(df) == {"mean": 11.67, "max": 20, "min": 5}
+    assert metric.get_aggregate_stats(df) == {
+        "mean": 11.67,
+        "max": 20,
+        "min": 5,
+        "p50": 10.0,
+        "p90": 18.0,
+        "p99": 19.8,
+    }
 
 
 def test_custom_relevance():
@@ -86,7 +110,12 @@ def test_custom_relevance():
 
     assert callable(metric.evaluator_fn(openai_config=None))
     df = pd.DataFrame([{"myrelevance": 5}, {"myrelevance": 4}, {"myrelevance": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_custom_coherence():
@@ -94,7 +123,12 @@ def test_custom_coherence():
 
     assert callable(metric.evaluator_fn(openai_config=None))
     df = pd.DataFrame([{"mycoherence": 5}, {"mycoherence": 4}, {"mycoherence": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_custom_groundedness():
@@ -102,7 +136,12 @@ def test_custom_groundedness():
 
     assert callable(metric.evaluator_fn(openai_config=None))
     df = pd.DataFrame([{"mygroundedness": 5}, {"mygroundedness": 4}, {"mygroundedness": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_custom_relevance_missing_values():
@@ -110,42 +149,72 @@ def test_custom_relevance_missing_values():
 
     assert callable(metric.evaluator_fn(openai_config=None))
     df = pd.DataFrame([{"myrelevance": 2}, {"myrelevance": 4}, {"myrelevance": "Failed"}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 3.0, "pass_count": 1, "pass_rate": 0.33}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 3.0,
+        "pass_count": 1,
+        "pass_rate": 0.33,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_coherence():
     metric = builtin_metrics.BuiltinCoherenceMetric()
     assert metric.METRIC_NAME == "gpt_coherence"
     df = pd.DataFrame([{"gpt_coherence": 5}, {"gpt_coherence": 4}, {"gpt_coherence": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_relevance():
     metric = builtin_metrics.BuiltinRelevanceMetric()
     assert metric.METRIC_NAME == "gpt_relevance"
     df = pd.DataFrame([{"gpt_relevance": 5}, {"gpt_relevance": 4}, {"gpt_relevance": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_groundedness():
     metric = builtin_metrics.BuiltinGroundednessMetric()
     assert metric.METRIC_NAME == "gpt_groundedness"
     df = pd.DataFrame([{"gpt_groundedness": 5}, {"gpt_groundedness": 4}, {"gpt_groundedness": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_fluency():
     metric = builtin_metrics.BuiltinFluencyMetric()
     assert metric.METRIC_NAME == "gpt_fluency"
     df = pd.DataFrame([{"gpt_fluency": 5}, {"gpt_fluency": 4}, {"gpt_fluency": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_similarity():
     metric = builtin_metrics.BuiltinSimilarityMetric()
     assert metric.METRIC_NAME == "gpt_similarity"
     df = pd.DataFrame([{"gpt_similarity": 5}, {"gpt_similarity": 4}, {"gpt_similarity": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 4.0, "pass_count": 2, "pass_rate": 0.67}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 4.0,
+        "pass_count": 2,
+        "pass_rate": 0.67,
+        "pass_rate_ci": [0.0, 1.0],
+    }
 
 
 def test_builtin_f1_score():
@@ -159,4 +228,124 @@ def test_builtin_coherence_missing_values():
     metric = builtin_metrics.BuiltinCoherenceMetric()
     assert metric.METRIC_NAME == "gpt_coherence"
     df = pd.DataFrame([{"gpt_coherence": "Failed"}, {"gpt_coherence": 4}, {"gpt_coherence": 3}])
-    assert metric.get_aggregate_stats(df) == {"mean_rating": 3.5, "pass_count": 1, "pass_rate": 0.33}
+    assert metric.get_aggregate_stats(df) == {
+        "mean_rating": 3.5,
+        "pass_count": 1,
+        "pass_rate": 0.33,
+        "pass_rate_ci": [0.0, 1.0],
+    }
+
+
+def test_numeric_rating_bootstrap_ci():
+    metric = prompt_metrics.RelevanceMetric()
+    df = pd.DataFrame({"myrelevance": [5] * 80 + [2] * 20})
+    stats = metric.get_aggregate_stats(df)
+    assert stats["pass_rate"] == 0.8
+    low, high = stats["pass_rate_ci"]
+    assert 0.7 <= low < 0.8 < high <= 0.9
+    # The interval is seeded, so the summary is the same every time
+    assert metric.get_aggregate_stats(df)["pass_rate_ci"] == stats["pass_rate_ci"]
+
+
+def test_summarize_results_typed_frame():
+    df = pd.DataFrame(
+        [
+            {"gpt_coherence": "Failed", "has_citation": True},
+            {"gpt_coherence": 4, "has_citation": -1},
+            {"gpt_coherence": "5", "has_citation": False},
+        ]
+    )
+    summary = summarize_results(df, [builtin_metrics.BuiltinCoherenceMetric, code_metrics.HasCitationMetric])
+    assert summary["gpt_coherence"]["pass_count"] == 2
+    assert summary["gpt_coherence"]["mean_rating"] == 4.5
+    assert summary["has_citation"]["total"] == 1
+    assert summary["num_questions"] == {"total": 3}
+
+
+def test_split_prompty():
+    system, rubric, row_template = prompt_metrics.split_prompty(prompt_metrics.CoherenceMetric.get_prompty_path())
+    assert system.startswith("You are an AI assistant.")
+    assert rubric.startswith("Coherence of an answer is measured")
+    assert "{{" not in rubric
+    assert row_template == "question: {{query}}\nanswer: {{response}}\nstars:"
+
+
+def test_batch_evaluator():
+    openai_config = {"azure_endpoint": "https://example.openai.azure.com", "azure_deployment": "gpt", "api_key": "x"}
+    evaluator = prompt_metrics.CoherenceMetric.batch_evaluator_fn(openai_config=openai_config)
+    rows = [
+        {"query": "What is 1+1?", "response": "2", "context": "", "ground_truth": "2"},
+        {"query": "What is 2+2?", "response": "4", "context": "", "ground_truth": "4"},
+        {"query": "What is 3+3?", "response": "6", "context": "", "ground_truth": "6"},
+    ]
+    messages = evaluator.build_messages(rows)
+    assert messages[1]["content"].count("Coherence of an answer is measured") == 1
+    assert "### Item 3\nquestion: What is 3+3?\nanswer: 6\nstars:" in messages[1]["content"]
+
+    llm_output = '{"scores": [{"id": 1, "score": 5}, {"id": 2, "score": "nope"}, {"id": 3, "score": 4}]}'
+    message = SimpleNamespace(content=llm_output)
+    create = lambda **kwargs: SimpleNamespace(choices=[SimpleNamespace(message=message)])  # noqa: E731
+    evaluator._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    assert evaluator(rows) == [{"mycoherence": 5.0}, None, {"mycoherence": 4.0}]
+
+
+def test_split_prompty_drops_reminder():
+    _, _, row_template = prompt_metrics.split_prompty(prompt_metrics.GroundednessMetric.get_prompty_path())
+    assert row_template == '{"CONTEXT": {{context}}, "QUESTION": "", "ANSWER": {{response}}}\nActual Task Output:'
+
+
+def test_batch_evaluator_uses_credential_and_prompty_parameters(monkeypatch):
+    clients = []
+
+    def get_openai_client(oai_config, azure_credential=None):
+        clients.append(azure_credential)
+        return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+    requests = []
+
+    def create(**kwargs):
+        requests.append(kwargs)
+        message = SimpleNamespace(content='{"scores": [{"id": 1, "score": 3}]}')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    monkeypatch.setattr(prompt_metrics.service_setup, "get_openai_client", get_openai_client)
+    credential = object()
+    evaluator = prompt_metrics.GroundednessMetric.batch_evaluator_fn(
+        openai_config={"azure_endpoint": "https://example.openai.azure.com", "azure_deployment": "gpt"},
+        azure_credential=credential,
+    )
+    assert clients == [credential]
+    row = {"query": "What is 1+1?", "response": "2", "context": "1+1=2", "ground_truth": "2"}
+    assert evaluator([row]) == [{"mygroundedness": 3.0}]
+    assert requests[0]["temperature"] == 0.0
+    assert requests[0]["top_p"] == 1.0
+    assert requests[0]["max_tokens"] == 70
+    assert requests[0]["response_format"] == {"type": "json_object"}
+
+
+def test_batch_evaluator_unparseable_output():
+    openai_config = {"azure_endpoint": "https://example.openai.azure.com", "azure_deployment": "gpt", "api_key": "x"}
+    evaluator = prompt_metrics.RelevanceMetric.batch_evaluator_fn(openai_config=openai_config)
+    assert evaluator.parse_scores("5", 2) == [None, None]
+    assert evaluator.parse_scores('{"scores": [{"id": 7, "score": 5}]}', 2) == [None, None]
+
+
+def test_code_metrics_evaluate_columns_match_evaluator_fn(monkeypatch):
+    rows = [
+        {"answer": "Answer with [info1.pdf#page=2] and [info2.txt]", "truth": "Truth from [info1.pdf#page=2]"},
+        {"answer": "Answer with [info2.txt]", "truth": "Truth from [info1.pdf#page=2]"},
+        {"answer": "Answer without citations", "truth": "Truth without citations"},
+        {"answer": None, "truth": "Truth from [info1.pdf]"},
+    ]
+    df = pd.DataFrame(rows)
+    for metric in [code_metrics.AnswerLengthMetric, code_metrics.HasCitationMetric, code_metrics.CitationMatchMetric]:
+        metric_function = metric.evaluator_fn()
+        expected = [metric_function(response=row["answer"], ground_truth=row["truth"]) for row in rows]
+        assert metric.evaluate_columns(df).to_dict("records") == expected
+
+    # Score the F1 rows in worker processes, even though there are only a few of them
+    monkeypatch.setattr(builtin_metrics, "F1_PROCESS_POOL_MIN_ROWS", 1)
+    rows = rows[:3]
+    f1_function = builtin_metrics.BuiltinF1ScoreMetric.evaluator_fn()
+    expected = [f1_function(response=row["answer"], ground_truth=row["truth"]) for row in rows]
+    assert builtin_metrics.BuiltinF1ScoreMetric.evaluate_columns(pd.DataFrame(rows)).to_dict("records") == expected
@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from evaltools import service_setup
+from evaltools.gen.dedupe import QuestionDeduplicator, normalize_text
+from evaltools.gen.generate import generate_dontknows_qa_data, sample_questions, write_generated_qa
+from evaltools.gen.search_retriever import JsonlSearchClient, SearchIndexRetriever
+
+
+def make_sources(num_sources):
+    return ({"id": ind} for ind in range(num_sources))
+
+
+def generate_for_source(source):
+    return [{"question": f"Question {source['id']}.{ind}", "truth": "Truth"} for ind in range(3)]
+
+
+def read_questions(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f]
+
+
+def test_write_generated_qa_stops_at_total(tmp_path):
+    calls = []
+
+    def counting_generate(source):
+        calls.append(source["id"])
+        return generate_for_source(source)
+
+    output_file = tmp_path / "out" / "qa.jsonl"
+    assert write_generated_qa(make_sources(100), counting_generate, 10, 3, output_file) == 10
+    questions = read_questions(output_file)
+    assert questions[:4] == ["Question 0.0", "Question 0.1", "Question 0.2", "Question 1.0"]
+    assert len(questions) == 10
+    # 4 sources are enough for 10 questions, so no more are generated
+    assert calls == [0, 1, 2, 3]
+
+
+def test_write_generated_qa_concurrent(tmp_path):
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def slow_generate(source):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.02)
+        with lock:
+            running -= 1
+        return generate_for_source(source)
+
+    output_file = tmp_path / "qa.jsonl"
+    assert write_generated_qa(make_sources(100), slow_generate, 30, 3, output_file, max_concurrency=4) == 30
+    questions = read_questions(output_file)
+    assert len(questions) == len(set(questions)) == 30
+    assert max_running == 4
+
+
+def test_write_generated_qa_runs_out_of_sources(tmp_path):
+    output_file = tmp_path / "qa.jsonl"
+    assert write_generated_qa(make_sources(2), generate_for_source, 10, 3, output_file, max_concurrency=2) == 6
+
+
+def test_write_generated_qa_keeps_questions_before_error(tmp_path):
+    def failing_generate(source):
+        if source["id"] == 2:
+            raise RuntimeError("Generation failed")
+        return generate_for_source(source)
+
+    output_file = tmp_path / "qa.jsonl"
+    with pytest.raises(RuntimeError):
+        write_generated_qa(make_sources(10), failing_generate, 20, 3, output_file)
+    assert len(read_questions(output_file)) == 6
+
+
+def write_search_documents(path, num_documents, num_citations=3):
+    with open(path, "w", encoding="utf-8") as f:
+        for ind in range(num_documents):
+            document = {"id": str(ind), "sourcepage": f"page{ind % num_citations}.pdf", "content": f"Content {ind}"}
+            f.write(json.dumps({**document, "embedding": [0.1] * 4}) + "\n")
+    return path
+
+
+def test_jsonl_search_client_pages(tmp_path):
+    client = JsonlSearchClient(write_search_documents(tmp_path / "docs.jsonl", 7), page_size=3)
+    results = client.search("", select=["sourcepage"], include_total_count=True)
+    assert results.get_count() == 7
+    page_iterator = results.by_page()
+    first_page = list(next(page_iterator))
+    assert first_page == [{"sourcepage": "page0.pdf"}, {"sourcepage": "page1.pdf"}, {"sourcepage": "page2.pdf"}]
+    assert page_iterator.continuation_token == "3"
+    # Continuing from the token skips the first page
+    assert [len(list(page)) for page in results.by_page(page_iterator.continuation_token)] == [3, 1]
+
+
+def test_search_index_retriever_reads_all_pages(tmp_path):
+    client = JsonlSearchClient(write_search_documents(tmp_path / "docs.jsonl", 20), page_size=3)
+    retriever = SearchIndexRetriever(client, "sourcepage")
+    documents = list(retriever())
+    assert [document["content"] for document in documents] == [f"Content {ind}" for ind in range(20)]
+    # Only the fields needed for generating questions are fetched
+    assert set(documents[0]) == {"sourcepage", "content"}
+    assert retriever.num_pages == 7
+
+
+def test_search_index_retriever_max_per_citation(tmp_path):
+    client = JsonlSearchClient(write_search_documents(tmp_path / "docs.jsonl", 20), page_size=4)
+    documents = list(SearchIndexRetriever(client, "sourcepage", max_per_citation=2)())
+    assert [document["content"] for document in documents] == [f"Content {ind}" for ind in range(6)]
+
+
+def generate_for_search_document(document):
+    return [{"question": f"{document['content']} {ind}?", "truth": document["sourcepage"]} for ind in range(3)]
+
+
+def test_search_index_retriever_stops_early(tmp_path):
+    client = JsonlSearchClient(write_search_documents(tmp_path / "docs.jsonl", 100), page_size=2)
+    retriever = SearchIndexRetriever(client, "sourcepage", prefetch_pages=1)
+    output_file = tmp_path / "qa.jsonl"
+    assert write_generated_qa(retriever(), generate_for_search_document, 6, 3, output_file) == 6
+    # Only the pages needed (and the ones being prefetched) are fetched
+    time.sleep(0.3)
+    assert retriever.num_pages < 5
+
+
+def test_search_index_retriever_raises_search_errors():
+    class FailingSearchClient:
+        def search(self, *args, **kwargs):
+            raise RuntimeError("Search failed")
+
+    with pytest.raises(RuntimeError, match="Search failed"):
+        list(SearchIndexRetriever(FailingSearchClient(), "sourcepage")())
+
+
+def test_normalize_text():
+    assert normalize_text("  1. What's the   PTO policy? ") == "what s the pto policy"
+
+
+def test_question_deduplicator():
+    deduplicator = QuestionDeduplicator()
+    assert deduplicator.add("What is the capital of France?")
+    assert not deduplicator.add("what is the capital of france")
+    assert not deduplicator.add("- What is the capital city of France?")
+    assert deduplicator.add("What is the tallest mountain in the world?")
+
+
+def test_sample_questions_within_budget():
+    qa = [{"question": "x" * 40} for _ in range(100)]
+    # Each question is about 10 tokens, plus one for its newline
+    assert len(sample_questions(qa, max_tokens=55)) == 5
+    assert len(sample_questions(qa, max_tokens=None)) == 100
+
+
+class MockDontknowsClient:
+    """Answers with numbered questions, which are all duplicates for the first call of each category."""
+
+    def __init__(self):
+        self.requests = []
+        self.lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        prompt = messages[0]["content"]
+        with self.lock:
+            self.requests.append({"model": model, "prompt": prompt})
+            num_calls = len(self.requests)
+        if num_calls <= 4:
+            # The first call for each category repeats the same question
+            questions = [f"{ind + 1}. What is {prompt[:40]}?" for ind in range(5)]
+        else:
+            questions = [f"{ind + 1}. What is {uuid.uuid4().hex}?" for ind in range(5)]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="\n".join(questions)))])
+
+
+def test_generate_dontknows_qa_data(tmp_path, monkeypatch):
+    client = MockDontknowsClient()
+    monkeypatch.setattr(service_setup, "get_openai_client", lambda *args, **kwargs: client)
+    input_file = tmp_path / "qa.jsonl"
+    with open(input_file, "w", encoding="utf-8") as f:
+        for ind in range(500):
+            f.write(json.dumps({"question": f"What does document {ind} say about topic {ind * 7}?"}) + "\n")
+    output_file = tmp_path / "dontknows.jsonl"
+    generate_dontknows_qa_data({"azure_deployment": "gpt-eval"}, 10, input_file, output_file, max_context_tokens=100)
+    questions = read_questions(output_file)
+    assert len(questions) == len(set(questions)) == 10
+    assert not any(question.startswith("1.") for question in questions)
+    # The four categories, then top-up calls for the duplicates
+    assert len(client.requests) > 4
+    assert all(request["model"] == "gpt-eval" for request in client.requests)
+    # The prompts only include as many existing questions as fit in the budget
+    assert all(len(request["prompt"]) < 1000 for request in client.requests)
+
+
+@pytest.mark.parametrize("num_questions_total", [1, 2, 5])
+def test_generate_dontknows_qa_data_small_totals(tmp_path, monkeypatch, num_questions_total):
+    client = MockDontknowsClient()
+    monkeypatch.setattr(service_setup, "get_openai_client", lambda *args, **kwargs: client)
+    input_file = tmp_path / "qa.jsonl"
+    input_file.write_text(json.dumps({"question": "What does the handbook say?"}) + "\n", encoding="utf-8")
+    output_file = tmp_path / "dontknows.jsonl"
+    generate_dontknows_qa_data({"azure_deployment": "gpt-eval"}, num_questions_total, input_file, output_file)
+    assert len(read_questions(output_file)) == num_questions_total
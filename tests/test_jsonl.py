@@ -0,0 +1,75 @@
+import json
+import math
+
+import pytest
+
+from evaltools import jsonl
+from evaltools.jsonl import count_jsonl_rows, iter_jsonl, iter_jsonl_with_offsets, read_jsonl, read_jsonl_row
+
+
+def write_jsonl(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return path
+
+
+def test_iter_jsonl_limit(tmp_path):
+    path = write_jsonl(tmp_path / "qa.jsonl", [{"question": f"Question {ind}"} for ind in range(10)])
+    assert read_jsonl(path) == [{"question": f"Question {ind}"} for ind in range(10)]
+    assert list(iter_jsonl(path, limit=3)) == [{"question": f"Question {ind}"} for ind in range(3)]
+    assert list(iter_jsonl(path, limit=0)) == []
+
+
+def test_iter_jsonl_stops_early(tmp_path):
+    path = write_jsonl(tmp_path / "qa.jsonl", [{"question": "Question 0"}])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("this line is not JSON\n")
+    # The invalid line is never parsed, since only the first row is needed
+    assert read_jsonl(path, limit=1) == [{"question": "Question 0"}]
+
+
+def test_iter_jsonl_with_offsets(tmp_path):
+    path = write_jsonl(tmp_path / "qa.jsonl", [{"question": "Qué?"}, {"question": "Why?"}, {"question": "How?"}])
+    offsets = [offset for offset, _ in iter_jsonl_with_offsets(path)]
+    with open(path, "rb") as f:
+        assert read_jsonl_row(f, offsets[2]) == {"question": "How?"}
+        assert read_jsonl_row(f, offsets[0]) == {"question": "Qué?"}
+    assert list(iter_jsonl(path, offset=offsets[1])) == [{"question": "Why?"}, {"question": "How?"}]
+
+
+def test_blank_lines(tmp_path):
+    path = tmp_path / "qa.jsonl"
+    path.write_text('{"question": "Q1"}\n\n{"question": "Q2"}', encoding="utf-8")
+    assert read_jsonl(path) == [{"question": "Q1"}, {"question": "Q2"}]
+    assert count_jsonl_rows(path) == 2
+    assert count_jsonl_rows(path, limit=1) == 1
+    assert count_jsonl_rows(path, limit=5) == 2
+
+
+def test_nan_rows(tmp_path):
+    # json.dumps writes NaN for metrics whose score couldn't be parsed, which the fast decoders reject
+    path = write_jsonl(tmp_path / "eval_results.jsonl", [{"gpt_groundedness": float("nan")}, {"gpt_groundedness": 5}])
+    rows = read_jsonl(path)
+    assert math.isnan(rows[0]["gpt_groundedness"])
+    assert rows[1] == {"gpt_groundedness": 5}
+    with open(path, "rb") as f:
+        assert math.isnan(read_jsonl_row(f, 0)["gpt_groundedness"])
+
+
+def test_nan_rows_with_fast_decoder(tmp_path, monkeypatch):
+    orjson = pytest.importorskip("orjson")
+    monkeypatch.setattr(jsonl, "_fast_loads", orjson.loads)
+    monkeypatch.setattr(jsonl, "_FAST_DECODE_ERRORS", (orjson.JSONDecodeError,))
+    test_nan_rows(tmp_path)
+
+
+def test_invalid_row_with_fast_decoder(tmp_path, monkeypatch):
+    orjson = pytest.importorskip("orjson")
+    monkeypatch.setattr(jsonl, "_fast_loads", orjson.loads)
+    monkeypatch.setattr(jsonl, "_FAST_DECODE_ERRORS", (orjson.JSONDecodeError,))
+    path = tmp_path / "eval_results.jsonl"
+    path.write_text("this line is not JSON\n", encoding="utf-8")
+    # Rows that aren't JSON at all still raise the standard library's error, which callers handle
+    with pytest.raises(json.JSONDecodeError):
+        read_jsonl(path)
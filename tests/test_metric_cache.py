@@ -0,0 +1,94 @@
+import math
+
+from evaltools.eval.metric_cache import MetricCache
+
+
+def test_make_key_depends_on_all_inputs():
+    inputs = ["gpt_relevance", "hash", "gpt-4o:eval", "Question?", "Answer", "Context", "Truth"]
+    key = MetricCache.make_key(*inputs)
+    assert key == MetricCache.make_key(*inputs)
+    for ind in range(len(inputs)):
+        changed_inputs = inputs.copy()
+        changed_inputs[ind] += "!"
+        assert MetricCache.make_key(*changed_inputs) != key
+
+
+def test_get_and_set(tmp_path):
+    cache = MetricCache(tmp_path / "metrics.db")
+    assert cache.get("key1") is None
+    cache.set("key1", {"gpt_relevance": 5})
+    assert cache.get("key1") == {"gpt_relevance": 5}
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    cache.close()
+
+    # Results persist across runs
+    cache = MetricCache(tmp_path / "metrics.db")
+    assert cache.get("key1") == {"gpt_relevance": 5}
+    cache.close()
+
+
+def test_get_or_compute(tmp_path):
+    cache = MetricCache(tmp_path / "metrics.db")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"mycoherence": 4.0}
+
+    assert cache.get_or_compute("key1", compute) == {"mycoherence": 4.0}
+    assert cache.get_or_compute("key1", compute) == {"mycoherence": 4.0}
+    assert len(calls) == 1
+    cache.close()
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # Each entry is ~1KB, so only a few fit in the cache
+    cache = MetricCache(tmp_path / "metrics.db", max_size_mb=3 / 1024)
+    for ind in range(3):
+        cache.set(f"key{ind}", {"reason": "x" * 1000})
+    # Use the first entry, so that the second entry is the least recently used
+    assert cache.get("key0") is not None
+    cache.set("key3", {"reason": "x" * 1000})
+    assert cache.get("key1") is None
+    assert cache.get("key0") is not None
+    assert cache.get("key3") is not None
+    cache.close()
+
+
+def test_invalid_results_are_not_cached(tmp_path):
+    cache = MetricCache(tmp_path / "metrics.db")
+    results = iter([{"mygroundedness": float("nan")}, {"gpt_relevance": "Failed"}, {"mygroundedness": 5.0}])
+    assert math.isnan(cache.get_or_compute("key1", lambda: next(results))["mygroundedness"])
+    assert cache.get_or_compute("key2", lambda: next(results)) == {"gpt_relevance": "Failed"}
+    assert cache.get("key1") is None
+    assert cache.get("key2") is None
+    # The failure is retried, and the valid result is cached
+    assert cache.get_or_compute("key1", lambda: next(results)) == {"mygroundedness": 5.0}
+    assert cache.get("key1") == {"mygroundedness": 5.0}
+    cache.close()
+
+
+def test_total_size_is_tracked(tmp_path):
+    cache = MetricCache(tmp_path / "metrics.db")
+    cache.set("key1", {"reason": "x" * 100})
+    cache.set("key1", {"reason": "x" * 10})
+    cache.set("key2", {"reason": "y" * 10})
+    cache.close()
+    cache = MetricCache(tmp_path / "metrics.db")
+    assert cache._total_size == 2 * len('{"reason": "xxxxxxxxxx"}')
+    cache.close()
+
+
+def test_recency_is_written_on_close(tmp_path):
+    cache = MetricCache(tmp_path / "metrics.db", max_size_mb=3 / 1024)
+    for ind in range(3):
+        cache.set(f"key{ind}", {"reason": "x" * 1000})
+    assert cache.get("key0") is not None
+    # The hit isn't committed right away, only with the next set() or when the cache is closed
+    assert cache._pending_last_used
+    cache.close()
+    cache = MetricCache(tmp_path / "metrics.db", max_size_mb=3 / 1024)
+    cache.set("key3", {"reason": "x" * 1000})
+    assert cache.get("key1") is None
+    assert cache.get("key0") is not None
+    cache.close()
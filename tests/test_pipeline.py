@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from evaltools.eval.pipeline import _gather_or_cancel, run_pipeline
+
+
+class InFlightCounter:
+    def __init__(self):
+        self.current = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        with self.lock:
+            self.current += 1
+            self.max = max(self.max, self.current)
+
+    def __exit__(self, *args):
+        with self.lock:
+            self.current -= 1
+
+
+class GPTMetricA:
+    METRIC_NAME = "metric_a"
+    REQUIRES_GPT = True
+
+
+class GPTMetricB:
+    METRIC_NAME = "metric_b"
+    REQUIRES_GPT = True
+
+
+class CodeMetric:
+    METRIC_NAME = "metric_code"
+    REQUIRES_GPT = False
+
+
+def test_run_pipeline_limits_each_stage():
+    target_calls = InFlightCounter()
+    judge_calls = InFlightCounter()
+    results = {}
+
+    def fetch_target_response(row):
+        with target_calls:
+            time.sleep(0.01)
+            return {"question": row["question"], "answer": row["question"].upper()}
+
+    def evaluate_metric(metric, row, output):
+        if metric.REQUIRES_GPT:
+            with judge_calls:
+                time.sleep(0.01)
+        return {metric.METRIC_NAME: len(output["answer"])}
+
+    rows = [(ind, {"question": f"question {ind}"}) for ind in range(30)]
+    run_pipeline(
+        iter(rows),
+        total=len(rows),
+        fetch_target_response=fetch_target_response,
+        metrics=[GPTMetricA, GPTMetricB, CodeMetric],
+        evaluate_metric=evaluate_metric,
+        record_result=results.__setitem__,
+        target_concurrency=2,
+        judge_concurrency=5,
+        queue_size=4,
+    )
+    assert sorted(results) == list(range(30))
+    assert results[7] == {
+        "question": "question 7",
+        "answer": "QUESTION 7",
+        "metric_a": 10,
+        "metric_b": 10,
+        "metric_code": 10,
+    }
+    assert target_calls.max == 2
+    # More than one row is judged at a time, but never more than the judge concurrency
+    assert 2 < judge_calls.max <= 5
+
+
+def test_run_pipeline_raises_errors():
+    def fetch_target_response(row):
+        return {"answer": row["question"]}
+
+    def evaluate_metric(metric, row, output):
+        if output["answer"] == "question 3":
+            raise ValueError("Evaluator failed")
+        return {metric.METRIC_NAME: 1}
+
+    rows = [(ind, {"question": f"question {ind}"}) for ind in range(10)]
+    with pytest.raises(ValueError):
+        run_pipeline(
+            rows,
+            total=len(rows),
+            fetch_target_response=fetch_target_response,
+            metrics=[GPTMetricA],
+            evaluate_metric=evaluate_metric,
+            record_result=lambda index, output: None,
+            target_concurrency=2,
+            judge_concurrency=2,
+        )
+
+
+def test_gather_or_cancel_cancels_siblings():
+    cancelled = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("Worker failed")
+
+    async def wait_forever():
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def run():
+        with pytest.raises(ValueError):
+            await _gather_or_cancel(fail(), wait_forever(), wait_forever())
+        # The other workers are stopped before the error is raised, not when the event loop closes
+        assert cancelled == [True, True]
+        assert await _gather_or_cancel(asyncio.sleep(0, result=1), asyncio.sleep(0, result=2)) == [1, 2]
+
+    asyncio.run(run())
+
+
+def test_run_pipeline_runs_code_metrics_off_the_event_loop():
+    threads = []
+
+    def evaluate_metric(metric, row, output):
+        threads.append(threading.current_thread())
+        return {metric.METRIC_NAME: 1}
+
+    rows = [(ind, {"question": f"question {ind}"}) for ind in range(3)]
+    run_pipeline(
+        rows,
+        total=len(rows),
+        fetch_target_response=lambda row: {"answer": row["question"]},
+        metrics=[CodeMetric],
+        evaluate_metric=evaluate_metric,
+        record_result=lambda index, output: None,
+    )
+    assert len(threads) == 3
+    assert threading.main_thread() not in threads
@@ -0,0 +1,131 @@
+import httpx
+import openai
+import pytest
+
+from evaltools.eval.rate_limit import (
+    RateLimiter,
+    TokenBucket,
+    get_retry_after,
+    get_throttled_headers,
+    parse_duration,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class MockResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_parse_duration():
+    assert parse_duration("20") == 20
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("200ms") == 0.2
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("soon") is None
+
+
+def test_get_retry_after():
+    assert get_retry_after({"Retry-After": "3"}) == 3
+    assert get_retry_after({"retry-after-ms": "250", "retry-after": "1"}) == 0.25
+    assert get_retry_after({}) is None
+    assert get_retry_after(None) is None
+
+
+def test_token_bucket_wait_time():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)
+    assert bucket.wait_time(60) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1) == pytest.approx(1)
+    clock.now = 30
+    assert bucket.wait_time(30) == 0
+    # Requests bigger than the whole budget only wait for a full bucket
+    assert bucket.wait_time(1000) == pytest.approx(30)
+
+
+def test_rate_limiter_retries_429_response():
+    responses = [MockResponse(429, {"Retry-After": "0"}), MockResponse(429, {"Retry-After": "0"}), MockResponse(200)]
+    limiter = RateLimiter("target", max_concurrency=8)
+    result = limiter.call(lambda: responses.pop(0))
+    assert result.status_code == 200
+    assert limiter.stats == {"requests": 3, "throttled": 2, "retries": 2}
+    # Two multiplicative decreases followed by one additive increase
+    assert limiter.concurrency_limit == pytest.approx(2.5)
+
+
+def test_rate_limiter_returns_last_response_after_max_retries():
+    limiter = RateLimiter("target", max_retries=1)
+    result = limiter.call(lambda: MockResponse(429, {"Retry-After": "0"}))
+    assert result.status_code == 429
+    assert limiter.stats["requests"] == 2
+
+
+def test_rate_limiter_retries_wrapped_rate_limit_error():
+    http_response = httpx.Response(
+        429, headers={"retry-after-ms": "0"}, request=httpx.Request("POST", "http://example.com")
+    )
+    calls = []
+
+    def judge_call():
+        calls.append(1)
+        if len(calls) == 1:
+            # Simulates the way that promptflow wraps the OpenAI SDK error
+            try:
+                raise openai.RateLimitError("Rate limit reached", response=http_response, body=None)
+            except openai.RateLimitError as e:
+                raise RuntimeError("Evaluator failed") from e
+        return {"gpt_relevance": 5}
+
+    limiter = RateLimiter("judge")
+    assert limiter.call(judge_call) == {"gpt_relevance": 5}
+    assert limiter.stats["throttled"] == 1
+
+
+def test_rate_limiter_does_not_retry_other_errors():
+    limiter = RateLimiter("judge")
+
+    def judge_call():
+        raise ValueError("Bad request")
+
+    with pytest.raises(ValueError):
+        limiter.call(judge_call)
+    assert limiter.stats == {"requests": 1, "throttled": 0, "retries": 0}
+    assert limiter.in_flight == 0
+
+
+class StatusError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def test_get_throttled_headers_checks_status_code_first():
+    # The status code decides, even when the message mentions a rate limit
+    assert get_throttled_headers(StatusError("Error 500 while checking the rate limit", 500)) == (False, None)
+    assert get_throttled_headers(StatusError("Too many requests", 429)) == (True, None)
+    try:
+        try:
+            raise StatusError("Bad request: the value 429 is too large", 400)
+        except StatusError as e:
+            raise RuntimeError("Evaluator failed") from e
+    except RuntimeError as e:
+        assert get_throttled_headers(e) == (False, None)
+    # Without a status code, the message is all there is to go on
+    assert get_throttled_headers(RuntimeError("429 Too Many Requests")) == (True, None)
+
+
+def test_rate_limiter_respects_remaining_requests_header():
+    clock = FakeClock()
+    limiter = RateLimiter("judge", requests_per_minute=600, clock=clock)
+    limiter.on_success({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+    assert limiter.request_bucket.available == 0
+    assert limiter.paused_until == 2
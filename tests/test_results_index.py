@@ -0,0 +1,65 @@
+import json
+import os
+import shutil
+
+from evaltools.review.results_index import ResultsIndex
+from evaltools.review.utils import summarize_results
+
+
+def write_run(results_dir, folder, mean_rating, answer_length, mtime=None):
+    run_dir = results_dir / folder
+    run_dir.mkdir(parents=True, exist_ok=True)
+    summary = {
+        "gpt_relevance": {"pass_count": 1, "pass_rate": mean_rating / 5, "mean_rating": mean_rating},
+        "answer_length": {"mean": answer_length, "max": answer_length, "min": answer_length},
+        "num_questions": {"total": 2},
+    }
+    with open(run_dir / "summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    with open(run_dir / "evaluate_parameters.json", "w", encoding="utf-8") as f:
+        json.dump({"evaluation_gpt_model": "gpt-4"}, f)
+    with open(run_dir / "eval_results.jsonl", "w", encoding="utf-8") as f:
+        f.write('{"question": "Question 1"}\n{"question": "Question 2"}\n')
+    if mtime:
+        for path in [run_dir, *run_dir.iterdir()]:
+            os.utime(path, (mtime, mtime))
+
+
+def test_results_index_only_reads_changed_runs(tmp_path):
+    write_run(tmp_path, "run1", 4.0, 500, mtime=1_000_000)
+    write_run(tmp_path, "run2", 4.5, 700, mtime=1_000_000)
+    index = ResultsIndex(tmp_path)
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+    index.close()
+
+    # The index is kept in the results folder, so a new summary only reads the runs that changed
+    write_run(tmp_path, "run1", 3.0, 500, mtime=2_000_000)
+    shutil.rmtree(tmp_path / "run2")
+    (tmp_path / "run3").mkdir()  # A run that hasn't finished yet
+    index = ResultsIndex(tmp_path)
+    assert index.refresh() == 1
+    assert [(folder, summary["gpt_relevance"]["mean_rating"]) for folder, summary, _, _ in index.query()] == [
+        ("run1", 3.0)
+    ]
+    index.close()
+
+
+def test_results_index_filter_and_sort(tmp_path):
+    write_run(tmp_path, "run1", 4.0, 500)
+    write_run(tmp_path, "run2", 4.5, 700)
+    write_run(tmp_path, "run3", 3.5, 900)
+    index = ResultsIndex(tmp_path)
+    index.refresh()
+    assert [run[0] for run in index.query(sort_by="gpt_relevance", descending=True)] == ["run2", "run1", "run3"]
+    assert [run[0] for run in index.query(sort_by="answer_length.mean")] == ["run1", "run2", "run3"]
+    assert [run[0] for run in index.query(filters=["gpt_relevance.pass_rate>=0.8", "answer_length<800"])] == [
+        "run1",
+        "run2",
+    ]
+    index.close()
+
+    rows, row_parameters = summarize_results(tmp_path, sort_by="gpt_relevance.mean_rating")
+    assert [row[0] for row in rows[2:]] == ["run3", "run1", "run2"]
+    assert all(row[-1] == 2 for row in rows[2:])
+    assert row_parameters["run1"] == {"evaluation_gpt_model": "gpt-4"}
@@ -0,0 +1,192 @@
+import asyncio
+import io
+import json
+
+from textual.widgets import Markdown, Static
+
+from evaltools.review import compare, diff_markdown, row_store
+from evaltools.review.diff_app import DiffApp
+from evaltools.review.row_store import RowStore
+from evaltools.review.utils import diff_directories
+
+
+def write_results(results_dir, rows):
+    results_dir.mkdir()
+    with open(results_dir / "eval_results.jsonl", "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+    return results_dir
+
+
+def make_rows(num_rows, answer="Answer"):
+    return [
+        {"question": f"Question {ind}", "truth": f"Truth {ind}", "answer": f"{answer} {ind}", "answer_length": ind}
+        for ind in range(num_rows)
+    ]
+
+
+def test_row_store_reads_rows_on_demand(tmp_path):
+    results_dir = write_results(tmp_path / "results", make_rows(50))
+    with open(results_dir / "eval_results.jsonl", "a", encoding="utf-8") as f:
+        f.write("\n")
+    store = RowStore(results_dir / "eval_results.jsonl", cache_size=4)
+    assert store.get(10)["question"] == "Question 10"
+    # Only the rows up to the requested one have been scanned so far
+    assert len(store._offsets) == 11
+    assert store.get(3)["question"] == "Question 3"
+    assert store.get(50) is None
+    assert len(store) == 50
+    store.prefetch(20, 4)
+    assert sorted(store._cache) == [20, 21, 22, 23]
+    assert store.find("Question 42", hint=42)["answer"] == "Answer 42"
+    assert store.find("Question 42", hint=0)["answer"] == "Answer 42"
+    assert store.find("Unknown question") is None
+    store.close()
+
+
+def test_row_store_question_index(tmp_path):
+    results_dir = write_results(tmp_path / "results", list(reversed(make_rows(50))))
+    store = RowStore(results_dir / "eval_results.jsonl")
+    # Without the index, only the hinted position is checked
+    assert store.find("Question 3", hint=3, build_index=False) is None
+    assert not store.has_question_index
+    store.index_questions()
+    assert store.find("Question 3", hint=3, build_index=False)["answer"] == "Answer 3"
+    store.close()
+
+
+def test_row_store_scans_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(row_store, "SCAN_CHUNK_ROWS", 4)
+    results_dir = write_results(tmp_path / "results", make_rows(10))
+    store = RowStore(results_dir / "eval_results.jsonl")
+    # Each chunk releases the lock, so a row can be read while the rest of the file is scanned
+    assert not store._scan_chunk(None)
+    assert len(store._offsets) == 4
+    assert store.get(1)["question"] == "Question 1"
+    assert len(store) == 10
+    store.close()
+
+
+def test_diff_app_navigation(tmp_path):
+    first_dir = write_results(tmp_path / "first", make_rows(5))
+    # The second run has its rows in a different order
+    second_dir = write_results(tmp_path / "second", list(reversed(make_rows(5, answer="Other answer"))))
+
+    async def run():
+        app = DiffApp([first_dir, second_dir])
+        async with app.run_test() as pilot:
+            await app.workers.wait_for_complete([worker for worker in app.workers if worker.group == "index"])
+            await pilot.pause()
+            assert str(app.query_one("#question", Static).render()) == "Question 0"
+            await pilot.press("right", "right")
+            assert str(app.query_one("#question", Static).render()) == "Question 2"
+            assert app.query_one("#answer1", Markdown).source == "Other answer 2"
+            await pilot.press("left")
+            assert app.result_index == 1
+            await pilot.press("g", "5", "enter")
+            assert app.result_index == 4
+            # Paging past the last question stays on it
+            await pilot.press("right")
+            assert app.result_index == 4
+            await pilot.pause()
+            assert str(app.query_one("#position", Static).render()) == "Question 5 of 5"
+
+    asyncio.run(run())
+
+
+def test_diff_markdown_sort_by_delta(tmp_path):
+    first_dir = write_results(tmp_path / "first", make_rows(6))
+    second_rows = make_rows(6, answer="Other answer")
+    for ind, row in enumerate(second_rows):
+        row["answer_length"] = ind * ind
+    second_dir = write_results(tmp_path / "second", list(reversed(second_rows)))
+
+    markdown = diff_markdown.main([first_dir, second_dir])
+    assert [line for line in markdown.splitlines() if line.startswith("**")] == [
+        f"**Question {ind}**" for ind in range(6)
+    ]
+    assert "<tr><th>answer_length</th><td>3 </td><td>9 ⬆️</td><td>N/A</td></tr>" in markdown
+
+    output_path = tmp_path / "diff.md"
+    with open(output_path, "w", encoding="utf-8") as output:
+        diff_markdown.write_markdown(
+            [first_dir, second_dir], output, changed="answer_length", limit=2, sort_by_delta="answer_length"
+        )
+    with open(output_path, encoding="utf-8") as f:
+        assert [line for line in f if line.startswith("**")] == ["**Question 5**\n", "**Question 4**\n"]
+
+
+def test_compare_runs(tmp_path):
+    directories = []
+    for run_ind, ratings in enumerate([[5, 5, 4, 3], [5, 2, 4, 3], [5, 4, "Failed", 1]]):
+        rows = [
+            # Questions are matched regardless of case and whitespace
+            {"question": f"  question {ind}" if run_ind == 2 else f"Question {ind}", "gpt_relevance": rating}
+            for ind, rating in enumerate(ratings)
+        ]
+        directories.append(write_results(tmp_path / f"run{run_ind}", rows))
+
+    comparison = compare.build_comparison(directories)
+    assert list(comparison["gpt_relevance"].columns) == ["run0", "run1", "run2"]
+    assert list(comparison["question"]) == [f"Question {ind}" for ind in range(4)]
+
+    ranked = compare.rank_questions(comparison, "gpt_relevance", rank_by="regression")
+    assert list(ranked["question"]) == ["Question 1", "Question 3", "Question 0", "Question 2"]
+    assert list(ranked["regression"]) == [3.0, 2.0, 0.0, 0.0]
+    ranked = compare.rank_questions(comparison, "gpt_relevance", rank_by="variance", limit=1)
+    assert list(ranked["question"]) == ["Question 1"]
+    assert "| Question 1 | 5.0 | 2.0 | 4.0 | 1.56 |" in compare.to_markdown(ranked)
+
+
+def test_diff_directories_changed_across_runs(tmp_path):
+    directories = [
+        write_results(tmp_path / f"run{run_ind}", [{"question": f"Question {ind}", "answer_length": length}])
+        for run_ind, length in enumerate([10, 10, 12])
+        for ind in [0]
+    ]
+    assert list(diff_directories(directories, changed="answer_length")[0]) == ["Question 0"]
+    assert list(diff_directories(directories[:2], changed="answer_length")[0]) == []
+
+
+def test_diff_directories_changed_strings(tmp_path):
+    first_dir = write_results(tmp_path / "first", make_rows(3))
+    second_rows = make_rows(3)
+    second_rows[1]["answer"] = "Other answer 1"
+    second_dir = write_results(tmp_path / "second", second_rows)
+    assert list(diff_directories([first_dir, second_dir], changed="answer")[0]) == ["Question 1"]
+
+
+def test_diff_directories_changed_context(tmp_path):
+    first_rows, second_rows = make_rows(2), make_rows(2)
+    for row in first_rows + second_rows:
+        row["context"] = "Same context"
+    second_rows[0]["context"] = "Other context"
+    first_dir = write_results(tmp_path / "first", first_rows)
+    second_dir = write_results(tmp_path / "second", second_rows)
+    assert list(diff_directories([first_dir, second_dir], changed="context")[0]) == ["Question 0"]
+
+
+def test_diff_markdown_changed_matches_diff_directories(tmp_path):
+    first_rows, second_rows = make_rows(4), make_rows(4)
+    first_rows[1]["gpt_relevance"], second_rows[1]["gpt_relevance"] = 0.3, 0.1 + 0.2
+    first_rows[2]["gpt_relevance"], second_rows[2]["gpt_relevance"] = 4.0, float("nan")
+    first_rows[3]["gpt_relevance"], second_rows[3]["gpt_relevance"] = 2.0, 5.0
+    first_dir = write_results(tmp_path / "first", first_rows)
+    second_dir = write_results(tmp_path / "second", second_rows)
+
+    # Rounding differences don't count as changes, in the markdown as in diff_directories
+    changed = list(diff_directories([first_dir, second_dir], changed="gpt_relevance")[0])
+    assert changed == ["Question 2", "Question 3"]
+    markdown = diff_markdown.main([first_dir, second_dir], changed="gpt_relevance")
+    assert [line for line in markdown.splitlines() if line.startswith("**")] == ["**Question 2**", "**Question 3**"]
+
+    output = io.StringIO()
+    diff_markdown.write_markdown([first_dir, second_dir], output, sort_by_delta="gpt_relevance")
+    # The NaN delta isn't ranked
+    assert [line for line in output.getvalue().splitlines() if line.startswith("**")] == [
+        "**Question 3**",
+        "**Question 1**",
+    ]
+    output = io.StringIO()
+    diff_markdown.write_markdown([first_dir, second_dir], output, limit=0, sort_by_delta="gpt_relevance")
+    assert output.getvalue() == ""
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from evaltools.eval.sequential import SequentialTest, get_spent_alpha
+
+
+def test_get_spent_alpha():
+    assert get_spent_alpha(0.05, 0) == 0
+    assert get_spent_alpha(0.05, 1) == pytest.approx(0.05)
+    # Early looks can only spend a tiny fraction of alpha
+    assert get_spent_alpha(0.05, 0.1) < 0.0001
+    assert get_spent_alpha(0.05, 0.25) < get_spent_alpha(0.05, 0.5) < get_spent_alpha(0.05, 0.75)
+
+
+def make_test(num_questions, metrics=("gpt_groundedness",), **kwargs):
+    baseline_rows = {f"question {ind}": {metric: 4 for metric in metrics} for ind in range(num_questions)}
+    return SequentialTest(baseline_rows, list(metrics), num_questions, **kwargs)
+
+
+def test_sequential_test_stops_when_worse():
+    rng = random.Random(0)
+    sequential = make_test(1000, min_questions=20)
+    num_added = 0
+    while not sequential.check():
+        for _ in range(50):
+            sequential.add({"question": f"Question {num_added}", "gpt_groundedness": rng.choice([2, 3, 3, 4])})
+            num_added += 1
+    assert num_added < 1000
+    assert sequential.decision["metric"] == "gpt_groundedness"
+    assert sequential.decision["direction"] == "worse"
+
+
+def test_sequential_test_keeps_going_without_difference():
+    rng = random.Random(0)
+    sequential = make_test(1000, min_questions=20)
+    for ind in range(1000):
+        sequential.add({"question": f"question {ind}", "gpt_groundedness": rng.choice([3, 4, 5])})
+        if ind % 100 == 99:
+            assert not sequential.check()
+    assert sequential.decision is None
+    # The alpha for every metric adds up to at most the overall alpha
+    assert sum(look["alpha"] for look in sequential.looks) <= 0.05 + 1e-9
+
+
+def test_sequential_test_waits_for_min_questions():
+    sequential = make_test(100, min_questions=30)
+    for ind in range(20):
+        sequential.add({"question": f"question {ind}", "gpt_groundedness": 1})
+    assert not sequential.check()
+    assert sequential.looks == []
+
+
+def test_sequential_test_lower_is_better():
+    sequential = make_test(100, metrics=["latency"], min_questions=10)
+    for ind in range(100):
+        sequential.add({"question": f"question {ind}", "latency": 2 + (ind % 3) / 10})
+    assert sequential.check()
+    assert sequential.decision["direction"] == "better"
+
+
+def test_sequential_test_ignores_unpaired_and_invalid_values():
+    sequential = make_test(10, min_questions=1)
+    sequential.add({"question": "not in the baseline", "gpt_groundedness": 1})
+    sequential.add({"question": "question 1", "gpt_groundedness": "Failed"})
+    assert sequential.num_paired == 1
+    assert sequential.deltas["gpt_groundedness"] == []
+
+
+def test_sequential_test_identical_differences():
+    sequential = make_test(100, min_questions=30)
+    for ind in range(50):
+        sequential.add({"question": f"question {ind}", "gpt_groundedness": 1})
+    # Every question is 3 worse, so there's no variance, but the sign test shows it's no accident
+    assert sequential.check()
+    assert sequential.decision["direction"] == "worse"
+    assert sequential.decision["p_value"] == pytest.approx(2 * 0.5**50, abs=1e-6)
+
+
+def test_sequential_test_identical_booleans():
+    baseline_rows = {f"question {ind}": {"citation_match": True} for ind in range(100)}
+    sequential = SequentialTest(baseline_rows, ["citation_match"], 100, min_questions=30)
+    for ind in range(50):
+        sequential.add({"question": f"question {ind}", "citation_match": False})
+    assert sequential.check()
+    assert sequential.decision["direction"] == "worse"
+
+
+def test_sequential_test_no_differences():
+    sequential = make_test(100, min_questions=10)
+    for ind in range(100):
+        sequential.add({"question": f"question {ind}", "gpt_groundedness": 4})
+    assert not sequential.check()
+    assert sequential.looks[0]["metrics"]["gpt_groundedness"]["p_value"] == 1.0